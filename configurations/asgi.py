@@ -2,6 +2,8 @@
 ASGI config for P2P_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The order status stream (WebSocket /ws/p2p/orders/ and SSE /api/p2p/orders/stream/)
+is served in front of Django, every other request goes to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,30 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'configurations.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once Django is set up
+from p2p_trading.controllers.p2p_order_stream_controller import OrderStreamRouter  # noqa: E402
+
+application = OrderStreamRouter(django_application)
+
+# build the public order book when the worker starts, if it fails it is built on the first request
+try:
+    from p2p_trading.engines.p2p_order_book_engine import ORDER_BOOK
+    ORDER_BOOK.warm()
+except Exception as e:
+    print(f"Order book warm up skipped: {str(e)}")
+
+# in-process expiry sweeper of the serving workers, off unless an interval is configured (use
+# `manage.py expire_orders` otherwise), the commands and shells that load the app never start it
+from django.conf import settings  # noqa: E402
+
+if settings.P2P_EXPIRY_SWEEP_INTERVAL:
+    from p2p_trading.engines.p2p_expiry_sweeper import EXPIRY_SWEEPER
+    EXPIRY_SWEEPER.start(settings.P2P_EXPIRY_SWEEP_INTERVAL, settings.P2P_EXPIRY_SWEEP_CHUNK)
+
+# in-process outbox relay of the serving workers, off unless an interval is configured (use
+# `manage.py relay_outbox` otherwise)
+if settings.P2P_OUTBOX_RELAY_INTERVAL:
+    from p2p_trading.engines.p2p_outbox_relay import OUTBOX_RELAY
+    OUTBOX_RELAY.start(settings.P2P_OUTBOX_RELAY_INTERVAL, settings.P2P_OUTBOX_BATCH)
@@ -4,6 +4,7 @@ import os
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
 
 # 1. Path Configuration and Environment Variables (.env)
 #==============================================================================
@@ -218,4 +219,68 @@ USE_TZ = True
 
 # 10. إعدادات أخرى
 # ==============================================================================
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# 11. Cache
+# ==============================================================================
+# the order book versions, the order counters, the block sets and the payment method details are shared
+# between the worker processes through this cache, every process must read the same one:
+# 'redis' (P2P_CACHE_LOCATION is the redis url, needs the redis package), 'database' (the p2p_cache table
+# of the default database, create it with `manage.py createcachetable`, a cache read is a query) or
+# 'locmem' (kept in the process, one worker only)
+P2P_CACHE_BACKEND = os.environ.get('P2P_CACHE_BACKEND', 'locmem')
+P2P_CACHE_LOCATION = os.environ.get('P2P_CACHE_LOCATION', '')
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', ''),
+    'database': ('django.core.cache.backends.db.DatabaseCache', 'p2p_cache'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/0'),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[P2P_CACHE_BACKEND][0],
+        'LOCATION': P2P_CACHE_LOCATION or CACHE_BACKENDS[P2P_CACHE_BACKEND][1],
+    }
+}
+# worker processes serving the app (the WEB_CONCURRENCY that gunicorn reads too), with more than one the
+# per-process LocMemCache would give every worker its own order counters and book versions
+P2P_WORKERS = int(os.environ.get('WEB_CONCURRENCY', '1'))
+if P2P_WORKERS > 1 and P2P_CACHE_BACKEND == 'locmem':
+    raise ImproperlyConfigured(
+        f"{P2P_WORKERS} workers need a shared cache, set P2P_CACHE_BACKEND to 'redis' or 'database'"
+    )
+
+
+# 12. P2P engines
+# ==============================================================================
+# reference price feed of the floating offers (dotted path of a ReferencePriceFeed class)
+P2P_PRICE_FEED = os.environ.get('P2P_PRICE_FEED', 'p2p_trading.engines.p2p_price_engine.FilePriceFeed')
+# json file read by the FilePriceFeed, the bundled fixture when empty
+P2P_PRICE_FEED_FILE = os.environ.get('P2P_PRICE_FEED_FILE', '')
+# seconds an index price is cached in the worker process
+P2P_PRICE_TTL = int(os.environ.get('P2P_PRICE_TTL', '30'))
+# seconds between two passes of the in-process expiry sweeper of the UNPAID orders, 0 disables the thread
+P2P_EXPIRY_SWEEP_INTERVAL = int(os.environ.get('P2P_EXPIRY_SWEEP_INTERVAL', '0'))
+# expired orders cancelled per transaction
+P2P_EXPIRY_SWEEP_CHUNK = int(os.environ.get('P2P_EXPIRY_SWEEP_CHUNK', '500'))
+# worker id (0-1023) of the order number allocator, one per process creating orders;
+# empty claims a free id in the p2p_order_worker table
+P2P_ORDER_WORKER_ID = os.environ.get('P2P_ORDER_WORKER_ID', '')
+# order intake: 'lock' (offer and wallet rows locked with SELECT FOR UPDATE) or 'conditional'
+# (lock-free conditional UPDATE ... RETURNING of the offer amount and of the wallet escrow)
+P2P_ORDER_RESERVATION = os.environ.get('P2P_ORDER_RESERVATION', 'lock')
+# seconds between two passes of the in-process outbox relay, 0 disables the thread
+P2P_OUTBOX_RELAY_INTERVAL = int(os.environ.get('P2P_OUTBOX_RELAY_INTERVAL', '0'))
+# outbox events delivered to a consumer per transaction
+P2P_OUTBOX_BATCH = int(os.environ.get('P2P_OUTBOX_BATCH', '200'))
+# fan-out of the order status stream between the nodes: InProcessBackend (one node) or
+# PostgresNotifyBackend (LISTEN/NOTIFY on the default database, several nodes)
+P2P_ORDER_STREAM_BACKEND = os.environ.get(
+    'P2P_ORDER_STREAM_BACKEND', 'p2p_trading.engines.p2p_order_stream.InProcessBackend'
+)
+# messages kept for a slow stream client, the oldest are dropped first
+P2P_ORDER_STREAM_QUEUE = int(os.environ.get('P2P_ORDER_STREAM_QUEUE', '100'))
+# seconds between two keepalive comments on an idle SSE stream
+P2P_ORDER_STREAM_KEEPALIVE = int(os.environ.get('P2P_ORDER_STREAM_KEEPALIVE', '25'))
+# seconds the per-status order counters of a user are cached, every order change updates them in place
+P2P_ORDER_COUNTERS_TTL = int(os.environ.get('P2P_ORDER_COUNTERS_TTL', '300'))
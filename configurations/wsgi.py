@@ -14,3 +14,24 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'configurations.settings')
 
 application = get_wsgi_application()
+
+# build the public order book when the worker starts, if it fails it is built on the first request
+try:
+    from p2p_trading.engines.p2p_order_book_engine import ORDER_BOOK
+    ORDER_BOOK.warm()
+except Exception as e:
+    print(f"Order book warm up skipped: {str(e)}")
+
+# in-process expiry sweeper of the serving workers, off unless an interval is configured (use
+# `manage.py expire_orders` otherwise), the commands and shells that load the app never start it
+from django.conf import settings  # noqa: E402
+
+if settings.P2P_EXPIRY_SWEEP_INTERVAL:
+    from p2p_trading.engines.p2p_expiry_sweeper import EXPIRY_SWEEPER
+    EXPIRY_SWEEPER.start(settings.P2P_EXPIRY_SWEEP_INTERVAL, settings.P2P_EXPIRY_SWEEP_CHUNK)
+
+# in-process outbox relay of the serving workers, off unless an interval is configured (use
+# `manage.py relay_outbox` otherwise)
+if settings.P2P_OUTBOX_RELAY_INTERVAL:
+    from p2p_trading.engines.p2p_outbox_relay import OUTBOX_RELAY
+    OUTBOX_RELAY.start(settings.P2P_OUTBOX_RELAY_INTERVAL, settings.P2P_OUTBOX_BATCH)
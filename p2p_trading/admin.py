@@ -26,6 +26,11 @@ from .models.p2p_order_model import P2POrder
 from .models.p2p_profile_models import P2PProfile, Feedback,Follow, BlockedUser
 from .models.p2p_wallet_model import Wallet
 from .models.p2p_transaction_model import Transaction
+from .models.p2p_escrow_audit_model import EscrowDrift
+from .engines.p2p_order_book_engine import ORDER_BOOK
+from .engines.p2p_block_cache import BLOCK_CACHE
+from .repositories.p2p_offer_repository import P2POfferRepository
+from .services.p2p_provisioning_service import ProvisioningService
 
 
 from django import forms
@@ -439,31 +444,23 @@ if MAIN_USER_AVAILABLE:
             # If it's a new user, create P2P profile and wallets
             if is_new:
                 try:
-                    # Create P2P Profile
-                    p2p_profile, created = P2PProfile.objects.get_or_create(
-                        user_id=obj.id,
-                        defaults={'nickname': f"{obj.username}_p2p"}
+                    # P2P Profile and a USDT wallet with its opening balance, through the provisioning service
+                    result = ProvisioningService.provision_users(
+                        [(obj.id, obj.username)], currencies=['USDT'], opening_balance=5000
                     )
 
-                    if created:
+                    if result['profiles']:
                         messages.success(
                             request,
                             f'✅ P2P Profile created automatically for {obj.username}'
                         )
-
-                    # Create basic wallets
-                    currencies = ['USDT']
-                    wallets_created = 0
-
-                    for currency in currencies:
-                        wallet, wallet_created = Wallet.objects.get_or_create(
-                            user_id=obj.id,
-                            currency=currency,
-                            defaults={'balance': 5000, 'locked_balance': 0}
+                    if result['skipped']:
+                        messages.warning(
+                            request,
+                            f'⚠️ Nickname {obj.username}_p2p is taken, no P2P Profile created'
                         )
-                        if wallet_created:
-                            wallets_created += 1
 
+                    wallets_created = result['wallets']
                     if wallets_created:
                         messages.success(
                             request,
@@ -584,18 +581,8 @@ if MAIN_USER_AVAILABLE:
 
         def create_basic_wallets_for_users(self, request, queryset):
             """Create basic wallets for selected users"""
-            currencies = ['BTC', 'USDT', 'ETH']  # يمكنك تعديل هذه القائمة
-            created_count = 0
-
-            for user in queryset:
-                for currency in currencies:
-                    wallet, created = Wallet.objects.get_or_create(
-                        user_id=user.id,
-                        currency=currency,
-                        defaults={'balance': 0, 'locked_balance': 0}
-                    )
-                    if created:
-                        created_count += 1
+            # BASIC_WALLET_CURRENCIES, the missing ones inserted in bulk
+            created_count = ProvisioningService.provision_wallets(queryset.values_list('id', flat=True).iterator())
 
             self.message_user(request, f'{created_count} wallets created.')
 
@@ -603,33 +590,17 @@ if MAIN_USER_AVAILABLE:
 
         def create_complete_p2p_setup(self, request, queryset):
             """Create complete P2P setup (profile + wallets) for selected users"""
-            currencies = ['BTC', 'USDT', 'ETH']
-            profiles_created = 0
-            wallets_created = 0
             errors = []
-
-            for user in queryset:
-                try:
-                    # Create P2P Profile if doesn't exist
-                    profile, profile_created = P2PProfile.objects.get_or_create(
-                        user_id=user.id,
-                        defaults={'nickname': f"{user.username}_p2p"}
-                    )
-                    if profile_created:
-                        profiles_created += 1
-
-                    # Create wallets
-                    for currency in currencies:
-                        wallet, wallet_created = Wallet.objects.get_or_create(
-                            user_id=user.id,
-                            currency=currency,
-                            defaults={'balance': 0, 'locked_balance': 0}
-                        )
-                        if wallet_created:
-                            wallets_created += 1
-
-                except Exception as e:
-                    errors.append(f"Error setting up {user.username}: {str(e)}")
+            try:
+                # profiles and BASIC_WALLET_CURRENCIES wallets of the missing ones, in bulk
+                result = ProvisioningService.provision_users(queryset.values_list('id', 'username').iterator())
+            except Exception as e:
+                result = {'profiles': 0, 'wallets': 0, 'skipped': []}
+                errors.append(f"Error setting up the users: {str(e)}")
+            profiles_created, wallets_created = result['profiles'], result['wallets']
+            errors.extend(
+                f"Nickname of user #{user_id} is taken, no P2P profile created" for user_id in result['skipped']
+            )
 
             success_msg = f'Complete setup: {profiles_created} profiles + {wallets_created} wallets created.'
             self.message_user(request, success_msg)
@@ -659,7 +630,9 @@ if MAIN_USER_AVAILABLE:
                     # Delete P2P data
                     P2PProfile.objects.filter(user_id=user.id).delete()
                     Wallet.objects.filter(user_id=user.id).delete()
-                    P2POffer.objects.filter(user_id=user.id).delete()
+                    offers = P2POffer.objects.filter(user_id=user.id)
+                    ORDER_BOOK.reload_offers(offers.values_list('id', flat=True))
+                    offers.delete()
 
 
                     # Finally delete user
@@ -674,7 +647,10 @@ if MAIN_USER_AVAILABLE:
             updated = queryset.update(is_active=False)
             # Also deactivate their offers
             user_ids = list(queryset.values_list('id', flat=True))
-            P2POffer.objects.filter(user_id__in=user_ids).update(status='INACTIVE')
+            offers = P2POffer.objects.filter(user_id__in=user_ids)
+            offer_ids = list(offers.values_list('id', flat=True))
+            offers.update(status='INACTIVE')
+            ORDER_BOOK.reload_offers(offer_ids)
 
             self.message_user(request, f'🚫 {updated} users deactivated')
         deactivate_users.short_description = '🚫 Deactivate users (safer than delete)'
@@ -791,18 +767,31 @@ class P2POfferAdmin(admin.ModelAdmin):
         )
     status_badge.short_description = 'Status'
 
+    def save_model(self, request, obj, form, change):
+        """keep the payment methods and the public order book in sync with edits from the admin form"""
+        super().save_model(request, obj, form, change)
+        if not change or 'payment_method_ids' in form.changed_data:
+            P2POfferRepository.set_payment_methods(obj, obj.payment_method_ids)
+        ORDER_BOOK.sync_on_commit(obj)
+
     def activate_offers(self, request, queryset):
+        offer_ids = list(queryset.values_list('id', flat=True))
         updated = queryset.update(status='ACTIVE')
+        ORDER_BOOK.reload_offers(offer_ids)
         self.message_user(request, f'{updated} offers activated.')
     activate_offers.short_description = 'Activate selected offers'
 
     def deactivate_offers(self, request, queryset):
+        offer_ids = list(queryset.values_list('id', flat=True))
         updated = queryset.update(status='INACTIVE')
+        ORDER_BOOK.reload_offers(offer_ids)
         self.message_user(request, f'{updated} offers deactivated.')
     deactivate_offers.short_description = 'Deactivate selected offers'
 
     def soft_delete_offers(self, request, queryset):
+        offer_ids = list(queryset.values_list('id', flat=True))
         updated = queryset.update(is_deleted=True, deleted_at=timezone.now())
+        ORDER_BOOK.reload_offers(offer_ids)
         self.message_user(request, f'{updated} offers soft deleted.')
     soft_delete_offers.short_description = 'Soft delete selected offers'
 
@@ -919,18 +908,7 @@ class P2PProfileAdmin(admin.ModelAdmin):
 
     def create_wallets_for_profiles(self, request, queryset):
         """Create wallets for selected P2P profiles"""
-        currencies = ['BTC', 'USDT', 'ETH']
-        created_count = 0
-
-        for profile in queryset:
-            for currency in currencies:
-                wallet, created = Wallet.objects.get_or_create(
-                    user_id=profile.user_id,
-                    currency=currency,
-                    defaults={'balance': 0, 'locked_balance': 0}
-                )
-                if created:
-                    created_count += 1
+        created_count = ProvisioningService.provision_wallets(queryset.values_list('user_id', flat=True).iterator())
 
         self.message_user(request, f'{created_count} wallets created for selected profiles.')
     create_wallets_for_profiles.short_description = 'Create wallets for selected profiles'
@@ -1010,21 +988,9 @@ class WalletAdmin(admin.ModelAdmin):
 
     def create_missing_wallets(self, request, queryset):
         """Create missing wallets for users who have some but not all currencies"""
-        currencies = ['BTC', 'USDT', 'ETH']
-        created_count = 0
-
         # Get unique user_ids from selected wallets
-        user_ids = set(queryset.values_list('user_id', flat=True))
-
-        for user_id in user_ids:
-            for currency in currencies:
-                wallet, created = Wallet.objects.get_or_create(
-                    user_id=user_id,
-                    currency=currency,
-                    defaults={'balance': 0, 'locked_balance': 0}
-                )
-                if created:
-                    created_count += 1
+        user_ids = queryset.order_by('user_id').values_list('user_id', flat=True).distinct()
+        created_count = ProvisioningService.provision_wallets(user_ids.iterator())
 
         self.message_user(request, f'{created_count} missing wallets created.')
     create_missing_wallets.short_description = 'Create missing wallets for selected users'
@@ -1069,6 +1035,27 @@ class TransactionAdmin(admin.ModelAdmin):
     amount_display.short_description = 'Amount'
 
 
+# ================== ESCROW DRIFT ADMIN ==================
+@admin.register(EscrowDrift)
+class EscrowDriftAdmin(admin.ModelAdmin):
+    """audit trail of the escrow checker, written by check_escrow only"""
+    list_display = [
+        'id', 'check_run', 'user_id', 'currency', 'actual', 'expected', 'repair_entry', 'error', 'created_at'
+    ]
+    list_filter = ['currency', 'created_at']
+    search_fields = ['user_id']
+    date_hierarchy = 'created_at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 # ================== FEEDBACK ADMIN ==================
 @admin.register(Feedback)
 class FeedbackAdmin(admin.ModelAdmin):
@@ -1223,7 +1210,12 @@ class BlockedUserAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         """Override save to remove follows when blocking"""
+        # an edit can move the block to other users, their cached block sets change too
+        previous = BlockedUser.objects.filter(pk=obj.pk).values_list(
+            'blocker__user_id', 'blocked__user_id'
+        ).first() if change else ()
         super().save_model(request, obj, form, change)
+        BLOCK_CACHE.refresh(obj.blocker.user_id, obj.blocked.user_id, *(previous or ()))
 
         # Remove any existing follow relationships
         Follow.objects.filter(
@@ -1235,6 +1227,18 @@ class BlockedUserAdmin(admin.ModelAdmin):
             request,
             f'Blocked relationship created and any follow relationships removed.'
         )
+
+    def delete_model(self, request, obj):
+        user_ids = (obj.blocker.user_id, obj.blocked.user_id)
+        super().delete_model(request, obj)
+        BLOCK_CACHE.refresh(*user_ids)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = {
+            user_id for pair in queryset.values_list('blocker__user_id', 'blocked__user_id') for user_id in pair
+        }
+        super().delete_queryset(request, queryset)
+        BLOCK_CACHE.refresh(*user_ids)
 # ================== CUSTOM ADMIN SITE CONFIG ==================
 admin.site.site_header = 'P2P Trading Administration'
 admin.site.site_title = 'P2P Admin'
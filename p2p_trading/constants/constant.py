@@ -37,6 +37,12 @@ class TransactionType(models.TextChoices):
     TRADE_FEE = 'TRADE_FEE', 'Trade Fee'  # trade fees
 
 
+class LedgerAccount(models.TextChoices):
+    BALANCE = 'BALANCE', 'Balance'  # wallet balance
+    LOCKED = 'LOCKED', 'Locked'  # wallet locked_balance, the escrow
+    EXTERNAL = 'EXTERNAL', 'External'  # outside the p2p wallets (main wallet, opening balances)
+
+
 STATUS_MAP = {
     'UNPAID': {'text': 'Unpaid', 'class': 'warning'},
     'PAID': {'text': 'Paid', 'class': 'info'},
@@ -50,6 +56,9 @@ STATUS_MAP = {
 PROCESSING_STATUSES = ['UNPAID', 'PAID', 'APPEAL']
 COMPLETED_STATUSES = ['COMPLETED', 'CANCELLED']
 
+# wallets every p2p user gets
+BASIC_WALLET_CURRENCIES = ['BTC', 'USDT', 'ETH']
+
 
 
 
@@ -7,18 +7,17 @@ from rest_framework.decorators import action
 from ..services.p2p_offer_service import P2POfferService
 from ..serializers.p2p_offer_serilaizer import (
     P2POfferCreateSerializer,
-    P2POfferListSerializer,
-    P2POfferDetailSerializer,
     OfferStatusUpdateSerializer,
-    P2POfferPublicSerializer
 )
+from ..serializers.p2p_offer_fast_serializer import FAST_LIST_SERIALIZER, FAST_DETAIL_SERIALIZER
 
 from ..decorator.swagger_decorator import swagger_serializer_mapping
 # ================ HELPER MACROS ================
 from ..helpers import (
     success_response,
     handle_exception,
-    extract_filters
+    extract_filters,
+    get_page_size,
 )
 
 
@@ -69,20 +68,17 @@ class P2POfferController(viewsets.ViewSet):
         # apply filters from the frontend url
         filters = extract_filters(request.query_params,
                                   ['status', 'type', 'asset_type', 'start_date', 'end_date'])
-        # get the offers according to those filters
-        offers = self.service.get_user_offers(user_id=request.user.id, filters=filters)
+        # get the offers according to those filters, as rows of the fields the list renders
+        offers = list(self.service.get_user_offers(user_id=request.user.id, filters=filters)
+                      .values(*FAST_LIST_SERIALIZER.sources))
 
         # get payment method details
         payment_details_map = self.service.get_payment_methods_for_offers(offers)
 
-        # Serialize
-        serializer = P2POfferListSerializer(
-            offers, many=True,
-            context={'payment_details_map': payment_details_map, 'request': request}
-        )
+        # Serialize (compiled P2POfferListSerializer)
+        data = FAST_LIST_SERIALIZER.render_many(offers, {'payment_details_map': payment_details_map})
         #add the count of the offers of the user
-        count = offers.count() if hasattr(offers, 'count') else len(offers)
-        return success_response(data=serializer.data, count=count)
+        return success_response(data=data, count=len(offers))
 
     @handle_exception
     def retrieve(self, request, pk=None):
@@ -92,8 +88,7 @@ class P2POfferController(viewsets.ViewSet):
             GET: /api/p2p/offers/{order_id}
         """
         offer = self.service.get_offer_detail(user_id=request.user.id, offer_id=pk)
-        serializer = P2POfferDetailSerializer(offer)
-        return success_response(serializer.data)
+        return success_response(FAST_DETAIL_SERIALIZER.render(offer))
 
     @handle_exception
     def update(self, request, pk=None):
@@ -119,10 +114,9 @@ class P2POfferController(viewsets.ViewSet):
         payment_details_map = self.service.get_payment_methods_for_single_offer(offer)
 
         # use the list serializer to show the details of updated offer
-        response_serializer = P2POfferListSerializer(
-            offer, context={'payment_details_map': payment_details_map}
+        return success_response(
+            FAST_LIST_SERIALIZER.render(offer, {'payment_details_map': payment_details_map})
         )
-        return success_response(response_serializer.data)
 
 
     @handle_exception
@@ -143,16 +137,23 @@ class P2POfferController(viewsets.ViewSet):
             GET: /api/p2p/offers//public_offers/
             GET: /api/p2p/offers//public_offers/?trade_type='BUY'
             GET: /api/p2p/offers//public_offers/?trade_type='BUY'&fiat_currency='EGP'
+            GET: /api/p2p/offers//public_offers/?trade_type='BUY'&payment_type='InstaPay'
+            GET: /api/p2p/offers//public_offers/?trade_type='BUY'&page_size=20&cursor={next_cursor}
             etc
         """
         # apply filters from the front end
         filters = extract_filters(request.query_params,
-                                  ['trade_type', 'crypto_currency', 'fiat_currency', 'payment_method'])
+                                  ['trade_type', 'crypto_currency', 'fiat_currency', 'payment_method',
+                                   'payment_type'])
 
-        offers = self.service.get_public_offers(filters=filters)
-        serializer = P2POfferPublicSerializer(offers, many=True)
+        # rendered page, served from the response cache while its pairs did not change,
+        # signed in viewers only see the offers they can take
+        feed = self.service.get_public_feed(filters=filters,
+                                            cursor=request.query_params.get('cursor'),
+                                            page_size=get_page_size(request.query_params),
+                                            viewer_id=request.user.id if request.user.is_authenticated else None)
 
-        return success_response(data=serializer.data, count=len(serializer.data))
+        return success_response(data=feed['data'], count=feed['count'], next_cursor=feed['next_cursor'])
 
 
 
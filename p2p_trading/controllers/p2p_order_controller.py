@@ -21,6 +21,7 @@ from ..helpers import (
     handle_exception,
     GET_CONTEXT,
     ORDER_RESPONSE,
+    get_page_size,
 )
 
 
@@ -37,7 +38,12 @@ class P2POrderController(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     service = P2POrderService()
 
-
+    def list_context(self, orders):
+        """serializer context with the nicknames of the counterparties of the page resolved in one batch"""
+        return {
+            **GET_CONTEXT(self),
+            'counterparty_names': self.service.get_counterparty_names(orders, self.request.user.id)
+        }
 
     @handle_exception
     def create(self, request):
@@ -64,17 +70,17 @@ class P2POrderController(viewsets.ViewSet):
                 GET /api/p2p/orders/?coin=BTC
                 GET /api/p2p/orders/?order_type=buy
                 GET /api/p2p/orders/?currency=USD
+                GET /api/p2p/orders/?cursor=<next_cursor>&page_size=50
                 etc
         """
-        #get the processing orders + historical data +filters from the url
-        all_orders = list(self.service.get_processing_orders(request.user.id, request.query_params)) + \
-                     list(self.service.get_historical_orders(request.user.id, request.query_params))
-
-        # order according ti date desce.
-        all_orders.sort(key=lambda x: x.created_at, reverse=True)
+        #get the processing + historical orders newest first, one page (?cursor=&page_size=) at a time
+        history = self.service.get_order_history(request.user.id, request.query_params,
+                                                 cursor=request.query_params.get('cursor'),
+                                                 page_size=get_page_size(request.query_params))
 
-        serializer = P2POrderListSerializer(all_orders, many=True, context=GET_CONTEXT(self))
-        return success_response(serializer.data, count=len(all_orders))
+        serializer = P2POrderListSerializer(history['orders'], many=True,
+                                            context=self.list_context(history['orders']))
+        return success_response(serializer.data, count=history['count'], next_cursor=history['next_cursor'])
 
     @handle_exception
     def retrieve(self, request, pk=None):
@@ -83,7 +89,7 @@ class P2POrderController(viewsets.ViewSet):
         API format:
             GET /api/p2p/orders/{id}/"""
         order = self.service.get_order_detail(request.user.id, pk)
-        serializer = P2POrderListSerializer(order, context=GET_CONTEXT(self))
+        serializer = P2POrderListSerializer(order, context=self.list_context([order]))
         return success_response(serializer.data)
 
 
@@ -98,9 +104,9 @@ class P2POrderController(viewsets.ViewSet):
             GET /api/p2p/orders/processing/?coin=BTC
             etc
                 """
-        orders = self.service.get_processing_orders(request.user.id, request.query_params)
-        serializer = P2POrderListSerializer(orders, many=True, context=GET_CONTEXT(self))
-        return success_response(serializer.data, count=orders.count() if hasattr(orders, 'count') else len(orders))
+        orders = list(self.service.get_processing_orders(request.user.id, request.query_params))
+        serializer = P2POrderListSerializer(orders, many=True, context=self.list_context(orders))
+        return success_response(serializer.data, count=len(orders))
 
     @action(detail=False, methods=['get'])
     @handle_exception
@@ -114,10 +120,22 @@ class P2POrderController(viewsets.ViewSet):
                   GET /api/p2p/orders/records/?coin=BTC
                   etc
     """
-        orders = self.service.get_historical_orders(request.user.id, request.query_params)
-        serializer = P2POrderListSerializer(orders, many=True, context=GET_CONTEXT(self))
-        return success_response(serializer.data, count=orders.count() if hasattr(orders, 'count') else len(orders))
+        orders = list(self.service.get_historical_orders(request.user.id, request.query_params))
+        serializer = P2POrderListSerializer(orders, many=True, context=self.list_context(orders))
+        return success_response(serializer.data, count=len(orders))
+
 
+    @action(detail=False, methods=['get'])
+    @handle_exception
+    def counters(self, request):
+        """
+        number of orders of the user in each status (the badges), cached and kept up to date on every change
+
+        API format:
+            GET /api/p2p/orders/counters/
+            {"statuses": {"UNPAID": 1, "PAID": 0, ...}, "processing": 1, "completed": 4, "total": 5}
+        """
+        return success_response(self.service.get_order_counters(request.user.id))
 
     @action(detail=True, methods=['post'], url_path='mark-as-paid')
     @handle_exception
@@ -126,9 +144,10 @@ class P2POrderController(viewsets.ViewSet):
         regard the fiat, the buyer should mark as paid
         API format:
             POST /api/p2p/orders/mark-as-paid/
+            {"version": 3}    optional, refused when the order changed since that version
         """
         print(f"Mark as paid - Order ID: {pk}, User ID: {request.user.id}")  # debugging
-        order = self.service.mark_order_as_paid(request.user.id, pk)
+        order = self.service.mark_order_as_paid(request.user.id, pk, request.data.get('version'))
         return success_response(
             ORDER_RESPONSE(order, f"Order {order.order_number} marked as paid."),
             status_code=status.HTTP_200_OK
@@ -141,8 +160,9 @@ class P2POrderController(viewsets.ViewSet):
         regard the fiat, the seller should confirm receiving the payment
         API format:
             POST /api/p2p/orders/{order_id}/confirm-payment/
+            {"version": 3}    optional, refused when the order changed since that version
             """
-        order = self.service.confirm_payment_received(request.user.id, pk)
+        order = self.service.confirm_payment_received(request.user.id, pk, request.data.get('version'))
         return success_response(
             ORDER_RESPONSE(order, "Order completed and funds released."),
             status_code=status.HTTP_200_OK
@@ -156,9 +176,10 @@ class P2POrderController(viewsets.ViewSet):
         Api format:
 
             POST /api/p2p/orders/{id}/cancel/
+            {"version": 3}    optional, refused when the order changed since that version
 
             """
-        order = self.service.cancel_order(request.user.id, pk)
+        order = self.service.cancel_order(request.user.id, pk, request.data.get('version'))
         return success_response(
             ORDER_RESPONSE(order, "Order cancelled successfully."),
             status_code=status.HTTP_200_OK
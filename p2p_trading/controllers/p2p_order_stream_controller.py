@@ -0,0 +1,168 @@
+# p2p_trading/controllers/p2p_order_stream_controller.py
+"""ASGI endpoints pushing the status changes of the orders of the user, they replace the polling of
+/api/p2p/orders/processing/. served by configurations/asgi.py in front of Django (not under WSGI):
+
+    WebSocket   ws://<host>/ws/p2p/orders/?token=<access token>
+    SSE         GET /api/p2p/orders/stream/      Authorization: Bearer <access token>  (or ?token=)
+
+every message is one json object:
+    {"type": "order.status", "order_id": 12, "order_number": "...", "status": "PAID", "version": 1,
+     "updated_at": "..."}
+
+a connection holds no database connection and no thread, the access token is checked once when it
+opens. a client that sees a gap in the version of an order reloads that order.
+"""
+
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from ..engines.p2p_order_stream import ORDER_STREAM
+
+WEBSOCKET_PATH = '/ws/p2p/orders/'
+EVENTS_PATH = '/api/p2p/orders/stream/'
+# websocket close code of a refused token (4000-4999 are free for the applications)
+UNAUTHORIZED_CLOSE_CODE = 4401
+DEFAULT_KEEPALIVE = 25
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+SSE_EVENT = lambda message: f"event: {message['type']}\ndata: {json.dumps(message)}\n\n".encode()
+WEBSOCKET_TEXT = lambda message: {'type': 'websocket.send', 'text': json.dumps(message)}
+
+
+def stream_user_id(scope):
+    """id of the user of the access token in the query string (?token=) or the Authorization header, None
+    when there is none or it is not valid, nothing is read from the database"""
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    if token is None:
+        header = dict(scope.get('headers', [])).get(b'authorization', b'').decode().split()
+        if len(header) == 2 and header[0] in api_settings.AUTH_HEADER_TYPES:
+            token = header[1]
+    if not token:
+        return None
+    try:
+        return JWTAuthentication().get_validated_token(token)[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        return None
+
+
+async def wait_disconnect(receive):
+    """read the client messages (ignored) until it goes away"""
+    while True:
+        message = await receive()
+        if message['type'] in ('websocket.disconnect', 'http.disconnect'):
+            return
+
+
+"""*************************************************************************************************************
+/*	function name:		    pump
+* 	function inputs:	    ASGI receive, subscription, async write(message), keepalive seconds and async ping()
+* 	function outputs:	    n/a, returns when the client disconnects
+* 	function description:	forward the messages of the subscription to the connection, an idle connection costs
+                            two pending futures on the event loop. ping() is written after keepalive seconds
+                            without a message (SSE comments keep the proxies from closing the stream)
+*   call back:              wait_disconnect()
+*/
+*************************************************************************************************************"""
+async def pump(receive, subscription, write, keepalive=None, ping=None):
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        while True:
+            next_message = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {disconnected, next_message}, timeout=keepalive, return_when=asyncio.FIRST_COMPLETED
+            )
+            if next_message in done:
+                await write(next_message.result())
+            else:
+                next_message.cancel()
+                if disconnected in done:
+                    return
+                await ping()
+            if disconnected.done():
+                return
+    finally:
+        disconnected.cancel()
+
+
+async def order_stream_websocket(scope, receive, send):
+    """websocket of the order status changes of the user"""
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    user_id = stream_user_id(scope)
+    if user_id is None:
+        await send({'type': 'websocket.close', 'code': UNAUTHORIZED_CLOSE_CODE})
+        return
+
+    await send({'type': 'websocket.accept'})
+    subscription = ORDER_STREAM.subscribe(user_id)
+    try:
+        await send(WEBSOCKET_TEXT({'type': 'subscribed', 'user_id': user_id}))
+        await pump(receive, subscription, lambda message: send(WEBSOCKET_TEXT(message)))
+    finally:
+        ORDER_STREAM.unsubscribe(subscription)
+
+
+async def order_stream_events(scope, receive, send):
+    """server-sent events of the order status changes of the user"""
+    user_id = stream_user_id(scope)
+    if user_id is None:
+        await send({'type': 'http.response.start', 'status': 401,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body',
+                    'body': json.dumps({'success': False, 'error': 'Authentication required.'}).encode()})
+        return
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+    subscription = ORDER_STREAM.subscribe(user_id)
+    body = lambda data: send({'type': 'http.response.body', 'body': data, 'more_body': True})
+    try:
+        await body(SSE_EVENT({'type': 'subscribed', 'user_id': user_id}))
+        await pump(
+            receive, subscription, lambda message: body(SSE_EVENT(message)),
+            keepalive=getattr(settings, 'P2P_ORDER_STREAM_KEEPALIVE', DEFAULT_KEEPALIVE),
+            ping=lambda: body(b': keepalive\n\n'),
+        )
+    finally:
+        ORDER_STREAM.unsubscribe(subscription)
+
+
+# ================ ASGI ROUTER ================
+class OrderStreamRouter:
+    """ASGI application in front of Django, the stream endpoints are served here and everything else by
+    Django, which handles http only (the lifespan events are answered here too)"""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            if scope['path'] == WEBSOCKET_PATH:
+                return await order_stream_websocket(scope, receive, send)
+            await receive()
+            return await send({'type': 'websocket.close', 'code': 1000})
+        if scope['type'] == 'http' and scope['path'] == EVENTS_PATH and scope['method'] == 'GET':
+            return await order_stream_events(scope, receive, send)
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        return await self.application(scope, receive, send)
+
+    @staticmethod
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                ORDER_STREAM.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,53 @@
+# p2p_trading/engines/p2p_block_cache.py
+"""cached block sets of the users
+
+for every user the cache keeps one set with the user ids on the other side of a block, the users
+it blocked and the users that blocked it (both directions hide the offers in the feed).
+a set is loaded with one query the first time it is asked, then block/unblock (repository and
+admin) reload the sets of the two users once the transaction commits.
+
+a set can be stale, until the commit of a block or in another worker without a shared cache, so
+the order intake does not use it: validate_counterparty checks the block in the database.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from ..models.p2p_profile_models import BlockedUser
+
+BLOCK_SET_KEY = lambda user_id: f"p2p_blocks_{user_id}"
+# seconds a set is kept in the shared cache, every block change reloads it anyway
+BLOCK_SET_TTL = 60 * 60 * 24
+
+
+# ================ CACHE CLASS ================
+class BlockCache:
+    """blocked and blocked-by user ids of each user"""
+
+    def get(self, user_id):
+        """frozenset of the user ids this user must not see or trade with"""
+        blocked = cache.get(BLOCK_SET_KEY(user_id))
+        if blocked is None:
+            blocked = self._load(user_id)
+            # add and not set: a set loaded before a block committed must not replace the one refresh() wrote
+            cache.add(BLOCK_SET_KEY(user_id), blocked, BLOCK_SET_TTL)
+        return blocked
+
+    def refresh(self, *user_ids):
+        """reload the sets of these users after the block change commits"""
+        def apply():
+            cache.set_many({BLOCK_SET_KEY(user_id): self._load(user_id) for user_id in user_ids}, BLOCK_SET_TTL)
+
+        transaction.on_commit(apply)
+
+    @staticmethod
+    def _load(user_id):
+        rows = BlockedUser.objects.filter(
+            Q(blocker__user_id=user_id) | Q(blocked__user_id=user_id)
+        ).values_list('blocker__user_id', 'blocked__user_id')
+        return frozenset(blocked if blocker == user_id else blocker for blocker, blocked in rows)
+
+
+# one cache object per worker process
+BLOCK_CACHE = BlockCache()
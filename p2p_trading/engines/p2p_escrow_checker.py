@@ -0,0 +1,114 @@
+# p2p_trading/engines/p2p_escrow_checker.py
+"""check that the locked_balance of every wallet is the crypto of the open orders of its seller
+
+    locked_balance of (seller, currency) == SUM(crypto_amount) of its UNPAID / PAID / APPEAL orders
+
+a full run diffs the wallets against one GROUP BY of the open orders (P2PEscrowRepository.get_drifts), an
+incremental run only the (seller, currency) pairs touched since the last finished run: wallets updated and
+sellers of orders updated since its resume_from. each run is an EscrowCheck row and each drifted wallet an
+EscrowDrift row, the audit trail. with repair, every drift is fixed in its own transaction:
+
+    lock the wallet, diff it again (the orders may have moved since the run read them)
+    post the difference as one journal entry (WalletService.repair_escrow): a locked_balance above its
+    orders goes back to the balance, a short one is locked from the balance when it covers it
+    write the EscrowDrift row with the entry, or with the error when the repair was refused
+
+run it with `python manage.py check_escrow`.
+"""
+
+import threading
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from ..repositories.p2p_escrow_repository import P2PEscrowRepository
+from ..services.p2p_wallet_service import WalletService
+
+
+# ================ CHECKER CLASS ================
+class EscrowChecker:
+    """set-based escrow invariant check with an optional repair, with the metrics of the worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # totals since the process started
+        self.metrics = {'runs': 0, 'drifts': 0, 'repaired': 0, 'seconds': 0.0, 'last_run': None}
+
+    """*************************************************************************************************************
+    /*	function name:		    run
+    * 	function inputs:	    incremental (only the pairs touched since the last run), repair
+    * 	function outputs:	    dict of the run: check id, mode, drifts (rows of get_drifts), repaired, seconds
+    * 	function description:	an incremental run without a finished run before it is a full one. the resume
+                                point of the next run is read before the tables, so a change committed while
+                                this run reads them is looked at again
+    *   call back:              get_resume_from(), get_drifts(), repair(), add_drift(), finish_check()
+    */
+    *************************************************************************************************************"""
+    def run(self, incremental=False, repair=False):
+        start = time.perf_counter()
+        last = P2PEscrowRepository.get_last_finished_check() if incremental else None
+        mode, since = ('incremental', last.resume_from) if last else ('full', None)
+        check = P2PEscrowRepository.create_check(mode, since, P2PEscrowRepository.get_resume_from())
+
+        drifts = P2PEscrowRepository.get_drifts(mode, since)
+        repaired = 0
+        for drift in drifts:
+            if repair:
+                repaired += self.repair(check, drift)
+            else:
+                P2PEscrowRepository.add_drift(check, drift)
+        P2PEscrowRepository.finish_check(check, len(drifts), repaired, timezone.now())
+
+        elapsed = time.perf_counter() - start
+        result = {
+            'check_id': check.id, 'mode': mode, 'since': since, 'drifts': drifts, 'repaired': repaired,
+            'seconds': elapsed,
+        }
+        with self._lock:
+            self.metrics['runs'] += 1
+            self.metrics['drifts'] += len(drifts)
+            self.metrics['repaired'] += repaired
+            self.metrics['seconds'] += elapsed
+            self.metrics['last_run'] = {key: value for key, value in result.items() if key != 'drifts'}
+        return result
+
+    """*************************************************************************************************************
+    /*	function name:		    repair
+    * 	function inputs:	    the EscrowCheck of the run, drift row of get_drifts
+    * 	function outputs:	    True when the wallet was repaired
+    * 	function description:	one transaction, the wallet locked and diffed again against its open orders
+                                before its difference is posted, the EscrowDrift row is written with the entry
+                                (or the error) in the same transaction
+    *   call back:              lock_wallet(), get_drifts(), WalletService.repair_escrow(), add_drift()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def repair(check, drift):
+        if drift['wallet_id'] is None:
+            P2PEscrowRepository.add_drift(check, drift, error='open orders without a wallet of their coin')
+            return False
+
+        with transaction.atomic():
+            WalletService.repo.lock_wallet(drift['user_id'], drift['currency'])
+            current = P2PEscrowRepository.get_drifts('wallet', user_id=drift['user_id'], currency=drift['currency'])
+            if not current:
+                P2PEscrowRepository.add_drift(check, drift, error='back in line before the repair')
+                return False
+
+            current = current[0]
+            try:
+                with transaction.atomic():
+                    WalletService.repair_escrow(
+                        current['user_id'], current['currency'], current['actual'] - current['expected']
+                    )
+            except ValueError as e:
+                P2PEscrowRepository.add_drift(check, current, error=str(e))
+                return False
+            entry = P2PEscrowRepository.get_last_wallet_entry(current['wallet_id'])
+            P2PEscrowRepository.add_drift(check, current, repair_entry=entry)
+        return True
+
+
+# one checker per worker process
+ESCROW_CHECKER = EscrowChecker()
@@ -0,0 +1,197 @@
+# p2p_trading/engines/p2p_expiry_sweeper.py
+"""cancel the UNPAID orders whose payment deadline passed
+
+an expired order keeps its crypto reserved twice, in the offer available_amount and in the seller
+locked_balance, until someone cancels it. the sweeper frees both in chunks:
+
+    one transaction per chunk:
+        lock up to chunk_size expired orders (partial deadline index, SKIP LOCKED)
+        lock their offers in id order
+        unlock the seller wallets with one journal statement (WalletService)
+        cancel them with one update
+        give the amounts back to the offers with one update
+        one insert of the order.cancelled outbox events, the order counters moved and the new status pushed
+        to both sides after the commit
+
+when the wallets refuse the chunk (an escrow short of its order), every order is unlocked in a savepoint
+of its own: the refused ones stay UNPAID, are left out of the rest of the pass and reported in its
+metrics (check_escrow finds and repairs their wallets), the others of the chunk are cancelled.
+
+the locks are taken in the order of the intake and of cancel_order, the order rows, then the offers, then
+the seller wallets: a sweep holding a seller wallet while it waits on an offer that an intake holds while
+it waits on that wallet would deadlock.
+
+SKIP LOCKED makes concurrent sweepers (several nodes, or the command next to the scheduler thread)
+take disjoint chunks. run it with `python manage.py expire_orders` (once or --loop), or in-process
+with EXPIRY_SWEEPER.start(interval) which the serving entry points (wsgi.py, asgi.py) start when
+P2P_EXPIRY_SWEEP_INTERVAL is set.
+"""
+
+import threading
+import time
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from ..constants.constant import OrderStatus
+from ..engines.p2p_order_counters import ORDER_COUNTERS
+from ..engines.p2p_order_stream import ORDER_STREAM
+from ..repositories.p2p_offer_repository import P2POfferRepository
+from ..repositories.p2p_order_repository import P2POrderRepository
+from ..repositories.p2p_outbox_repository import P2POutboxRepository
+from ..services.p2p_wallet_service import WalletService
+
+DEFAULT_CHUNK_SIZE = 500
+# payload of the order.cancelled event of an expired order, from the locked row values
+EXPIRED_EVENT = lambda order: {
+    'id': order['id'], 'offer_id': order['offer_id'], 'status': OrderStatus.CANCELLED, 'reason': 'expired',
+    'seller_id': order['seller_id'], 'crypto_currency': order['crypto_currency'],
+    'crypto_amount': order['crypto_amount'],
+}
+# the order stream message of an expired order, cancel_orders() bumped its version
+EXPIRED_STATUS_MESSAGE = lambda order, now: {
+    'type': 'order.status', 'order_id': order['id'], 'order_number': order['order_number'],
+    'status': OrderStatus.CANCELLED, 'version': order['version'] + 1, 'updated_at': now,
+}
+
+
+# ================ SWEEPER CLASS ================
+class ExpirySweeper:
+    """chunked cancellation of the expired UNPAID orders, with the metrics of the worker process"""
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # totals since the process started
+        self.metrics = {'passes': 0, 'chunks': 0, 'orders': 0, 'refused': 0, 'seconds': 0.0, 'last_pass': None}
+
+    """*************************************************************************************************************
+    /*	function name:		    sweep_chunk
+    * 	function inputs:	    current time, chunk size, ids of the orders refused earlier in the pass
+    * 	function outputs:	    (number of orders cancelled, ids of the orders whose escrow was refused)
+    * 	function description:	one transaction, lock the chunk of expired orders and free the wallets and the
+                                offers of all of them with set-based statements, the orders the wallets refuse
+                                stay locked and UNPAID until the commit. the offers are locked before the
+                                wallets, like the intake does
+    *   call back:              lock_expired_unpaid(), lock_offers(), unlock_escrow(), cancel_orders(),
+                                restore_available_amounts(), add_events(), move_on_commit(), publish_on_commit()
+    */
+    *************************************************************************************************************"""
+    def sweep_chunk(self, now, chunk_size=DEFAULT_CHUNK_SIZE, refused=()):
+        with transaction.atomic():
+            orders = P2POrderRepository.lock_expired_unpaid(now, chunk_size, refused)
+            if not orders:
+                return 0, []
+            P2POfferRepository.lock_offers({order['offer_id'] for order in orders})
+            orders, refused = self.unlock_escrow(orders)
+            if not orders:
+                return 0, refused
+            P2POrderRepository.cancel_orders([order['id'] for order in orders], now)
+
+            amounts = {}
+            for order in orders:
+                amounts[order['offer_id']] = amounts.get(order['offer_id'], 0) + order['crypto_amount']
+            P2POfferRepository.restore_available_amounts(amounts)
+            P2POutboxRepository.add_events([
+                ('order', order['id'], 'order.cancelled', {**EXPIRED_EVENT(order), 'cancelled_at': now})
+                for order in orders
+            ])
+            ORDER_COUNTERS.move_on_commit([
+                ((order['maker_id'], order['taker_id']), OrderStatus.UNPAID, OrderStatus.CANCELLED) for order in orders
+            ])
+            ORDER_STREAM.publish_on_commit([
+                ((order['maker_id'], order['taker_id']), EXPIRED_STATUS_MESSAGE(order, now)) for order in orders
+            ])
+        return len(orders), refused
+
+    @staticmethod
+    def unlock_escrow(orders):
+        """
+            give the escrow of the orders back to their sellers, all of them in one statement, one savepoint
+            per order when the wallets refuse the batch
+            arg:
+                locked order rows
+            return:
+                (orders unlocked, ids of the orders refused)
+        """
+        try:
+            with transaction.atomic():
+                WalletService.unlock_funds_for_orders(orders)
+            return orders, []
+        except ValueError:
+            pass
+
+        unlocked, refused = [], []
+        for order in orders:
+            try:
+                with transaction.atomic():
+                    WalletService.unlock_funds_for_orders([order])
+                unlocked.append(order)
+            except ValueError as e:
+                print(f"Expiry sweeper error: order {order['id']}: {str(e)}")
+                refused.append(order['id'])
+        return unlocked, refused
+
+    def sweep(self, chunk_size=DEFAULT_CHUNK_SIZE, max_chunks=None):
+        """chunks until no expired order is left (or max_chunks), returns the metrics of the pass"""
+        now = timezone.now()
+        start = time.perf_counter()
+        chunks = orders = 0
+        refused = []
+        while max_chunks is None or chunks < max_chunks:
+            count, chunk_refused = self.sweep_chunk(now, chunk_size, refused)
+            if not count and not chunk_refused:
+                break
+            chunks += 1
+            orders += count
+            refused.extend(chunk_refused)
+            if count + len(chunk_refused) < chunk_size:
+                break
+
+        elapsed = time.perf_counter() - start
+        result = {
+            'chunks': chunks, 'orders': orders, 'refused': refused, 'seconds': elapsed,
+            'orders_per_second': orders / elapsed if elapsed else 0.0,
+        }
+        with self._lock:
+            self.metrics['passes'] += 1
+            self.metrics['chunks'] += chunks
+            self.metrics['orders'] += orders
+            self.metrics['refused'] += len(refused)
+            self.metrics['seconds'] += elapsed
+            self.metrics['last_pass'] = result
+        return result
+
+    # ================ SCHEDULER THREAD ================
+    def start(self, interval, chunk_size=DEFAULT_CHUNK_SIZE):
+        """sweep every interval seconds in a daemon thread of this process"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self._thread
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(interval, chunk_size), name='p2p-expiry-sweeper', daemon=True
+            )
+            self._thread.start()
+            return self._thread
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, interval, chunk_size):
+        while not self._stop.is_set():
+            try:
+                close_old_connections()
+                self.sweep(chunk_size)
+            except Exception as e:
+                # a failed pass is retried on the next tick, the chunk transaction was rolled back
+                print(f"Expiry sweeper error: {str(e)}")
+            self._stop.wait(interval)
+        close_old_connections()
+
+
+# one sweeper per worker process
+EXPIRY_SWEEPER = ExpirySweeper()
@@ -0,0 +1,173 @@
+# p2p_trading/engines/p2p_ledger_reconciler.py
+"""recompute every wallet from its transaction history and report where the wallet rows disagree
+
+the wallets are split in wallet-id ranges, each range is reconciled by one process of a pool:
+
+    one REPEATABLE READ, READ ONLY transaction per range (one snapshot for the wallets and their history)
+        stream the wallets of the range in id order                      (server-side cursor)
+        stream their transactions in (wallet, created_at, id) order       (server-side cursor, history index)
+        merge both streams on the wallet id, per wallet:
+            running_balance of each row = the balance changes up to it            (kind running_balance)
+            balance        = the sum of the balance changes                       (kind balance)
+            locked_balance = the sum of the escrow changes                        (kind locked_balance)
+
+only the current wallet is held in memory, whatever the number of transactions, and the ranges share
+nothing, so the time of a run is the rows divided by the processes. the balance change of a transaction
+is its amount, except RELEASE_ESCROW which moves the seller locked_balance (its amount, or the crypto of
+its order for the rows written with an amount of 0 before the journal). run it with
+`python manage.py reconcile_wallets`.
+"""
+
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.db import connection, connections, transaction
+
+from ..constants.constant import TransactionType
+from ..repositories.p2p_wallet_repository import P2PWalletRepository
+
+DEFAULT_RANGE_SIZE = 100000
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_LIMIT = 1000
+ZERO = Decimal('0')
+# the locked_balance change of the escrow transactions, from (amount, order amount)
+LOCKED_DELTAS = {
+    TransactionType.LOCK_ESCROW: lambda amount, order_amount: -amount,
+    TransactionType.CANCEL_ESCROW: lambda amount, order_amount: -amount,
+    TransactionType.RELEASE_ESCROW: lambda amount, order_amount: amount if amount else -(order_amount or ZERO),
+}
+# one row of the report
+DISCREPANCY = lambda wallet, kind, expected, actual, transaction_id=None: {
+    'wallet_id': wallet[0], 'user_id': wallet[1], 'currency': wallet[2], 'kind': kind,
+    'expected': expected, 'actual': actual, 'transaction_id': transaction_id,
+}
+
+
+"""*************************************************************************************************************
+/*	function name:		    reconcile_range
+* 	function inputs:	    first wallet id, last wallet id (excluded), rows per fetch, max discrepancies kept
+* 	function outputs:	    dict of the counts of the range and its discrepancies
+* 	function description:	module level so the pool can send it to its processes. both streams are read in
+                            one snapshot, a transaction committed during the run is either in the wallet and
+                            its history or in none of them
+*   call back:              stream_wallets(), stream_history(), fold_history(), compare_wallet()
+*/
+*************************************************************************************************************"""
+def reconcile_range(first_id, last_id, chunk_size=DEFAULT_CHUNK_SIZE, limit=DEFAULT_LIMIT):
+    result = {'wallets': 0, 'transactions': 0, 'discrepancies': [], 'found': 0}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+
+        history = P2PWalletRepository.stream_history(first_id, last_id, chunk_size)
+        row = next(history, None)
+        for wallet in P2PWalletRepository.stream_wallets(first_id, last_id, chunk_size):
+            state, rows = {'balance': ZERO, 'locked': ZERO}, []
+            while row is not None and row[1] == wallet[0]:
+                rows.append(row)
+                row = next(history, None)
+                if len(rows) == chunk_size:
+                    # a long history is folded chunk by chunk, the memory stays one chunk
+                    fold_history(wallet, rows, state, result, limit)
+                    rows = []
+            fold_history(wallet, rows, state, result, limit)
+            compare_wallet(wallet, state, result, limit)
+    return result
+
+
+def fold_history(wallet, rows, state, result, limit):
+    """apply the history rows of the wallet to its recomputed state, each running balance is checked against it"""
+    found = []
+    for tx_id, _, tx_type, amount, running_balance, order_amount in rows:
+        state['balance'] += ZERO if tx_type == TransactionType.RELEASE_ESCROW else amount
+        if running_balance != state['balance']:
+            found.append(DISCREPANCY(wallet, 'running_balance', state['balance'], running_balance, tx_id))
+        if tx_type in LOCKED_DELTAS:
+            state['locked'] += LOCKED_DELTAS[tx_type](amount, order_amount)
+    result['transactions'] += len(rows)
+    add_discrepancies(result, found, limit)
+
+
+def compare_wallet(wallet, state, result, limit):
+    """the wallet row against the state recomputed from its whole history"""
+    found = []
+    if wallet[3] != state['balance']:
+        found.append(DISCREPANCY(wallet, 'balance', state['balance'], wallet[3]))
+    if wallet[4] != state['locked']:
+        found.append(DISCREPANCY(wallet, 'locked_balance', state['locked'], wallet[4]))
+    result['wallets'] += 1
+    add_discrepancies(result, found, limit)
+
+
+def add_discrepancies(result, found, limit):
+    """count every discrepancy, keep the first limit ones"""
+    result['found'] += len(found)
+    result['discrepancies'].extend(found[:max(0, limit - len(result['discrepancies']))])
+
+
+# ================ RECONCILER CLASS ================
+class LedgerReconciler:
+    """the wallet-id ranges of a run spread over a process pool, with the metrics of the runs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # totals since the process started
+        self.metrics = {'runs': 0, 'wallets': 0, 'transactions': 0, 'discrepancies': 0, 'seconds': 0.0,
+                        'last_run': None}
+
+    @staticmethod
+    def ranges(range_size=DEFAULT_RANGE_SIZE):
+        """[first, last) wallet-id ranges covering every wallet"""
+        first, last = P2PWalletRepository.get_wallet_id_bounds()
+        if first is None:
+            return []
+        return [(start, min(start + range_size, last + 1)) for start in range(first, last + 1, range_size)]
+
+    """*************************************************************************************************************
+    /*	function name:		    reconcile
+    * 	function inputs:	    number of processes, wallets per range, rows per fetch, max discrepancies reported
+    * 	function outputs:	    dict of the counts of the run, its discrepancies (up to limit) and its speed
+    * 	function description:	reconcile_range() for every range, in this process with one worker, else in a
+                                pool of forked processes (they inherit the settings, the connections of this one
+                                are closed first so that each process opens its own)
+    *   call back:              ranges(), reconcile_range()
+    */
+    *************************************************************************************************************"""
+    def reconcile(self, workers=1, range_size=DEFAULT_RANGE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                  limit=DEFAULT_LIMIT):
+        start = time.perf_counter()
+        ranges = self.ranges(range_size)
+        if workers > 1 and len(ranges) > 1:
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(ranges)), mp_context=multiprocessing.get_context('fork')
+            ) as pool:
+                results = list(pool.map(
+                    reconcile_range, *zip(*ranges), [chunk_size] * len(ranges), [limit] * len(ranges)
+                ))
+        else:
+            results = [reconcile_range(first, last, chunk_size, limit) for first, last in ranges]
+
+        elapsed = time.perf_counter() - start
+        transactions = sum(result['transactions'] for result in results)
+        result = {
+            'ranges': len(ranges), 'wallets': sum(result['wallets'] for result in results),
+            'transactions': transactions, 'found': sum(result['found'] for result in results),
+            'discrepancies': [row for result in results for row in result['discrepancies']][:limit],
+            'seconds': elapsed, 'transactions_per_second': transactions / elapsed if elapsed else 0.0,
+        }
+        with self._lock:
+            self.metrics['runs'] += 1
+            self.metrics['wallets'] += result['wallets']
+            self.metrics['transactions'] += transactions
+            self.metrics['discrepancies'] += result['found']
+            self.metrics['seconds'] += elapsed
+            self.metrics['last_run'] = {key: value for key, value in result.items() if key != 'discrepancies'}
+        return result
+
+
+# one reconciler per process
+LEDGER_RECONCILER = LedgerReconciler()
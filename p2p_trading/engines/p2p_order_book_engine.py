@@ -0,0 +1,419 @@
+# p2p_trading/engines/p2p_order_book_engine.py
+"""in-memory order book that serves the public offers feed
+
+every (crypto_currency, fiat_currency, trade_type) pair has its own book that keeps the
+active offers sorted by (price, id). the book is built once per worker process, then kept
+up to date by the write paths (offer create/update/soft_delete, order create/cancel).
+
+each pair has a version counter in the shared django cache, every write bumps it. a worker
+compares its local version with the shared one before reading a pair and reloads only that
+pair if another process changed it, so the feed does not touch the database while nothing
+changed. the counters need the cache shared by all the workers (P2P_CACHE_BACKEND in the settings),
+the default LocMemCache keeps them per process and is for a single worker only.
+"""
+
+import copy
+import hashlib
+import threading
+from bisect import bisect_left, bisect_right, insort
+from heapq import merge
+from itertools import islice
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+
+from ..constants.constant import OfferStatus, TradeType
+from ..models.p2p_offer_model import P2POffer
+
+# ================ HELPER MACROS ================
+from ..helpers import (
+    BOOK_KEY_FILTERS,
+    BOOK_FILTER_MAPPING,
+    IS_RESTRICTED,
+    CAN_TAKE_OFFER,
+    NOT_BLOCKED,
+    VIEWER_SIGNATURE,
+)
+
+# pair of the book that the offer belongs to
+BOOK_KEY = lambda offer: (offer.crypto_currency, offer.fiat_currency, offer.trade_type)
+# shared cache keys
+BOOK_VERSION_KEY = lambda key: f"p2p_book_v_{'_'.join(key)}"
+BOOK_PAIRS_KEY = 'p2p_book_pairs'
+# filters are free text from the url, hash them to get a safe key
+BOOK_COUNT_KEY = lambda filters: 'p2p_book_count_' + hashlib.md5(
+    '&'.join(f"{k}={v}" for k, v in sorted(filters.items())).encode()
+).hexdigest()
+# seconds the feed count estimate is kept when it needs a scan
+COUNT_TTL = 30
+# same order as the old ORDER BY: -price for BUY, price otherwise
+IS_DESCENDING = lambda trade_type: trade_type == TradeType.BUY
+
+# the only offers that can be shown in the public feed
+IS_PUBLIC = lambda offer: (
+    not offer.is_deleted and offer.status == OfferStatus.ACTIVE and offer.available_amount > 0
+)
+
+
+# ================ BOOK CLASS ================
+class PairBook:
+    """one side of one pair, offers sorted by (price, id)"""
+
+    __slots__ = ('keys', 'entries', 'restricted', 'version')
+
+    def __init__(self, version=0):
+        self.keys = []          # sorted list of (price, id)
+        self.entries = {}       # id -> P2POffer
+        self.restricted = set() # ids of the offers with counterparty restrictions
+        self.version = version
+
+    def upsert(self, offer):
+        """add the offer or move it to its new price"""
+        self.remove(offer.id)
+        insort(self.keys, (offer.price, offer.id))
+        self.entries[offer.id] = offer
+        if IS_RESTRICTED(offer):
+            self.restricted.add(offer.id)
+
+    def remove(self, offer_id):
+        """remove the offer if it exists in the book"""
+        old = self.entries.pop(offer_id, None)
+        if old is not None:
+            index = bisect_left(self.keys, (old.price, old.id))
+            del self.keys[index]
+            self.restricted.discard(offer_id)
+
+    def ordered(self, descending=False, after=None):
+        """offers in the book order, starting right after the (price, id) key if given"""
+        if descending:
+            start = len(self.keys) if after is None else bisect_left(self.keys, after)
+            positions = range(start - 1, -1, -1)
+        else:
+            start = 0 if after is None else bisect_right(self.keys, after)
+            positions = range(start, len(self.keys))
+        # walk by position, the cost depends on the page size not on the depth of the cursor
+        return (self.entries[self.keys[i][1]] for i in positions)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# ================ ENGINE CLASS ================
+class OrderBookEngine:
+    """all the pair books of the worker process"""
+
+    def __init__(self):
+        self._books = {}        # pair key -> PairBook
+        self._where = {}        # offer id -> pair key
+        self._pairs_version = None
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    """*************************************************************************************************************
+    /*	function name:		    warm
+    * 	function inputs:	    force flag
+    * 	function outputs:	    n/a
+    * 	function description:	build all the books from the database in one query, it runs once per worker
+    *   call back:              _load_rows()
+    */
+    *************************************************************************************************************"""
+    def warm(self, force=False):
+        with self._lock:
+            if self._loaded and not force:
+                return
+            self._books, self._where = {}, {}
+            self._pairs_version = cache.get(BOOK_PAIRS_KEY, 0)
+            self._load_rows(P2POffer.objects.filter(self._public_q()))
+            self._loaded = True
+
+    def _load_rows(self, queryset, keys=None):
+        """fill the books from queryset, keys are the pairs being (re)loaded"""
+        versions = cache.get_many([BOOK_VERSION_KEY(key) for key in keys or []])
+        for key in keys or []:
+            self._drop_pair(key)
+            self._books[key] = PairBook(versions.get(BOOK_VERSION_KEY(key), 0))
+
+        # the payment types are kept with the offers, the feed never reads them again
+        for offer in queryset.prefetch_related('payment_methods').iterator(chunk_size=2000):
+            key = BOOK_KEY(offer)
+            if key not in self._books:
+                # version unknown before the query, 0 makes the first read re-check this pair
+                self._books[key] = PairBook()
+            self._books[key].upsert(offer)
+            self._where[offer.id] = key
+
+    def _drop_pair(self, key):
+        book = self._books.pop(key, None)
+        if book:
+            for offer_id in book.entries:
+                self._where.pop(offer_id, None)
+
+    @staticmethod
+    def _public_q(key=None):
+        query = Q(is_deleted=False, status=OfferStatus.ACTIVE, available_amount__gt=0)
+        if key:
+            query &= Q(crypto_currency=key[0], fiat_currency=key[1], trade_type=key[2])
+        return query
+
+    """*************************************************************************************************************
+    /*	function name:		    sync
+    * 	function inputs:	    offer instance after it was saved
+    * 	function outputs:	    n/a
+    * 	function description:	apply one offer change to the local book and bump the pair version in the cache
+    *   call back:              _bump_version()
+    */
+    *************************************************************************************************************"""
+    def sync(self, offer):
+        key = BOOK_KEY(offer)
+        changed = {key}
+        with self._lock:
+            if self._loaded:
+                # the pair of the offer can be changed from the admin
+                old_key = self._where.pop(offer.id, None)
+                if old_key in self._books:
+                    self._books[old_key].remove(offer.id)
+                    changed.add(old_key)
+
+                if IS_PUBLIC(offer):
+                    prefetch_related_objects([offer], 'payment_methods')
+                    self._books.setdefault(key, PairBook()).upsert(copy.copy(offer))
+                    self._where[offer.id] = key
+
+            for pair in changed:
+                self._bump_version(pair)
+
+    def sync_on_commit(self, offer):
+        """apply the change only when the transaction commits, rollbacks keep the book untouched"""
+        transaction.on_commit(lambda: self.sync(offer))
+
+    def reload_offers(self, offer_ids):
+        """re-read offers changed by bulk updates (admin actions) and sync each one"""
+        offer_ids = list(offer_ids)
+
+        def apply():
+            found = {
+                offer.id: offer
+                for offer in P2POffer.objects.filter(id__in=offer_ids).prefetch_related('payment_methods')
+            }
+            for offer_id in offer_ids:
+                if offer_id in found:
+                    self.sync(found[offer_id])
+                else:
+                    self.discard(offer_id)
+
+        transaction.on_commit(apply)
+
+    def reload_pairs(self, keys):
+        """many offers of these pairs changed at once (repricing), reload each pair on its next read"""
+        keys = list(keys)
+
+        def apply():
+            with self._lock:
+                for key in keys:
+                    self._bump_version(key)
+                    if key in self._books:
+                        # no version can match, the next read reloads the pair
+                        self._books[key].version = -1
+
+        transaction.on_commit(apply)
+
+    def discard(self, offer_id):
+        """remove an offer that does not exist anymore (hard deleted)"""
+        with self._lock:
+            key = self._where.pop(offer_id, None)
+            if key in self._books:
+                self._books[key].remove(offer_id)
+                self._bump_version(key)
+
+    def _bump_version(self, key):
+        """increase the shared version, keep the local one in step if nobody else wrote in between"""
+        version_key = BOOK_VERSION_KEY(key)
+        if cache.add(version_key, 1, None):
+            # first write ever seen for this pair, tell the other workers a new pair exists
+            new_version = 1
+            try:
+                cache.incr(BOOK_PAIRS_KEY)
+            except ValueError:
+                cache.add(BOOK_PAIRS_KEY, 1, None)
+        else:
+            try:
+                new_version = cache.incr(version_key)
+            except ValueError:
+                # evicted between add and incr
+                cache.add(version_key, 1, None)
+                new_version = 1
+
+        book = self._books.get(key)
+        if book is not None and book.version == new_version - 1:
+            book.version = new_version
+
+    """*************************************************************************************************************
+    /*	function name:		    get_page
+    * 	function inputs:	    filters from the url frontend, (price, id) key of the last offer seen, page size,
+                                viewer stats and blocked users (None for anonymous feeds)
+    * 	function outputs:	    list of offer instances in the feed order, key of the last offer in the page
+    * 	function description:	pick the books that match the pair filters, refresh the stale ones, then merge
+                                them in price order from the cursor and apply the remaining filters on each offer
+                                until the page is full, limit None returns the whole feed. the offers of the
+                                blocked users are skipped and the counterparty restrictions are checked only
+                                when the books hold restricted offers
+    *   call back:              _select(), BOOK_FILTER_MAPPING, _viewer_predicates()
+    */
+    *************************************************************************************************************"""
+    def get_page(self, filters, after=None, limit=None, viewer=None):
+        self.warm()
+        wanted, predicates, descending = self._parse(filters)
+
+        with self._lock:
+            books = self._select(wanted)
+            predicates = predicates + self._viewer_predicates(books, viewer)
+            if len(books) == 1:
+                candidates = books[0].ordered(descending, after)
+            else:
+                candidates = merge(
+                    *[book.ordered(descending, after) for book in books],
+                    key=lambda offer: (offer.price, offer.id),
+                    reverse=descending
+                )
+            matching = (
+                offer for offer in candidates
+                if all(predicate(value, offer) for predicate, value in predicates)
+            )
+            # read one more offer to know if there is a next page
+            page = [copy.copy(offer) for offer in islice(matching, None if limit is None else limit + 1)]
+
+        if limit is not None and len(page) > limit:
+            page = page[:limit]
+            return page, (page[-1].price, page[-1].id)
+        return page, None
+
+    def get_offers(self, filters, viewer=None):
+        """the whole feed for these filters"""
+        return self.get_page(filters, viewer=viewer)[0]
+
+    """*************************************************************************************************************
+    /*	function name:		    count
+    * 	function inputs:	    filters from the url frontend, viewer stats
+    * 	function outputs:	    number of offers in the feed
+    * 	function description:	size of the selected books when only the pair is filtered, otherwise one scan
+                                cached for COUNT_TTL seconds, used as an estimate for the feed total
+    *   call back:              _select()
+    */
+    *************************************************************************************************************"""
+    def count(self, filters, viewer=None):
+        self.warm()
+        wanted, predicates, _ = self._parse(filters)
+        with self._lock:
+            books = self._select(wanted)
+            personal = bool(self._viewer_predicates(books, viewer))
+            if not predicates and not personal:
+                return sum(len(book) for book in books)
+
+        count_key = BOOK_COUNT_KEY({**filters, 'viewer': VIEWER_SIGNATURE(viewer) if personal else ''})
+        count = cache.get(count_key)
+        if count is None:
+            count = len(self.get_offers(filters, viewer))
+            cache.set(count_key, count, COUNT_TTL)
+        return count
+
+    """*************************************************************************************************************
+    /*	function name:		    feed_version
+    * 	function inputs:	    filters from the url frontend, viewer stats
+    * 	function outputs:	    string that changes whenever a pair of the feed changes, viewer flag
+    * 	function description:	the shared versions of the pairs selected by the filters, plus the pairs epoch when
+                                the pair is not fully given (a new pair can join the feed), used as part of the
+                                response cache key so a write makes the old entries unreachable at once.
+                                the viewer matters only when it has blocks or the pairs hold restricted offers,
+                                then its signature joins the version and the flag tells the caller to pass the
+                                viewer to get_page
+    *   call back:              _select()
+    */
+    *************************************************************************************************************"""
+    def feed_version(self, filters, viewer=None):
+        self.warm()
+        wanted, _, _ = self._parse(filters)
+        with self._lock:
+            # refresh first, the restricted flag must describe the books get_page will read
+            books = self._select(wanted)
+            personal = bool(self._viewer_predicates(books, viewer))
+            if len(wanted) == len(BOOK_KEY_FILTERS):
+                keys, epoch = [tuple(wanted[field] for field in BOOK_KEY_FILTERS)], ''
+            else:
+                epoch = self._pairs_version
+                keys = sorted(
+                    key for key in self._books
+                    if all(dict(zip(BOOK_KEY_FILTERS, key)).get(f) == v for f, v in wanted.items())
+                )
+        versions = cache.get_many([BOOK_VERSION_KEY(key) for key in keys])
+        version = f"{epoch}|" + ','.join(str(versions.get(BOOK_VERSION_KEY(key), 0)) for key in keys)
+        return (f"{version}|{VIEWER_SIGNATURE(viewer)}" if personal else version), personal
+
+    @staticmethod
+    def _viewer_predicates(books, viewer):
+        """per offer checks of this viewer, empty when the feed is the same as the anonymous one"""
+        if viewer is None:
+            return []
+        predicates = [(NOT_BLOCKED, viewer['hidden'])] if viewer.get('hidden') else []
+        if any(book.restricted for book in books):
+            predicates.append((CAN_TAKE_OFFER, viewer))
+        return predicates
+
+    @staticmethod
+    def _parse(filters):
+        """split the filters into the pair fields, the per offer predicates and the sort direction"""
+        wanted = {
+            field: normalize(filters[field])
+            for field, normalize in BOOK_KEY_FILTERS.items() if filters.get(field)
+        }
+        predicates = [
+            (BOOK_FILTER_MAPPING[k], v) for k, v in filters.items() if v and k in BOOK_FILTER_MAPPING
+        ]
+        return wanted, predicates, IS_DESCENDING(wanted.get('trade_type'))
+
+    def _select(self, wanted):
+        """fresh books matching the pair fields, call it while holding the lock"""
+        self._refresh(wanted)
+        return [
+            book for key, book in self._books.items()
+            if all(dict(zip(BOOK_KEY_FILTERS, key)).get(f) == v for f, v in wanted.items())
+        ]
+
+    def _refresh(self, wanted):
+        """reload the pairs that were changed by another process since we read them"""
+        if len(wanted) == len(BOOK_KEY_FILTERS):
+            key = tuple(wanted[field] for field in BOOK_KEY_FILTERS)
+            keys = [key]
+        else:
+            keys = list(self._books)
+            # a pair that this worker never saw can only be found by asking the database
+            pairs_version = cache.get(BOOK_PAIRS_KEY, 0)
+            if pairs_version != self._pairs_version:
+                self._pairs_version = pairs_version
+                known = set(self._books)
+                keys += [
+                    key for key in P2POffer.objects.filter(self._public_q())
+                    .values_list('crypto_currency', 'fiat_currency', 'trade_type').distinct()
+                    if key not in known
+                ]
+
+        shared = cache.get_many([BOOK_VERSION_KEY(key) for key in keys])
+        stale = [
+            key for key in keys
+            if shared.get(BOOK_VERSION_KEY(key), 0) != getattr(self._books.get(key), 'version', 0)
+            or (key not in self._books and BOOK_VERSION_KEY(key) in shared)
+        ]
+        if stale:
+            query = Q()
+            for key in stale:
+                query |= self._public_q(key)
+            self._load_rows(P2POffer.objects.filter(query), keys=stale)
+
+    def size(self):
+        """number of offers in all books"""
+        with self._lock:
+            return sum(len(book) for book in self._books.values())
+
+
+# one engine per worker process
+ORDER_BOOK = OrderBookEngine()
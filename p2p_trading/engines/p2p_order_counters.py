@@ -0,0 +1,101 @@
+# p2p_trading/engines/p2p_order_counters.py
+"""cached order counters of the users, one number per order status
+
+the counters of a user are loaded with one GROUP BY over the orders of both sides the first time they
+are asked, then every order change moves them in the shared cache once its transaction commits:
+
+    new order           UNPAID + 1                           for the maker and the taker
+    transition          previous status - 1, new status + 1  (P2POrderService.transition, expiry sweeper)
+
+each status has its own key so a change is two atomic incr/decr, not a read-modify-write. a change that
+finds the keys gone (expired, never loaded) drops the counters of the user and the next read loads them
+again. a generation key per user catches a change committed while the counters were being loaded.
+
+the counters are only right when every worker moves the same keys: the cache must be shared
+(P2P_CACHE_BACKEND), the settings refuse the per-process LocMemCache with several workers.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from ..constants.constant import OrderStatus, PROCESSING_STATUSES, COMPLETED_STATUSES
+from ..repositories.p2p_order_repository import P2POrderRepository
+
+COUNTER_KEY = lambda user_id, status: f"p2p_order_count_{user_id}_{status}"
+GENERATION_KEY = lambda user_id: f"p2p_order_count_gen_{user_id}"
+COUNTER_KEYS = lambda user_id: {COUNTER_KEY(user_id, status): status for status in OrderStatus.values}
+# seconds the counters are kept, they are maintained on every change, the ttl bounds the drift of the
+# changes made outside the services (admin, raw sql)
+DEFAULT_COUNTERS_TTL = 300
+
+
+# ================ COUNTERS CLASS ================
+class OrderCounters:
+    """per status order counts of each user"""
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'P2P_ORDER_COUNTERS_TTL', DEFAULT_COUNTERS_TTL)
+
+    def get(self, user_id):
+        """dict {status: number of orders of the user}, every status present"""
+        keys = COUNTER_KEYS(user_id)
+        cached = cache.get_many(list(keys))
+        if len(cached) == len(keys):
+            return {status: cached[key] for key, status in keys.items()}
+        return self._load(user_id)
+
+    def summary(self, user_id):
+        """the counters with the totals of the processing and finished groups"""
+        counts = self.get(user_id)
+        return {
+            'statuses': counts,
+            'processing': sum(counts[status] for status in PROCESSING_STATUSES),
+            'completed': sum(counts[status] for status in COMPLETED_STATUSES),
+            'total': sum(counts.values()),
+        }
+
+    """*************************************************************************************************************
+    /*	function name:		    move_on_commit
+    * 	function inputs:	    list of (user ids, previous status or None for a new order, new status)
+    * 	function outputs:	    n/a
+    * 	function description:	once the transaction commits, move one order of each user from the previous
+                                status counter to the new one, nothing moves when it rolls back
+    *   call back:              move()
+    */
+    *************************************************************************************************************"""
+    def move_on_commit(self, changes):
+        transaction.on_commit(lambda: self.move(changes))
+
+    def move(self, changes):
+        ttl = self.ttl
+        for user_ids, previous, status in changes:
+            for user_id in set(user_ids):
+                # a load running now must not keep what it read before this change
+                try:
+                    cache.incr(GENERATION_KEY(user_id))
+                except ValueError:
+                    cache.add(GENERATION_KEY(user_id), 1, ttl)
+                try:
+                    if previous is not None:
+                        cache.decr(COUNTER_KEY(user_id, previous))
+                    cache.incr(COUNTER_KEY(user_id, status))
+                except ValueError:
+                    # not cached (or expired meanwhile), the next read loads them
+                    cache.delete_many(list(COUNTER_KEYS(user_id)))
+
+    def _load(self, user_id):
+        generation = cache.get(GENERATION_KEY(user_id))
+        counts = dict.fromkeys(OrderStatus.values, 0)
+        counts.update(P2POrderRepository.count_orders_by_status(user_id))
+        keys = COUNTER_KEYS(user_id)
+        cache.set_many({key: counts[status] for key, status in keys.items()}, self.ttl)
+        # a change committed during the query may be missing from what was just cached
+        if cache.get(GENERATION_KEY(user_id)) != generation:
+            cache.delete_many(list(keys))
+        return counts
+
+
+# one counters object per worker process, the numbers live in the shared cache
+ORDER_COUNTERS = OrderCounters()
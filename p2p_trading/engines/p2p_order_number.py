@@ -0,0 +1,175 @@
+# p2p_trading/engines/p2p_order_number.py
+"""snowflake style allocator of the order numbers
+
+a number packs three parts into 63 bits and is written as 19 zero padded digits:
+
+    | 41 bits milliseconds since ORDER_EPOCH | 10 bits worker id | 12 bits sequence |
+
+numbers of one worker always grow, numbers of different workers can never be equal, and the string
+order is the time order (k-sortable), all without asking the database. 4096 numbers per millisecond
+per worker, the allocator waits for the next millisecond when a millisecond is used up or when the
+clock moves back.
+
+the worker id must be unique among the processes that create orders at the same time:
+    - P2P_ORDER_WORKER_ID (setting or environment), one value per process, e.g. the gunicorn worker index
+    - otherwise a free id is claimed in the p2p_order_worker table of the database every node shares, and
+      kept with a lease. the lease is renewed before a number is built once half of it is gone, a process
+      that lost its id (suspended past the lease and the id claimed by another one) claims a new one first
+the claims use a connection of their own in autocommit, an order transaction rolled back never undoes one.
+a forked child forgets the worker id of its parent and claims its own.
+"""
+
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connections
+
+# 2025-01-01T00:00:00Z in milliseconds, 41 bits of milliseconds last until 2094
+ORDER_EPOCH = 1735689600000
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+# 63 bits fit in 19 digits, the padding keeps the string order equal to the number order
+NUMBER_DIGITS = 19
+
+# seconds a claimed worker id is kept without allocation, renewed at half of it
+WORKER_LEASE = 10 * 60
+# tries of a claim that lost the race for its free id to another process
+CLAIM_ATTEMPTS = 5
+
+# the first free (or expired) id counting from start, taken with the token of the process. two processes
+# picking the same free id meet on the primary key, the second one gets no row back and tries again
+CLAIM_WORKER_SQL = """
+    WITH free AS (
+        SELECT candidate FROM generate_series(0, %(max_id)s) AS candidate
+        LEFT JOIN p2p_order_worker w ON w.worker_id = candidate
+        WHERE w.worker_id IS NULL OR w.expires_at < now()
+        ORDER BY (candidate - %(start)s + %(max_id)s + 1) %% (%(max_id)s + 1)
+        LIMIT 1
+    )
+    INSERT INTO p2p_order_worker (worker_id, token, expires_at)
+    SELECT candidate, %(token)s, now() + make_interval(secs => %(lease)s) FROM free
+    ON CONFLICT (worker_id) DO UPDATE SET token = EXCLUDED.token, expires_at = EXCLUDED.expires_at
+        WHERE p2p_order_worker.expires_at < now()
+    RETURNING worker_id
+"""
+# no row updated: the id is not ours anymore
+RENEW_WORKER_SQL = """
+    UPDATE p2p_order_worker SET expires_at = now() + make_interval(secs => %(lease)s)
+    WHERE worker_id = %(worker_id)s AND token = %(token)s
+"""
+
+# (milliseconds, worker id, sequence) of an order number
+PARSE_ORDER_NUMBER = lambda number: (
+    (int(number) >> (WORKER_BITS + SEQUENCE_BITS)) + ORDER_EPOCH,
+    (int(number) >> SEQUENCE_BITS) & MAX_WORKER_ID,
+    int(number) & MAX_SEQUENCE,
+)
+
+
+# ================ ALLOCATOR CLASS ================
+class OrderNumberAllocator:
+    """time ordered unique order numbers of one process"""
+
+    def __init__(self, worker_id=None):
+        self._fixed_worker_id = worker_id
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        """new process, the claimed worker id and the sequence belong to the parent"""
+        self._worker_id = self._fixed_worker_id
+        self._token = None
+        self._renew_at = 0.0
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def worker_id(self):
+        """the configured worker id, or the claimed one with its lease renewed when due"""
+        if self._worker_id is None:
+            configured = getattr(settings, 'P2P_ORDER_WORKER_ID', None) or os.environ.get('P2P_ORDER_WORKER_ID')
+            self._worker_id = int(configured) if configured not in (None, '') else self._claim_worker_id()
+        elif self._token is not None and time.monotonic() >= self._renew_at:
+            self._renew_claim()
+        if not 0 <= self._worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"order worker id must be between 0 and {MAX_WORKER_ID}")
+        return self._worker_id
+
+    """*************************************************************************************************************
+    /*	function name:		    next
+    * 	function inputs:	    n/a
+    * 	function outputs:	    19 digits order number string
+    * 	function description:	current millisecond + worker id + per millisecond sequence, waits for the next
+                                millisecond when the sequence is used up or the clock went back. a claimed
+                                worker id is checked (its lease renewed when due) before the number is built
+    *   call back:              worker_id
+    */
+    *************************************************************************************************************"""
+    def next(self):
+        with self._lock:
+            worker_id = self.worker_id
+            now = self._now()
+            if now < self._last_ms:
+                # the clock moved back, never reuse a millisecond already handed out
+                now = self._wait_until(self._last_ms)
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    now = self._wait_until(self._last_ms + 1)
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            number = ((now - ORDER_EPOCH) << (WORKER_BITS + SEQUENCE_BITS)) | (worker_id << SEQUENCE_BITS) | self._sequence
+        return f"{number:0{NUMBER_DIGITS}d}"
+
+    @staticmethod
+    def _now():
+        return time.time_ns() // 1_000_000
+
+    def _wait_until(self, target_ms):
+        now = self._now()
+        while now < target_ms:
+            time.sleep((target_ms - now) / 1000)
+            now = self._now()
+        return now
+
+    def _claim_worker_id(self):
+        """first free worker id in the database, starting from one derived from the pid"""
+        token = uuid.uuid4().hex
+        params = {'max_id': MAX_WORKER_ID, 'start': os.getpid() & MAX_WORKER_ID, 'token': token,
+                  'lease': WORKER_LEASE}
+        for _ in range(CLAIM_ATTEMPTS):
+            row = self._execute(CLAIM_WORKER_SQL, params)
+            if row is not None:
+                self._token, self._renew_at = token, time.monotonic() + WORKER_LEASE / 2
+                return row[0]
+        raise RuntimeError("no free order worker id, set P2P_ORDER_WORKER_ID")
+
+    def _renew_claim(self):
+        if self._execute(RENEW_WORKER_SQL, {'lease': WORKER_LEASE, 'worker_id': self._worker_id, 'token': self._token}):
+            self._renew_at = time.monotonic() + WORKER_LEASE / 2
+        else:
+            # the lease expired and another process took the id, claim a new one before the next number
+            self._worker_id = self._claim_worker_id()
+
+    @staticmethod
+    def _execute(sql, params):
+        """one statement on a connection of its own (autocommit, outside the transaction of the caller)
+        returns the first row, or the number of rows changed when the statement returns none"""
+        connection = connections.create_connection('default')
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchone() if cursor.description else cursor.rowcount
+        finally:
+            connection.close()
+
+
+# one allocator per worker process
+ORDER_NUMBERS = OrderNumberAllocator()
@@ -0,0 +1,229 @@
+# p2p_trading/engines/p2p_order_stream.py
+"""push the order status changes to the connected clients instead of letting them poll
+
+the order service (and the expiry sweeper) publish the new status of an order once its transaction
+commits, the broker hands it to the subscriptions of the maker and of the taker:
+
+    P2POrderService.record_event() -> ORDER_STREAM.publish_on_commit()
+        -> backend.publish()                    after the commit
+        -> ORDER_STREAM.deliver() on each node  the subscriptions of the two users on this node
+        -> subscription queue -> websocket / SSE connection (controllers/p2p_order_stream_controller.py)
+
+the backend moves the messages between the nodes (P2P_ORDER_STREAM_BACKEND):
+    InProcessBackend        one node, delivers in the publishing process (default)
+    PostgresNotifyBackend   several nodes, NOTIFY on the default database, each node LISTENs
+
+a subscription keeps the last P2P_ORDER_STREAM_QUEUE messages, a slow client loses the oldest ones and
+sees the gap in the order version, it reloads the order then.
+"""
+
+import asyncio
+import json
+import select
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+NOTIFY_CHANNEL = 'p2p_order_stream'
+DEFAULT_QUEUE_SIZE = 100
+
+# what a client receives when one of its orders changes
+STATUS_MESSAGE = lambda order: {
+    'type': 'order.status', 'order_id': order.id, 'order_number': order.order_number,
+    'status': order.status, 'version': order.version, 'updated_at': order.updated_at,
+}
+
+
+# ================ FAN-OUT BACKENDS ================
+class InProcessBackend:
+    """single node, the messages never leave the process that published them"""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, messages):
+        for user_ids, message in messages:
+            self.deliver(user_ids, message)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PostgresNotifyBackend:
+    """several nodes, each message is a NOTIFY on the default database and every node LISTENs on its own
+    connection in a daemon thread, the payload is limited to 8000 bytes which a status message never reaches"""
+
+    def __init__(self, deliver, alias='default', poll_timeout=5.0):
+        self.deliver = deliver
+        self.alias = alias
+        self.poll_timeout = poll_timeout
+        self._thread = None
+        self._stop = threading.Event()
+
+    def publish(self, messages):
+        with connections[self.alias].cursor() as cursor:
+            for user_ids, message in messages:
+                payload = json.dumps([list(user_ids), message], cls=DjangoJSONEncoder)
+                cursor.execute("SELECT pg_notify(%s, %s)", [NOTIFY_CHANNEL, payload])
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name='p2p-order-stream-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.poll_timeout + 1)
+
+    def _listen(self):
+        while not self._stop.is_set():
+            try:
+                wrapper = connections[self.alias]
+                connection = wrapper.get_new_connection(wrapper.get_connection_params())
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                try:
+                    while not self._stop.is_set():
+                        if select.select([connection], [], [], self.poll_timeout)[0]:
+                            connection.poll()
+                            while connection.notifies:
+                                user_ids, message = json.loads(connection.notifies.pop(0).payload)
+                                self.deliver(user_ids, message)
+                finally:
+                    connection.close()
+            except Exception as e:
+                # the messages sent while reconnecting are lost, the clients catch up with the order version
+                print(f"Order stream listener error: {str(e)}")
+                self._stop.wait(self.poll_timeout)
+
+
+# ================ SUBSCRIPTION ================
+class Subscription:
+    """the queue of one connection, filled from any thread, read on the event loop of the connection"""
+
+    __slots__ = ('user_id', 'queue', 'loop', 'dropped')
+
+    def __init__(self, user_id, loop, size):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(size)
+        self.loop = loop
+        self.dropped = 0
+
+    def put(self, message):
+        # the loop of a connection that just closed is gone, nothing to deliver to
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        # a full queue is a slow client, keep the newest messages
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+# ================ BROKER CLASS ================
+class OrderStreamBroker:
+    """the subscriptions of this process by user, and the backend that brings the messages of every node"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._backend = None
+        self.metrics = {'subscriptions': 0, 'published': 0, 'delivered': 0}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    backend = import_string(getattr(
+                        settings, 'P2P_ORDER_STREAM_BACKEND', 'p2p_trading.engines.p2p_order_stream.InProcessBackend'
+                    ))(self.deliver)
+                    backend.start()
+                    self._backend = backend
+        return self._backend
+
+    def set_backend(self, backend_class, **options):
+        """replace the backend (tests, or a custom fan-out), the previous one is stopped"""
+        with self._lock:
+            if self._backend is not None:
+                self._backend.stop()
+            self._backend = backend_class(self.deliver, **options)
+            self._backend.start()
+        return self._backend
+
+    def stop(self):
+        """stop the backend of this process (ASGI shutdown), the next subscription starts a new one"""
+        with self._lock:
+            if self._backend is not None:
+                self._backend.stop()
+                self._backend = None
+
+    def subscribe(self, user_id, size=None):
+        """new subscription of a user, called on the event loop that will read it"""
+        subscription = Subscription(
+            user_id, asyncio.get_running_loop(),
+            size or getattr(settings, 'P2P_ORDER_STREAM_QUEUE', DEFAULT_QUEUE_SIZE)
+        )
+        # the backend of a multi-node setup starts listening with the first subscription
+        self.backend
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            self.metrics['subscriptions'] += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None and subscription in subscriptions:
+                subscriptions.discard(subscription)
+                self.metrics['subscriptions'] -= 1
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish_on_commit(self, messages):
+        """publish a list of (user ids, message) once the current transaction commits, never for a rollback"""
+        transaction.on_commit(lambda: self.publish(messages))
+
+    def publish(self, messages):
+        if not messages:
+            return
+        # a message crosses the backend as json, every node delivers the same plain values
+        messages = [(list(user_ids), json.loads(json.dumps(message, cls=DjangoJSONEncoder)))
+                    for user_ids, message in messages]
+        with self._lock:
+            self.metrics['published'] += len(messages)
+        try:
+            self.backend.publish(messages)
+        except Exception as e:
+            # the change is committed already, the clients catch up with the order version
+            print(f"Order stream publish error: {str(e)}")
+
+    def deliver(self, user_ids, message):
+        """hand a message to the subscriptions of the users on this node"""
+        with self._lock:
+            subscriptions = [s for user_id in user_ids for s in self._subscriptions.get(user_id, ())]
+            self.metrics['delivered'] += len(subscriptions)
+        for subscription in subscriptions:
+            subscription.put(message)
+        return len(subscriptions)
+
+    def subscribers(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscriptions.get(user_id, ()))
+            return self.metrics['subscriptions']
+
+
+# one broker per worker process
+ORDER_STREAM = OrderStreamBroker()
@@ -0,0 +1,175 @@
+# p2p_trading/engines/p2p_outbox_relay.py
+"""deliver the outbox events to the in-process consumers, off the request path
+
+P2POrderService and P2POfferService write one OutboxEvent in the transaction of every state change,
+so an event exists if and only if its change was committed. the relay drains the outbox per consumer:
+
+    one transaction per consumer and batch:
+        lock the checkpoint of the consumer (SKIP LOCKED, one relay per consumer at a time)
+        read the next events of the finished transactions in (transaction_id, id) order
+        call the handler for each event in its own savepoint, stop at the first failure
+        move the checkpoint to the last event handled
+
+delivery is at least once: a failed event (and every event after it, to keep the order) is delivered
+again on the next pass, an event handled right before a crash of the relay is delivered again too, so
+handlers must be idempotent. what a handler writes in the database commits with the checkpoint.
+
+    @OUTBOX_RELAY.register('chat_rooms', event_types={'order.created'})
+    def link_chat_room(event):
+        ...
+
+run it with `python manage.py relay_outbox` (once or --loop), or in-process with OUTBOX_RELAY.start(interval)
+which the serving entry points (wsgi.py, asgi.py) start when P2P_OUTBOX_RELAY_INTERVAL is set.
+"""
+
+import threading
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from ..repositories.p2p_outbox_repository import P2POutboxRepository
+
+DEFAULT_BATCH_SIZE = 200
+
+
+# ================ RELAY CLASS ================
+class OutboxRelay:
+    """registry of the outbox consumers and the worker that feeds them, with the metrics of each consumer"""
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # consumer name -> (handler, event types it wants or None for all)
+        self.consumers = {}
+        # totals since the process started, per consumer
+        self.metrics = {'passes': 0, 'consumers': {}}
+
+    def register(self, name, handler=None, event_types=None):
+        """add a consumer, usable as a decorator, the name keys its checkpoint so keep it stable"""
+        if handler is None:
+            return lambda function: self.register(name, function, event_types)
+        self.consumers[name] = (handler, frozenset(event_types) if event_types else None)
+        return handler
+
+    def unregister(self, name):
+        self.consumers.pop(name, None)
+
+    """*************************************************************************************************************
+    /*	function name:		    relay_consumer
+    * 	function inputs:	    consumer name, batch size
+    * 	function outputs:	    dict of the events read, delivered, whether the consumer failed, and its lag
+    * 	function description:	one transaction, lock the checkpoint, deliver the next batch in order, each handler
+                                call in a savepoint so a failure undoes only its own writes, then save the
+                                checkpoint at the last event handled. the events the consumer does not want move
+                                the checkpoint without a call. a checkpoint held by another relay is skipped
+    *   call back:              lock_checkpoint(), get_batch(), save_checkpoint(), get_lag()
+    */
+    *************************************************************************************************************"""
+    def relay_consumer(self, name, batch_size=DEFAULT_BATCH_SIZE):
+        handler, event_types = self.consumers[name]
+        result = {'read': 0, 'delivered': 0, 'failed': None, 'lag': None}
+        with transaction.atomic():
+            checkpoint = P2POutboxRepository.lock_checkpoint(name)
+            if checkpoint is None:
+                return result
+            events = P2POutboxRepository.get_batch(checkpoint, batch_size)
+            result['read'] = len(events)
+
+            last = None
+            for event in events:
+                if event_types is None or event.event_type in event_types:
+                    try:
+                        with transaction.atomic():
+                            handler(event)
+                    except Exception as e:
+                        # the order is kept, this event and the next ones wait for the next pass
+                        result['failed'] = f"{event.event_type} {event.id}: {str(e)}"
+                        break
+                    result['delivered'] += 1
+                last = event
+            if last is not None:
+                P2POutboxRepository.save_checkpoint(checkpoint, last)
+            result['lag'] = P2POutboxRepository.get_lag(checkpoint)
+
+        self._record(name, result)
+        return result
+
+    def relay_once(self, batch_size=DEFAULT_BATCH_SIZE):
+        """one batch for every consumer, returns the result of each consumer"""
+        results = {name: self.relay_consumer(name, batch_size) for name in list(self.consumers)}
+        with self._lock:
+            self.metrics['passes'] += 1
+        return results
+
+    def relay(self, batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+        """batches until every consumer caught up, failed, or max_batches, returns the totals per consumer"""
+        totals = {name: {'read': 0, 'delivered': 0, 'failed': None} for name in self.consumers}
+        pending = set(totals)
+        batches = 0
+        while pending and (max_batches is None or batches < max_batches):
+            batches += 1
+            for name in list(pending):
+                result = self.relay_consumer(name, batch_size)
+                totals[name]['read'] += result['read']
+                totals[name]['delivered'] += result['delivered']
+                totals[name]['failed'] = result['failed']
+                if result['failed'] or result['read'] < batch_size:
+                    pending.discard(name)
+        with self._lock:
+            self.metrics['passes'] += 1
+        return totals
+
+    def _record(self, name, result):
+        """metrics of a consumer after one batch, the lag is the events still waiting and the age of the oldest"""
+        lag = result['lag'] or {'events': 0, 'oldest': None}
+        with self._lock:
+            metrics = self.metrics['consumers'].setdefault(
+                name, {'delivered': 0, 'failed': 0, 'last_error': None, 'lag_events': 0, 'lag_seconds': 0.0}
+            )
+            metrics['delivered'] += result['delivered']
+            if result['failed']:
+                metrics['failed'] += 1
+                metrics['last_error'] = result['failed']
+            metrics['lag_events'] = lag['events']
+            metrics['lag_seconds'] = (
+                (timezone.now() - lag['oldest']).total_seconds() if lag['oldest'] else 0.0
+            )
+
+    def prune(self, before):
+        """delete the events older than before that every consumer already passed, the consumers registered
+        on this relay included (one that never ran has no checkpoint yet)"""
+        return P2POutboxRepository.prune(before, list(self.consumers))
+
+    # ================ RELAY THREAD ================
+    def start(self, interval, batch_size=DEFAULT_BATCH_SIZE):
+        """relay every interval seconds in a daemon thread of this process"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self._thread
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(interval, batch_size), name='p2p-outbox-relay', daemon=True
+            )
+            self._thread.start()
+            return self._thread
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, interval, batch_size):
+        while not self._stop.is_set():
+            try:
+                close_old_connections()
+                self.relay(batch_size)
+            except Exception as e:
+                # the batch transaction was rolled back, the checkpoints did not move
+                print(f"Outbox relay error: {str(e)}")
+            self._stop.wait(interval)
+        close_old_connections()
+
+
+# one relay per worker process, the consumers register on it
+OUTBOX_RELAY = OutboxRelay()
@@ -0,0 +1,115 @@
+# p2p_trading/engines/p2p_payment_method_cache.py
+"""read-through cache of the payment method details that live in the main database
+
+two levels per payment method id:
+    - an in-process LRU, no round trip at all for the hot ids
+    - the shared django cache, one get_many for all the ids missing locally
+only the ids missing from both are read from main_db, in one query.
+
+the writes of P2PProfileRepository (add, update and delete of a payment method) call invalidate():
+the shared entries are deleted and a shared generation counter is bumped, every worker drops its LRU
+when it sees a new generation, so no worker keeps serving an old entry after a write. the rows loaded
+while the generation moved may be older than the write, they are served once and cached nowhere.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+# shared cache keys
+PAYMENT_METHOD_KEY = lambda payment_id: f"p2p_pm_{payment_id}"
+PAYMENT_METHOD_GENERATION_KEY = 'p2p_pm_generation'
+# ids that do not exist in the main database are cached too, as this marker
+MISSING = {}
+# entries kept by each worker
+LOCAL_MAX_SIZE = 10000
+# seconds an entry is kept in the shared cache
+SHARED_TTL = 60 * 60 * 24
+
+
+# ================ CACHE CLASS ================
+class PaymentMethodCache:
+    """per id cache of the display projection built by get_payment_methods_details"""
+
+    def __init__(self, max_size=LOCAL_MAX_SIZE):
+        self._local = OrderedDict()     # payment method id -> details dict (or MISSING)
+        self._generation = None
+        self._max_size = max_size
+        self._lock = threading.Lock()
+
+    """*************************************************************************************************************
+    /*	function name:		    get_many
+    * 	function inputs:	    list of payment method ids, loader(ids) -> {id: details} reading the main database
+    * 	function outputs:	    dict {id: details} of the ids that exist
+    * 	function description:	serve each id from the local LRU, then the shared cache, then load all the
+                                remaining ids with one call of the loader and fill both levels, unless an
+                                invalidate() bumped the generation since the read started
+    *   call back:              _sync_generation(), _remember()
+    */
+    *************************************************************************************************************"""
+    def get_many(self, payment_ids, loader):
+        wanted = list(dict.fromkeys(int(payment_id) for payment_id in payment_ids))
+        generation = self._sync_generation()
+
+        found, missing = {}, []
+        with self._lock:
+            for payment_id in wanted:
+                if payment_id in self._local:
+                    self._local.move_to_end(payment_id)
+                    found[payment_id] = self._local[payment_id]
+                else:
+                    missing.append(payment_id)
+
+        if missing:
+            shared = cache.get_many([PAYMENT_METHOD_KEY(payment_id) for payment_id in missing])
+            fresh = {
+                payment_id: shared[PAYMENT_METHOD_KEY(payment_id)]
+                for payment_id in missing if PAYMENT_METHOD_KEY(payment_id) in shared
+            }
+            to_load = [payment_id for payment_id in missing if payment_id not in fresh]
+            if to_load:
+                loaded = loader(to_load)
+                loaded = {payment_id: loaded.get(payment_id, MISSING) for payment_id in to_load}
+                found.update(loaded)
+                # a write invalidated during the load would be overwritten by the rows read before it
+                if cache.get(PAYMENT_METHOD_GENERATION_KEY, 0) == generation:
+                    cache.set_many({PAYMENT_METHOD_KEY(k): v for k, v in loaded.items()}, SHARED_TTL)
+                    fresh.update(loaded)
+            self._remember(fresh)
+            found.update(fresh)
+
+        return {payment_id: details for payment_id, details in found.items() if details}
+
+    def invalidate(self, payment_ids):
+        """drop the entries of these ids everywhere, call it after any write to PaymentMethods"""
+        payment_ids = [int(payment_id) for payment_id in payment_ids]
+        cache.delete_many([PAYMENT_METHOD_KEY(payment_id) for payment_id in payment_ids])
+        try:
+            cache.incr(PAYMENT_METHOD_GENERATION_KEY)
+        except ValueError:
+            cache.add(PAYMENT_METHOD_GENERATION_KEY, 1, None)
+        with self._lock:
+            for payment_id in payment_ids:
+                self._local.pop(payment_id, None)
+
+    def _sync_generation(self):
+        """another worker wrote since our last read, our LRU may hold old entries, returns the generation"""
+        generation = cache.get(PAYMENT_METHOD_GENERATION_KEY, 0)
+        if generation != self._generation:
+            with self._lock:
+                self._local.clear()
+                self._generation = generation
+        return generation
+
+    def _remember(self, entries):
+        with self._lock:
+            for payment_id, details in entries.items():
+                self._local[payment_id] = details
+                self._local.move_to_end(payment_id)
+            while len(self._local) > self._max_size:
+                self._local.popitem(last=False)
+
+
+# one cache per worker process
+PAYMENT_METHOD_CACHE = PaymentMethodCache()
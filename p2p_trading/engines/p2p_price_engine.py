@@ -0,0 +1,164 @@
+# p2p_trading/engines/p2p_price_engine.py
+"""reference prices and repricing of the floating offers
+
+a floating offer keeps its effective price in `price`:
+
+    price = index price of the pair * (100 + price_margin) / 100     (rounded to cents)
+
+the index prices come from a pluggable feed (P2P_PRICE_FEED, dotted path of a ReferencePriceFeed
+class), the default one reads a local json file that stands in for the exchange feed. the latest
+price of each (crypto, fiat) pair is kept in memory for P2P_PRICE_TTL seconds.
+
+the repricing pass loads the floating offers of one pair, computes all the new prices in one numpy
+step (integer cents, no float rounding) and writes the changed ones back with a single bulk update.
+"""
+
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from decimal import Decimal, ROUND_HALF_UP
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from ..constants.constant import PriceType, TradeType
+from ..models.p2p_offer_model import P2POffer
+from .p2p_order_book_engine import ORDER_BOOK
+
+DEFAULT_FEED = 'p2p_trading.engines.p2p_price_engine.FilePriceFeed'
+DEFAULT_FEED_FILE = Path(__file__).resolve().parent.parent / 'fixtures' / 'reference_prices.json'
+DEFAULT_TTL = 30
+
+CENT = Decimal('0.01')
+# 2-decimal amount (price, margin) as a whole number of hundredths
+TO_CENTS = lambda price: int((price / CENT).to_integral_value(ROUND_HALF_UP))
+
+# all the floating offers of one (crypto, fiat) pair that can still be traded or edited
+FLOATING_OFFERS = lambda key: P2POffer.objects.filter(
+    is_deleted=False, price_type=PriceType.FLOATING, crypto_currency=key[0], fiat_currency=key[1]
+)
+
+
+# ================ FEED CLASSES ================
+class ReferencePriceFeed(ABC):
+    """source of the index prices, subclass it and point P2P_PRICE_FEED to the class"""
+
+    @abstractmethod
+    def fetch(self, pairs=None):
+        """{(crypto, fiat): Decimal} of the latest index prices, pairs None returns every pair"""
+
+
+class FilePriceFeed(ReferencePriceFeed):
+    """reads {"USDT": {"EGP": "48.50", ...}, ...} from P2P_PRICE_FEED_FILE, local stand-in for the real feed"""
+
+    def fetch(self, pairs=None):
+        path = getattr(settings, 'P2P_PRICE_FEED_FILE', None) or DEFAULT_FEED_FILE
+        with open(path) as file:
+            data = json.load(file)
+
+        prices = {
+            (crypto.upper(), fiat): Decimal(str(price))
+            for crypto, fiats in data.items() for fiat, price in fiats.items()
+        }
+        return prices if pairs is None else {key: prices[key] for key in pairs if key in prices}
+
+
+# ================ ENGINE CLASS ================
+class PriceEngine:
+    """index price cache and repricing of the floating offers of the worker process"""
+
+    def __init__(self):
+        self._prices = {}   # (crypto, fiat) -> (index price, time it was fetched)
+        self._feed = None
+        self._lock = threading.Lock()
+
+    @property
+    def feed(self):
+        if self._feed is None:
+            self._feed = import_string(getattr(settings, 'P2P_PRICE_FEED', DEFAULT_FEED))()
+        return self._feed
+
+    def refresh(self, pairs=None):
+        """pull the latest index prices from the feed into the cache"""
+        prices = self.feed.fetch(pairs)
+        now = time.monotonic()
+        with self._lock:
+            self._prices.update({key: (price, now) for key, price in prices.items()})
+        return prices
+
+    def get_index_price(self, crypto_currency, fiat_currency):
+        """cached index price of the pair, None if the feed does not know it"""
+        key = (crypto_currency.upper(), fiat_currency)
+        cached = self._prices.get(key)
+        if cached is None or time.monotonic() - cached[1] > getattr(settings, 'P2P_PRICE_TTL', DEFAULT_TTL):
+            try:
+                self.refresh([key])
+            except (OSError, ValueError) as e:
+                # feed down, keep serving the last known price
+                print(f"Reference price feed error: {str(e)}")
+            cached = self._prices.get(key)
+        return cached[0] if cached else None
+
+    def effective_price(self, crypto_currency, fiat_currency, margin, fallback=None):
+        """index price of the pair with the margin applied, fallback when there is no index price"""
+        index = self.get_index_price(crypto_currency, fiat_currency)
+        if index is None:
+            return fallback
+        cents = TO_CENTS(index) * (100 + (margin or Decimal('0'))) / 100
+        return max(cents.to_integral_value(ROUND_HALF_UP) * CENT, CENT).quantize(CENT)
+
+    """*************************************************************************************************************
+    /*	function name:		    reprice_pair
+    * 	function inputs:	    (crypto, fiat) pair
+    * 	function outputs:	    number of offers that got a new price
+    * 	function description:	compute the effective price of every floating offer of the pair in one vectorized
+                                step and write the changed prices with one bulk update, then reload both sides
+                                of the pair in the order book
+    *   call back:              get_index_price(), ORDER_BOOK.reload_pairs()
+    */
+    *************************************************************************************************************"""
+    def reprice_pair(self, key):
+        index = self.get_index_price(*key)
+        if index is None:
+            return 0
+        rows = list(FLOATING_OFFERS(key).values_list('id', 'price_margin', 'price'))
+        if not rows:
+            return 0
+
+        count = len(rows)
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=count)
+        # margin in basis points and prices in cents, the whole pass stays in exact integers
+        margins = np.fromiter((TO_CENTS(row[1] or Decimal('0')) for row in rows), dtype=np.int64, count=count)
+        current = np.fromiter((TO_CENTS(row[2]) for row in rows), dtype=np.int64, count=count)
+
+        # cents * (10000 + bp) / 10000 rounded half up, never below one cent (price_must_be_positive)
+        prices = np.maximum((TO_CENTS(index) * (10000 + margins) + 5000) // 10000, 1)
+        changed = prices != current
+        if not changed.any():
+            return 0
+
+        offers = [
+            P2POffer(id=int(offer_id), price=Decimal(int(price)) * CENT)
+            for offer_id, price in zip(ids[changed], prices[changed])
+        ]
+        with transaction.atomic():
+            P2POffer.objects.bulk_update(offers, ['price'], batch_size=None)
+            ORDER_BOOK.reload_pairs([(key[0], key[1], side) for side in TradeType.values])
+        return len(offers)
+
+    def reprice_all(self):
+        """refresh every index price and reprice each pair that has floating offers"""
+        self.refresh()
+        pairs = (
+            P2POffer.objects.filter(is_deleted=False, price_type=PriceType.FLOATING)
+            .values_list('crypto_currency', 'fiat_currency').distinct()
+        )
+        return {pair: self.reprice_pair(pair) for pair in pairs}
+
+
+# one engine per worker process
+PRICE_ENGINE = PriceEngine()
@@ -8,7 +8,10 @@ from .p2p_decorator_helpers import (handle_exception)
 
 # Filter helpers
 from .p2p_filter_helpers import (extract_filters, FILTER_MAPPING, apply_filters, ORDER_FILTER_MAP, USER_FILTER,
-                                 apply_order_filters,buy_filter,sell_filter)
+                                 USER_SIDES,ORDER_HISTORY_AFTER,
+                                 apply_order_filters,buy_filter,sell_filter,BOOK_KEY_FILTERS,BOOK_FILTER_MAPPING,
+                                 NORMALIZE_FEED_FILTERS,FEED_CACHE_KEY,IS_RESTRICTED,CAN_TAKE_OFFER,
+                                 NOT_BLOCKED,VIEWER_SIGNATURE)
 
 # Validation helpers
 from .p2p_validation_helpers import (validate_and_raise, validate_payment_methods, OfferValidator)
@@ -33,13 +36,26 @@ from .p2p_macro_helpers import (
     GET_TAKER_TYPE,
     PAYMENT_DEADLINE,
 
-    STATUS_TIME_FIELDS,
+    ORDER_TRANSITIONS,
+    ORDER_EVENT,
+    OFFER_EVENT,
 
     GET_SELLER_BUYER,
+    GET_OFFER_SELLER,
+    GET_ORDER_SELLER_BUYER,
     VALIDATE_BALANCE,
 
     GET_CURRENCY,
     CREATE_WALLET,
+    ESCROW_LOCK_ENTRY,
+    ESCROW_RELEASE_ENTRY,
+    ESCROW_CANCEL_ENTRY,
+    ESCROW_REPAIR_ENTRY,
+    WALLET_MUTATION_ENTRY,
+
+    get_page_size,
+    ENCODE_CURSOR,
+    decode_cursor,
 
     FORMAT_PERCENTAGE,
     FORMAT_TIME,
@@ -58,6 +74,14 @@ __all__ = [
     'extract_filters',
     'FILTER_MAPPING',
     'apply_filters',
+    'BOOK_KEY_FILTERS',
+    'BOOK_FILTER_MAPPING',
+    'NORMALIZE_FEED_FILTERS',
+    'FEED_CACHE_KEY',
+    'IS_RESTRICTED',
+    'CAN_TAKE_OFFER',
+    'NOT_BLOCKED',
+    'VIEWER_SIGNATURE',
 
     # Validation
     'validate_and_raise',
@@ -86,15 +110,26 @@ __all__ = [
 
     'ORDER_FILTER_MAP',
     'USER_FILTER',
+    'USER_SIDES',
+    'ORDER_HISTORY_AFTER',
     'buy_filter',
     'sell_filter',
 
     'apply_order_filters',
-    'STATUS_TIME_FIELDS',
+    'ORDER_TRANSITIONS',
+    'ORDER_EVENT',
+    'OFFER_EVENT',
 
     'GET_SELLER_BUYER',
+    'GET_OFFER_SELLER',
+    'GET_ORDER_SELLER_BUYER',
     'VALIDATE_BALANCE',
     'CREATE_WALLET',
+    'ESCROW_LOCK_ENTRY',
+    'ESCROW_RELEASE_ENTRY',
+    'ESCROW_CANCEL_ENTRY',
+    'ESCROW_REPAIR_ENTRY',
+    'WALLET_MUTATION_ENTRY',
 
     'GET_CURRENCY',
     'ORDER_FEEDBACK_RESPONSE',
@@ -104,6 +139,10 @@ __all__ = [
     'FORMAT_PERCENTAGE',
     'FORMAT_TIME',
 
+    'get_page_size',
+    'ENCODE_CURSOR',
+    'decode_cursor',
+
 
 ]
 
@@ -1,4 +1,6 @@
 # p2p_trading/helpers/filter_helpers.py
+import hashlib
+
 from django.db.models import Q
 
 from ..helpers.p2p_macro_helpers import  parse_date
@@ -30,14 +32,66 @@ FILTER_MAPPING = {
     'trade_type': lambda v, q: q.filter(trade_type=v.upper()),
     'crypto_currency': lambda v, q: q.filter(crypto_currency=v.upper()),
     'fiat_currency': lambda v, q: q.filter(fiat_currency=v),
-    'payment_method': lambda v, q: q.filter(payment_method_ids__contains=v)
+    'payment_method': lambda v, q: q.filter(payment_methods__payment_method_id=v),
+    'payment_type': lambda v, q: q.filter(payment_methods__payment_type__iexact=v).distinct()
+}
+
+# ================ HELPER MACROS ORDER BOOK ENGINE================
+
+# filters that select the book, same normalization as FILTER_MAPPING
+# (keep the order of the book key: crypto, fiat, trade type)
+BOOK_KEY_FILTERS = {
+    'crypto_currency': lambda v: v.upper(),
+    'fiat_currency': lambda v: v,
+    'trade_type': lambda v: v.upper(),
 }
 
+# filters applied on each offer of the selected books
+BOOK_FILTER_MAPPING = {
+    'payment_method': lambda v, offer: str(v) in {str(pid) for pid in (offer.payment_method_ids or [])},
+    'payment_type': lambda v, offer: v.upper() in {t.upper() for t in offer.payment_types},
+}
+
+# the offer asks something from the counterparty (minimum account age or holdings)
+IS_RESTRICTED = lambda offer: (
+    offer.counterparty_min_registration_days > 0 or offer.counterparty_min_holding_amount > 0
+)
+
+# the viewer {'registration_days': int, 'holdings': {currency: balance}} meets the offer restrictions
+CAN_TAKE_OFFER = lambda viewer, offer: (
+    offer.counterparty_min_registration_days <= viewer['registration_days']
+    and offer.counterparty_min_holding_amount <= viewer['holdings'].get(offer.crypto_currency, 0)
+)
+
+# the offer owner is not on the other side of a block with the viewer ('hidden' set of user ids)
+NOT_BLOCKED = lambda hidden, offer: offer.user_id not in hidden
+
+# viewers with the same stats and the same blocks see the same feed
+VIEWER_SIGNATURE = lambda viewer: f"{viewer['registration_days']}:" + ','.join(
+    f"{currency}={balance}" for currency, balance in sorted(viewer['holdings'].items())
+) + ':' + ','.join(str(user_id) for user_id in sorted(viewer.get('hidden', ())))
+
+# same feed asked with other case or order of the filters shares one normalized form
+NORMALIZE_FEED_FILTERS = lambda filters: tuple(sorted(
+    (k, BOOK_KEY_FILTERS[k](v) if k in BOOK_KEY_FILTERS else str(v).upper()) for k, v in filters.items() if v
+))
+
+# response cache key of one feed page, the parts are free text from the url so they are hashed
+FEED_CACHE_KEY = lambda *parts: 'p2p_feed_' + hashlib.md5(repr(parts).encode()).hexdigest()
+
 # ================ HELPER MACROS ORDER REPOSITORY================
 
 # filter if the user is taker or the maker for the order
 USER_FILTER = lambda user_id: Q(maker_id=user_id) | Q(taker_id=user_id)
 
+# one side of the user orders, the order history reads each side on its own index and unions them
+USER_SIDES = ('maker_id', 'taker_id')
+
+# orders after the (created_at, id) key of the last order of the previous page, newest first
+ORDER_HISTORY_AFTER = lambda created_at, order_id: (
+    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id)
+)
+
 def buy_filter(user_id):
     return Q(maker_id=user_id, offer__trade_type='BUY') | Q(taker_id=user_id, trade_type='BUY')
 
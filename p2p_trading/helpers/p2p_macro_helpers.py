@@ -1,12 +1,14 @@
 # p2p_trading/helpers/macro_helpers.py
 
-from decimal import Decimal
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from decimal import Decimal, InvalidOperation
 from datetime import datetime
 from django.utils import timezone
 from rest_framework import serializers
-from rest_framework.exceptions import  PermissionDenied
+from rest_framework.exceptions import  PermissionDenied, ValidationError
 
-from ..constants.constant import OrderStatus
+from ..constants.constant import OrderStatus, TransactionType, LedgerAccount
 from ..models.p2p_wallet_model import Wallet
 
 # ================ HELPER MACROS CONTROLLERS================
@@ -15,6 +17,40 @@ from ..models.p2p_wallet_model import Wallet
 GET_CONTEXT = lambda self: {'request': self.request}
 
 
+# ================ HELPER MACROS PAGINATION================
+# page size from the url, bounded by the max. page size
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def get_page_size(query_params, default=DEFAULT_PAGE_SIZE, max_size=MAX_PAGE_SIZE):
+    """read ?page_size= from the url, bad values fall back to the default"""
+    try:
+        size = int(query_params.get('page_size', default))
+    except (TypeError, ValueError):
+        return default
+    return min(max(size, 1), max_size)
+
+# opaque cursor of the last row in the page, e.g. (price, id) or (created_at, id)
+ENCODE_CURSOR = lambda *values: urlsafe_b64encode('|'.join(str(v) for v in values).encode()).decode()
+
+"""*************************************************************************************************************
+/*	function name:		    decode_cursor
+* 	function inputs:	    cursor string from the url, the type of each value in the cursor
+* 	function outputs:	    tuple of the values or None if there no cursor
+* 	function description:	turn the cursor back into the key of the last row of the previous page
+*   call back:              n/a
+*/
+*************************************************************************************************************"""
+def decode_cursor(cursor, *types):
+    if not cursor:
+        return None
+    try:
+        parts = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return tuple(cast(part) for cast, part in zip(types, parts, strict=True))
+    except (ValueError, TypeError, InvalidOperation, binascii.Error, UnicodeDecodeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+
+
 # ================ HELPER MACROS WALLET CONTROLLERS================
 
 # Macros
@@ -70,6 +106,12 @@ GET_SELLER_BUYER = lambda order: (
     (order.offer.user_id, order.taker_id) if order.offer.trade_type == 'SELL'
     else (order.taker_id, order.offer.user_id)
 )
+#seller and buyer from the taker side stored on the order, without reading the offer
+GET_ORDER_SELLER_BUYER = lambda order: (
+    (order.maker_id, order.taker_id) if order.trade_type == 'BUY' else (order.taker_id, order.maker_id)
+)
+#the seller of an order not created yet, the one whose wallet pays the escrow
+GET_OFFER_SELLER = lambda offer, taker_id: offer.user_id if offer.trade_type == 'SELL' else taker_id
 
 VALIDATE_BALANCE = lambda wallet, amount, balance_type='balance': (
     ValueError(f"Insufficient {balance_type}. Available: {getattr(wallet, balance_type)}, Required: {amount}")
@@ -167,12 +209,59 @@ def get_or_403(model, error_msg="Access denied", **kwargs):
         raise PermissionDenied(error_msg)
 
 # ================ HELPER MACROS ORDER REPOSITORY================
-#dic to update the time fields
-STATUS_TIME_FIELDS = {
-    OrderStatus.PAID: ('paid_at', timezone.now),
-    OrderStatus.COMPLETED: ('completed_at', timezone.now),
-    OrderStatus.CANCELLED: ('cancelled_at', timezone.now)
+#the order state machine, new status -> (statuses it can come from, who moves it, time field written with it,
+#only before the payment deadline)
+ORDER_TRANSITIONS = {
+    OrderStatus.PAID: ((OrderStatus.UNPAID,), 'buyer', 'paid_at', True),
+    OrderStatus.COMPLETED: ((OrderStatus.PAID,), 'seller', 'completed_at', False),
+    OrderStatus.CANCELLED: ((OrderStatus.UNPAID, OrderStatus.PAID, OrderStatus.APPEAL), 'maker', 'cancelled_at', False),
+}
+
+# ================ HELPER MACROS OUTBOX================
+#payloads of the outbox events, the state of the order/offer right after the change
+ORDER_EVENT = lambda order: {
+    'id': order.id, 'order_number': order.order_number, 'offer_id': order.offer_id,
+    'status': order.status, 'version': order.version, 'maker_id': order.maker_id, 'taker_id': order.taker_id,
+    'trade_type': order.trade_type, 'crypto_currency': order.crypto_currency, 'crypto_amount': order.crypto_amount,
+    'fiat_currency': order.fiat_currency, 'fiat_amount': order.fiat_amount, 'price': order.price,
 }
+OFFER_EVENT = lambda offer: {
+    'id': offer.id, 'user_id': offer.user_id, 'status': offer.status, 'is_deleted': offer.is_deleted,
+    'trade_type': offer.trade_type, 'crypto_currency': offer.crypto_currency, 'fiat_currency': offer.fiat_currency,
+    'price': offer.price, 'available_amount': offer.available_amount,
+}
+
+# ================ HELPER MACROS JOURNAL================
+#journal entries (event type, order id, legs), a leg is (user id, currency, account, amount, transaction type),
+#the user id of the external leg is None, the legs of an entry sum to zero
+ESCROW_LOCK_ENTRY = lambda order_id, seller_id, currency, amount: (TransactionType.LOCK_ESCROW, order_id, [
+    (seller_id, currency, LedgerAccount.BALANCE, -amount, TransactionType.LOCK_ESCROW),
+    (seller_id, currency, LedgerAccount.LOCKED, amount, TransactionType.LOCK_ESCROW),
+])
+ESCROW_RELEASE_ENTRY = lambda order_id, seller_id, buyer_id, currency, amount: (
+    TransactionType.RELEASE_ESCROW, order_id, [
+        (seller_id, currency, LedgerAccount.LOCKED, -amount, TransactionType.RELEASE_ESCROW),
+        (buyer_id, currency, LedgerAccount.BALANCE, amount, TransactionType.DEPOSIT),
+    ]
+)
+ESCROW_CANCEL_ENTRY = lambda order_id, seller_id, currency, amount: (TransactionType.CANCEL_ESCROW, order_id, [
+    (seller_id, currency, LedgerAccount.LOCKED, -amount, TransactionType.CANCEL_ESCROW),
+    (seller_id, currency, LedgerAccount.BALANCE, amount, TransactionType.CANCEL_ESCROW),
+])
+#the difference between the locked_balance of a wallet and its open orders (locked - expected) moved back
+#to its balance, or locked from it when the escrow is short
+ESCROW_REPAIR_ENTRY = lambda seller_id, currency, drift: (
+    ESCROW_CANCEL_ENTRY(None, seller_id, currency, drift) if drift > 0
+    else ESCROW_LOCK_ENTRY(None, seller_id, currency, -drift)
+)
+#any change of one wallet, what it does not move between its own accounts comes from (or goes to) outside
+WALLET_MUTATION_ENTRY = lambda user_id, currency, balance_delta, locked_delta, tx_type, order_id=None: (
+    tx_type, order_id, [
+        (user_id, currency, LedgerAccount.BALANCE, balance_delta, tx_type),
+        (user_id, currency, LedgerAccount.LOCKED, locked_delta, tx_type),
+        (None, currency, LedgerAccount.EXTERNAL, -(balance_delta + locked_delta), None),
+    ]
+)
 
 # ================ HELPER MACROS WALLET REPOSITORY================
 
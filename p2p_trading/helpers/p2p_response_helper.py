@@ -4,7 +4,7 @@ from rest_framework import status
 from rest_framework.response import Response
 
 # ================ HELPER MACROS OFFER CONTROLLERS================
-def success_response(data=None, message=None, count=None, status_code=status.HTTP_200_OK):
+def success_response(data=None, message=None, count=None, status_code=status.HTTP_200_OK, next_cursor=None):
     """if the response is success """
     response = {"success": True}
     if data is not None:
@@ -13,6 +13,8 @@ def success_response(data=None, message=None, count=None, status_code=status.HTT
         response["message"] = message
     if count is not None:
         response["count"] = count
+    if next_cursor is not None:
+        response["next_cursor"] = next_cursor
     return Response(response, status=status_code)
 
 def error_response(error, status_code=status.HTTP_400_BAD_REQUEST, details=None):
@@ -24,7 +26,9 @@ def error_response(error, status_code=status.HTTP_400_BAD_REQUEST, details=None)
 
 # ================ HELPER MACROS ORDER CONTROLLERS================
 # Response formatters
-ORDER_RESPONSE = lambda order, msg: {"order_id": str(order.id), "status": order.status, "message": msg}
+ORDER_RESPONSE = lambda order, msg: {
+    "order_id": str(order.id), "status": order.status, "version": order.version, "message": msg
+}
 
 
 # ================ HELPER MACROS PROFILE CONTROLLERS================
@@ -0,0 +1,152 @@
+# p2p_trading/management/commands/benchmark_offer_indexes.py
+"""EXPLAIN benchmark for the partial indexes of p2p_offer
+
+seeds a large offer table inside a transaction, runs EXPLAIN ANALYZE on the queries of the
+public feed and of my-offers, prints the plan of each query and rolls everything back.
+
+    python manage.py benchmark_offer_indexes --rows 1000000
+"""
+
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from ...constants.constant import OfferStatus, TradeType
+from ...models.p2p_offer_model import P2POffer
+from ...repositories.p2p_offer_repository import P2POfferRepository
+
+PUBLIC_FEED_INDEX = 'p2p_offer_public_feed_idx'
+USER_CREATED_INDEX = 'p2p_offer_user_created_idx'
+
+CRYPTOS = ['USDT', 'USDC', 'BTC', 'ETH', 'BNB']
+FIATS = ['EGP', 'USD', 'EUR', 'SAR']
+USERS = 50000
+
+# one row per offer, ~80% of them are public, the rest are deleted, inactive or sold out.
+# user 1 is a heavy maker with 5% of the offers, the others share the rest
+SEED_SQL = """
+    INSERT INTO p2p_offer (
+        user_id, trade_type, crypto_currency, fiat_currency, price_type, price,
+        total_amount, available_amount, min_order_limit, max_order_limit, payment_method_ids,
+        payment_time_limit_minutes, counterparty_min_registration_days,
+        counterparty_min_holding_amount, status, created_at, updated_at, is_deleted
+    )
+    SELECT
+        CASE WHEN g %% 20 = 0 THEN 1 ELSE 2 + (g::bigint * 7919) %% %(users)s END,
+        CASE WHEN g %% 2 = 0 THEN %(buy)s ELSE %(sell)s END,
+        (%(cryptos)s::varchar[])[1 + (g / 2) %% %(n_cryptos)s],
+        (%(fiats)s::varchar[])[1 + (g / 10) %% %(n_fiats)s],
+        'FIXED',
+        round((10 + random() * 90)::numeric, 2),
+        1000,
+        CASE WHEN g %% 17 = 0 THEN 0 ELSE 500 END,
+        10,
+        10000,
+        '[1]'::jsonb,
+        15,
+        0,
+        0,
+        CASE WHEN g %% 13 = 0 THEN %(inactive)s ELSE %(active)s END,
+        now() - (g || ' seconds')::interval,
+        now(),
+        g %% 11 = 0
+    FROM generate_series(1, %(rows)s) AS g
+"""
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the public feed and my-offers queries on a seeded offer table (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='number of offers to seed')
+        parser.add_argument('--page-size', type=int, default=50)
+
+    def handle(self, *args, **options):
+        database = router.db_for_write(P2POffer)
+        connection = connections[database]
+        if connection.vendor != 'postgresql':
+            raise CommandError('the partial indexes are only benchmarked on postgresql')
+
+        with transaction.atomic(using=database):
+            self.seed(connection, options['rows'])
+            failed = [name for name, plan in self.plans(options['page_size']) if not self.report(name, plan)]
+            # nothing from the benchmark is kept
+            transaction.set_rollback(True, using=database)
+
+        if failed:
+            raise CommandError(f"queries not served by the partial indexes: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS('all the queries are served by the partial indexes without a sort'))
+
+    def seed(self, connection, rows):
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(SEED_SQL, {
+                'rows': rows, 'users': USERS,
+                'cryptos': CRYPTOS, 'n_cryptos': len(CRYPTOS),
+                'fiats': FIATS, 'n_fiats': len(FIATS),
+                'buy': TradeType.BUY.value, 'sell': TradeType.SELL.value,
+                'active': OfferStatus.ACTIVE.value, 'inactive': OfferStatus.INACTIVE.value,
+            })
+            cursor.execute('ANALYZE p2p_offer')
+        self.stdout.write(f'seeded {rows} offers in {time.perf_counter() - start:.1f}s')
+
+    """*************************************************************************************************************
+    /*	function name:		    plans
+    * 	function inputs:	    page size
+    * 	function outputs:	    (name, expected index, queryset) of each benchmarked query
+    * 	function description:	the same querysets the repositories run, the first page of the feed on both sides,
+                                the order book reload of one pair, the pair count and the first page of my-offers
+    *   call back:              P2POfferRepository.PUBLIC_QUERY, P2POfferRepository.get_by_user_and_filters()
+    */
+    *************************************************************************************************************"""
+    def plans(self, page_size):
+        pair = P2POfferRepository.PUBLIC_QUERY.filter(crypto_currency=CRYPTOS[0], fiat_currency=FIATS[0])
+        queries = [
+            ('feed SELL page', PUBLIC_FEED_INDEX,
+             pair.filter(trade_type=TradeType.SELL).order_by('price', 'id')[:page_size]),
+            ('feed BUY page', PUBLIC_FEED_INDEX,
+             pair.filter(trade_type=TradeType.BUY).order_by('-price', '-id')[:page_size]),
+            ('book pair reload', PUBLIC_FEED_INDEX,
+             pair.filter(trade_type=TradeType.SELL)),
+            ('feed pair count', PUBLIC_FEED_INDEX,
+             pair.filter(trade_type=TradeType.SELL).values('id')),
+            ('my offers page', USER_CREATED_INDEX,
+             P2POfferRepository.get_by_user_and_filters(1, {})[:page_size]),
+        ]
+        for name, index, queryset in queries:
+            if name == 'feed pair count':
+                sql, params = queryset.query.sql_with_params()
+                explained = self.explain_sql(f'SELECT count(*) FROM ({sql}) AS feed', params)
+            else:
+                explained = queryset.explain(format='json', analyze=True, buffers=True)
+            yield name, (index, json.loads(explained)[0])
+
+    @staticmethod
+    def explain_sql(sql, params):
+        connection = connections[router.db_for_read(P2POffer)]
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return plan if isinstance(plan, str) else json.dumps(plan)
+
+    def report(self, name, plan):
+        """print the plan nodes, ok when the expected index is used without a seq scan or a sort"""
+        index, explained = plan
+        nodes = list(self.walk(explained['Plan']))
+        used = {node.get('Index Name') for node in nodes}
+        sorted_ = any(node['Node Type'] in ('Sort', 'Incremental Sort') for node in nodes)
+        ok = index in used and not sorted_ and not any(node['Node Type'] == 'Seq Scan' for node in nodes)
+
+        style = self.style.SUCCESS if ok else self.style.ERROR
+        self.stdout.write(style(f"{'ok  ' if ok else 'FAIL'} {name}: {explained['Execution Time']:.2f} ms"))
+        for node in nodes:
+            detail = f" using {node['Index Name']}" if node.get('Index Name') else ''
+            self.stdout.write(f"       {node['Node Type']}{detail} rows={node.get('Actual Rows')}")
+        return ok
+
+    def walk(self, node):
+        yield node
+        for child in node.get('Plans', []):
+            yield from self.walk(child)
@@ -0,0 +1,93 @@
+# p2p_trading/management/commands/benchmark_offer_serializers.py
+"""DRF vs compiled offer serializers
+
+renders the same in-memory offers (no database) with the DRF serializers and with the compiled ones,
+prints the serialization time of both paths for each size (the json rendering is the same for both
+and is left out) and checks that the rendered json is byte-identical.
+
+    python manage.py benchmark_offer_serializers --sizes 1000 10000 100000
+"""
+
+import random
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from ...constants.constant import OfferStatus, PriceType, TradeType
+from ...models.p2p_offer_model import P2POffer
+from ...serializers.p2p_offer_serilaizer import (
+    P2POfferPublicSerializer, P2POfferListSerializer, P2POfferDetailSerializer
+)
+from ...serializers.p2p_offer_fast_serializer import (
+    FAST_PUBLIC_SERIALIZER, FAST_LIST_SERIALIZER, FAST_DETAIL_SERIALIZER
+)
+
+PAYMENT_DETAILS = {
+    1: {'type': 'BANK_TRANSFER', 'display_name': 'BANK_TRANSFER - Seller'},
+    2: {'type': 'VODAFONE_CASH', 'display_name': 'VODAFONE_CASH - ****1234'},
+}
+CASES = [
+    ('public', P2POfferPublicSerializer, FAST_PUBLIC_SERIALIZER),
+    ('list', P2POfferListSerializer, FAST_LIST_SERIALIZER),
+    ('detail', P2POfferDetailSerializer, FAST_DETAIL_SERIALIZER),
+]
+
+
+class Command(BaseCommand):
+    help = 'time the DRF and the compiled offer serializers on the same offers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        renderer = JSONRenderer()
+        context = {'payment_details_map': PAYMENT_DETAILS}
+
+        for size in options['sizes']:
+            offers = [self.make_offer(rng, offer_id) for offer_id in range(1, size + 1)]
+            for name, serializer_class, compiled in CASES:
+                start = time.perf_counter()
+                reference = serializer_class(offers, many=True, context=context).data
+                drf_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                fast = compiled.render_many(offers, context)
+                fast_time = time.perf_counter() - start
+
+                if renderer.render(fast) != renderer.render(reference):
+                    raise CommandError(f'{name}: the compiled output differs from the DRF output at {size} offers')
+                self.stdout.write(
+                    f"{name:<7} {size:>7} offers: drf {drf_time * 1000:9.1f} ms  "
+                    f"compiled {fast_time * 1000:9.1f} ms  x{drf_time / fast_time:.1f}"
+                )
+        self.stdout.write(self.style.SUCCESS('the compiled output is byte-identical on every size'))
+
+    @staticmethod
+    def make_offer(rng, offer_id):
+        """unsaved offer with the fields of the feed, half fixed and half floating"""
+        total = Decimal(rng.randint(100, 100000))
+        floating = offer_id % 2 == 0
+        now = timezone.now()
+        offer = P2POffer(
+            id=offer_id, user_id=rng.randint(1, 5000),
+            trade_type=rng.choice(TradeType.values), crypto_currency='USDT', fiat_currency='EGP',
+            price_type=PriceType.FLOATING if floating else PriceType.FIXED,
+            price=Decimal(rng.randint(4500, 5500)) / 100,
+            price_margin=Decimal(rng.randint(-1000, 1000)) / 100 if floating else None,
+            total_amount=total, available_amount=(total * Decimal(rng.randint(0, 100)) / 100).quantize(Decimal('1e-8')),
+            min_order_limit=Decimal('100.00'), max_order_limit=Decimal('10000.00'),
+            payment_method_ids=rng.sample(sorted(PAYMENT_DETAILS), rng.randint(1, 2)),
+            payment_time_limit_minutes=15, status=OfferStatus.ACTIVE, created_at=now, updated_at=now,
+        )
+        # every third advertiser has no profile yet
+        offer.user_profile = None if offer_id % 3 == 0 else SimpleNamespace(
+            nickname=f'maker{offer.user_id}', total_30d_trades=rng.randint(0, 500),
+            completion_rate_30d=rng.randint(5000, 10000) / 100
+        )
+        return offer
@@ -0,0 +1,163 @@
+# p2p_trading/management/commands/benchmark_order_intake.py
+"""concurrent takers on one hot offer, row lock vs conditional update reservation
+
+N takers (threads, one database connection each) take orders from the same offer at the same time through
+P2POrderService.create_order_from_offer. the offer holds less crypto than the takers ask for, so part of
+the orders are refused. for each reservation path (P2P_ORDER_RESERVATION: lock, conditional) and each N it
+prints the throughput and the latency, then checks:
+
+    - no deadlock and no other database error
+    - no oversell: the orders sum to what left the offer and available_amount never went below 0
+    - the seller wallet locked exactly the sum of the orders, balance + locked_balance did not change
+    - every refused order left nothing behind (one order and one LOCK_ESCROW transaction per accepted order)
+
+the benchmark rows (offer, orders, wallet, transactions, outbox events) are deleted at the end of each run.
+
+    python manage.py benchmark_order_intake --takers 1 8 64 --orders 50
+    python manage.py benchmark_order_intake --paths conditional
+"""
+
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+from django.db.models import Sum
+from rest_framework.exceptions import APIException
+
+from ...constants.constant import OfferStatus, PriceType, TradeType, TransactionType
+from ...engines.p2p_order_book_engine import ORDER_BOOK
+from ...models.p2p_offer_model import P2POffer
+from ...models.p2p_journal_model import JournalEntry, Posting
+from ...models.p2p_order_model import P2POrder
+from ...models.p2p_outbox_model import OutboxEvent
+from ...models.p2p_transaction_model import Transaction
+from ...models.p2p_wallet_model import Wallet
+from ...services.p2p_order_service import P2POrderService, RESERVATIONS
+
+# user ids far from the real ones, nothing is read from the users tables
+MAKER_ID = 2100000000
+PRICE = Decimal('50.00')
+FIAT_AMOUNT = Decimal('100.00')
+CRYPTO_AMOUNT = FIAT_AMOUNT / PRICE
+
+
+class Command(BaseCommand):
+    help = 'N parallel takers on one hot offer: throughput, latency, no deadlock and no oversell'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', nargs='+', choices=list(RESERVATIONS), default=list(RESERVATIONS))
+        parser.add_argument('--takers', type=int, nargs='+', default=[1, 8, 64])
+        parser.add_argument('--orders', type=int, default=50, help='orders tried by each taker')
+        parser.add_argument('--capacity', type=float, default=0.75,
+                            help='share of the asked crypto the offer can give')
+
+    def handle(self, *args, **options):
+        failed = []
+        for path in options['paths']:
+            for takers in options['takers']:
+                if not self.run(path, takers, options['orders'], options['capacity']):
+                    failed.append(f'{path} with {takers} takers')
+        if failed:
+            raise CommandError(f"order intake broke: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS('no deadlock and no oversell on any path with any number of takers'))
+
+    """*************************************************************************************************************
+    /*	function name:		    run
+    * 	function inputs:	    reservation path, number of takers, orders per taker, capacity share
+    * 	function outputs:	    True when every check passed
+    * 	function description:	seed the hot offer and the seller wallet, start the takers together on a barrier,
+                                report the numbers, check the rows and delete them
+    *   call back:              take(), verify()
+    */
+    *************************************************************************************************************"""
+    def run(self, path, takers, orders, capacity):
+        asked = CRYPTO_AMOUNT * takers * orders
+        supply = (asked * Decimal(str(capacity))).quantize(CRYPTO_AMOUNT)
+        offer = P2POffer.objects.create(
+            user_id=MAKER_ID, trade_type=TradeType.SELL, crypto_currency='USDT', fiat_currency='EGP',
+            price_type=PriceType.FIXED, price=PRICE, total_amount=supply, available_amount=supply,
+            min_order_limit=FIAT_AMOUNT, max_order_limit=FIAT_AMOUNT, status=OfferStatus.ACTIVE,
+        )
+        # the wallet keeps locked_balance <= balance (wallet constraint), twice the supply covers every order
+        wallet, _ = Wallet.objects.update_or_create(
+            user_id=MAKER_ID, currency='USDT', defaults={'balance': supply * 2, 'locked_balance': 0}
+        )
+        results = {'latencies': [], 'refused': [], 'errors': []}
+        barrier = threading.Barrier(takers + 1)
+        threads = [
+            threading.Thread(target=self.take, args=(path, MAKER_ID + taker, offer.id, orders, barrier, results))
+            for taker in range(1, takers + 1)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            latencies = sorted(results['latencies'])
+            percentile = lambda p: (
+                latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+            )
+            self.stdout.write(
+                f"{path:<11} {takers:>3} takers: {len(latencies)} created, {len(results['refused'])} refused in {elapsed:.2f}s  "
+                f"{len(latencies) / elapsed:8.1f} orders/s  p50 {percentile(0.5):.1f} ms  p99 {percentile(0.99):.1f} ms"
+            )
+            return self.verify(offer, wallet, supply, len(latencies), results['errors'])
+        finally:
+            self.cleanup(offer, wallet)
+
+    def take(self, path, taker_id, offer_id, orders, barrier, results):
+        """one taker thread, its own connection, refused orders are expected once the offer is sold out"""
+        barrier.wait()
+        try:
+            for _ in range(orders):
+                start = time.perf_counter()
+                try:
+                    P2POrderService.create_order_from_offer(
+                        taker_id, {'offer_id': offer_id, 'fiat_amount': str(FIAT_AMOUNT)}, reservation=path
+                    )
+                    results['latencies'].append(time.perf_counter() - start)
+                except APIException as e:
+                    results['refused'].append(str(e))
+                except DatabaseError as e:
+                    results['errors'].append(str(e))
+        finally:
+            connections.close_all()
+
+    def verify(self, offer, wallet, supply, created, errors):
+        offer.refresh_from_db()
+        wallet.refresh_from_db()
+        ordered = P2POrder.objects.filter(offer_id=offer.id).aggregate(total=Sum('crypto_amount'))['total'] or 0
+        checks = [
+            (not errors, f"{len(errors)} database errors, first: {errors[0] if errors else ''}"),
+            (offer.available_amount >= 0, f"available amount went below 0: {offer.available_amount}"),
+            (ordered + offer.available_amount == supply, f"oversell: {ordered} ordered from {supply}"),
+            (P2POrder.objects.filter(offer_id=offer.id).count() == created, "orders written for refused takers"),
+            (wallet.locked_balance == ordered, f"wallet locked {wallet.locked_balance} for {ordered} ordered"),
+            (wallet.balance + wallet.locked_balance == supply * 2, "the wallet total changed"),
+            (Transaction.objects.filter(wallet=wallet, transaction_type=TransactionType.LOCK_ESCROW).count()
+             == created, "escrow transactions do not match the orders"),
+        ]
+        for ok, error in checks:
+            if not ok:
+                self.stdout.write(self.style.ERROR(f"     {error}"))
+        return all(ok for ok, _ in checks)
+
+    @staticmethod
+    def cleanup(offer, wallet):
+        entries = list(JournalEntry.objects.filter(postings__wallet=wallet).values_list('id', flat=True).distinct())
+        Posting.objects.filter(entry_id__in=entries).delete()
+        JournalEntry.objects.filter(id__in=entries).delete()
+        Transaction.objects.filter(wallet=wallet).delete()
+        OutboxEvent.objects.filter(
+            aggregate_type='order', aggregate_id__in=P2POrder.objects.filter(offer_id=offer.id).values('id')
+        ).delete()
+        P2POrder.objects.filter(offer_id=offer.id).delete()
+        ORDER_BOOK.discard(offer.id)
+        offer.delete()
+        wallet.delete()
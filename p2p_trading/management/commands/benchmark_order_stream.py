@@ -0,0 +1,196 @@
+# p2p_trading/management/commands/benchmark_order_stream.py
+"""load test of the order status stream: N idle subscribers on one worker, then a burst of status changes
+
+the subscribers are real ASGI connections of configurations/asgi.py (OrderStreamRouter) served in memory
+on one event loop, as one ASGI worker serves them, each one with its own signed access token. the status
+changes are published from another thread through ORDER_STREAM, as the order service does after a commit.
+it prints the connect time, the memory held per idle subscriber, the event loop lag while idle, and the
+delivery latency of the burst, then checks:
+
+    - every subscriber was accepted and received every message of its user, nothing was dropped
+    - the event loop stays responsive with all the subscribers connected
+    - every subscription is released when the clients disconnect
+
+no socket is opened, the numbers are the cost of the stream code itself (the ASGI server adds its own
+per connection cost on top).
+
+    python manage.py benchmark_order_stream                            # 10k websocket subscribers
+    python manage.py benchmark_order_stream --subscribers 20000 --transport sse --messages 5000
+"""
+
+import asyncio
+import json
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ...controllers.p2p_order_stream_controller import OrderStreamRouter, WEBSOCKET_PATH, EVENTS_PATH
+from ...engines.p2p_order_stream import ORDER_STREAM
+
+# user ids far from the real ones, nothing is read from the users tables
+FIRST_USER_ID = 2100000000
+# the event loop must answer a 10 ms sleep within this many ms while the subscribers idle
+MAX_LOOP_LAG_MS = 100
+
+
+class Command(BaseCommand):
+    help = 'N idle order stream subscribers on one worker: memory, loop lag and fan-out latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=10000)
+        parser.add_argument('--transport', choices=['websocket', 'sse'], default='websocket')
+        parser.add_argument('--messages', type=int, default=1000, help='status changes published in the burst')
+        parser.add_argument('--idle', type=float, default=1.0, help='seconds the subscribers stay idle')
+
+    def handle(self, *args, **options):
+        try:
+            str(AccessToken())
+        except Exception as e:
+            raise CommandError(f"access tokens cannot be signed, check SIMPLE_JWT SIGNING_KEY: {str(e)}")
+        baseline = ORDER_STREAM.subscribers()
+        report = asyncio.run(self.run(**{k: options[k] for k in ('subscribers', 'transport', 'messages', 'idle')}))
+        report['left'] = ORDER_STREAM.subscribers() - baseline
+
+        self.stdout.write(
+            f"{report['subscribers']} {options['transport']} subscribers connected in {report['connect']:.2f}s, "
+            f"{report['memory'] / max(report['subscribers'], 1) / 1024:.1f} KiB each, idle loop lag {report['lag']:.1f} ms"
+        )
+        self.stdout.write(
+            f"{report['sent']} status changes delivered {report['delivered']} times in {report['burst']:.2f}s  "
+            f"p50 {report['p50']:.1f} ms  p99 {report['p99']:.1f} ms"
+        )
+        if not self.verify(report, options['messages']):
+            raise CommandError('the order stream broke under the load')
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['subscribers']} idle subscribers held by one worker, every message delivered"
+        ))
+
+    """*************************************************************************************************************
+    /*	function name:		    run
+    * 	function inputs:	    number of subscribers, transport, messages in the burst, idle seconds
+    * 	function outputs:	    dict of the measures
+    * 	function description:	connect the subscribers to the ASGI router, measure the memory and the loop lag
+                                while they idle, publish the burst from a worker thread and wait for every
+                                delivery, then disconnect them all
+    *   call back:              connect(), publish_burst()
+    */
+    *************************************************************************************************************"""
+    async def run(self, subscribers, transport, messages, idle):
+        router = OrderStreamRouter(None)
+        tokens = [str(self.token(FIRST_USER_ID + n)) for n in range(subscribers)]
+        expected = {n: 0 for n in range(subscribers)}
+        for n in range(messages):
+            expected[n % subscribers] += 1
+        state = {'accepted': 0, 'received': [0] * subscribers, 'latencies': [], 'errors': []}
+        all_accepted, all_delivered = asyncio.Event(), asyncio.Event()
+        total = sum(expected.values())
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        connections = [
+            self.connect(router, transport, tokens[n], n, state, subscribers, total, all_accepted, all_delivered)
+            for n in range(subscribers)
+        ]
+        try:
+            await asyncio.wait_for(all_accepted.wait(), timeout=max(60, subscribers / 100))
+        except asyncio.TimeoutError:
+            state['errors'].append(f"{subscribers - state['accepted']} subscribers were not accepted")
+        connect = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        # loop lag while everybody idles
+        lag = 0.0
+        end = time.perf_counter() + idle
+        while time.perf_counter() < end:
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag = max(lag, (time.perf_counter() - before - 0.01) * 1000)
+
+        start = time.perf_counter()
+        publisher = threading.Thread(target=self.publish_burst, args=(messages, subscribers))
+        publisher.start()
+        if total:
+            try:
+                await asyncio.wait_for(all_delivered.wait(), timeout=max(30, messages / 100))
+            except asyncio.TimeoutError:
+                state['errors'].append('the burst was not delivered in time')
+        burst = time.perf_counter() - start
+        publisher.join()
+
+        for receive_queue, task in connections:
+            receive_queue.put_nowait({'type': 'websocket.disconnect' if transport == 'websocket' else 'http.disconnect'})
+        await asyncio.gather(*(task for _, task in connections), return_exceptions=True)
+
+        latencies = sorted(state['latencies'])
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+        return {
+            'subscribers': state['accepted'], 'connect': connect, 'memory': memory, 'lag': lag,
+            'sent': messages, 'delivered': len(latencies), 'burst': burst,
+            'p50': percentile(0.5), 'p99': percentile(0.99), 'errors': state['errors'],
+            'missing': sum(1 for n, count in expected.items() if state['received'][n] != count),
+        }
+
+    def connect(self, router, transport, token, n, state, subscribers, total, all_accepted, all_delivered):
+        """one in-memory ASGI connection, its send() counts the messages and the delivery latency"""
+        receive_queue = asyncio.Queue()
+        if transport == 'websocket':
+            scope = {'type': 'websocket', 'path': WEBSOCKET_PATH, 'query_string': f'token={token}'.encode(),
+                     'headers': []}
+            receive_queue.put_nowait({'type': 'websocket.connect'})
+        else:
+            scope = {'type': 'http', 'method': 'GET', 'path': EVENTS_PATH, 'query_string': b'',
+                     'headers': [(b'authorization', f'Bearer {token}'.encode())]}
+            receive_queue.put_nowait({'type': 'http.request', 'body': b'', 'more_body': False})
+
+        async def send(event):
+            if event['type'] == 'websocket.close' or event.get('status', 200) != 200:
+                state['errors'].append(f"subscriber {n} refused")
+                return
+            text = event.get('text') or event.get('body', b'').decode()
+            if not text or text.startswith(':'):
+                return
+            message = json.loads(text if 'text' in event else text.split('data: ', 1)[1])
+            if message['type'] == 'subscribed':
+                state['accepted'] += 1
+                if state['accepted'] == subscribers:
+                    all_accepted.set()
+            elif message['type'] == 'order.status':
+                state['received'][n] += 1
+                state['latencies'].append(time.perf_counter() - message['sent_at'])
+                if len(state['latencies']) == total:
+                    all_delivered.set()
+
+        return receive_queue, asyncio.ensure_future(router(scope, receive_queue.get, send))
+
+    @staticmethod
+    def publish_burst(messages, subscribers):
+        """the status changes, published from a worker thread like the order service after its commits"""
+        for n in range(messages):
+            user_id = FIRST_USER_ID + n % subscribers
+            ORDER_STREAM.publish([((user_id,), {
+                'type': 'order.status', 'order_id': n, 'status': 'PAID', 'version': 1, 'sent_at': time.perf_counter(),
+            })])
+
+    @staticmethod
+    def token(user_id):
+        token = AccessToken()
+        token[api_settings.USER_ID_CLAIM] = user_id
+        return token
+
+    def verify(self, report, messages):
+        checks = [
+            (not report['errors'], f"{len(report['errors'])} errors, first: {report['errors'][:1]}"),
+            (report['delivered'] == messages and not report['missing'],
+             f"{report['missing']} subscribers missed messages"),
+            (report['lag'] < MAX_LOOP_LAG_MS, f"event loop lag {report['lag']:.1f} ms while idle"),
+            (report['left'] == 0, f"{report['left']} subscriptions left after the disconnects"),
+        ]
+        for ok, error in checks:
+            if not ok:
+                self.stdout.write(self.style.ERROR(f"     {error}"))
+        return all(ok for ok, _ in checks)
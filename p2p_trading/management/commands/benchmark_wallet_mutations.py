@@ -0,0 +1,200 @@
+# p2p_trading/management/commands/benchmark_wallet_mutations.py
+"""concurrent mutations of one hot wallet, read-modify-write vs a journal entry (conditional UPDATE ... RETURNING)
+
+N writers (threads, one database connection each) deposit 1 into the same wallet M times, each deposit in
+its own transaction with its DEPOSIT transaction row, through:
+
+    read_modify_write   read the wallet, balance += 1, save(), the running balance from the read (the old path)
+    journal             WalletService.mutate_wallet(), one journal entry: the database adds the delta, and
+                        writes the entry, its postings and the transaction with the balance it returned
+
+for each path and each N it prints the throughput, the latency and the lost updates, then checks the journal
+path: no lost update, and the running balances of the transactions are exactly balance + 1 .. balance + N*M
+(each deposit saw its own new balance, without reading the wallet). a last run locks and unlocks escrow
+in a loop against a wallet that can lock only part of the asks, no change may break locked <= balance.
+
+the benchmark wallet and its transactions are deleted at the end of each run.
+
+    python manage.py benchmark_wallet_mutations --writers 1 8 32 --mutations 100
+"""
+
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, transaction
+
+from ...constants.constant import TransactionType
+from ...models.p2p_journal_model import JournalEntry, Posting
+from ...models.p2p_transaction_model import Transaction
+from ...models.p2p_wallet_model import Wallet
+from ...services.p2p_wallet_service import WalletService
+
+# user id far from the real ones, nothing is read from the users tables
+WALLET_USER_ID = 2100000000
+CURRENCY = 'USDT'
+DEPOSIT = Decimal('1')
+
+
+class Command(BaseCommand):
+    help = 'N parallel writers on one wallet: throughput, latency and lost updates of each mutation path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', nargs='+', choices=list(self.PATHS), default=list(self.PATHS))
+        parser.add_argument('--writers', type=int, nargs='+', default=[1, 8, 32])
+        parser.add_argument('--mutations', type=int, default=100, help='deposits made by each writer')
+
+    def handle(self, *args, **options):
+        failed = []
+        for path in options['paths']:
+            for writers in options['writers']:
+                if not self.run(path, writers, options['mutations']):
+                    failed.append(f'{path} with {writers} writers')
+        if not self.run_escrow(max(options['writers']), options['mutations']):
+            failed.append('escrow lock/unlock')
+        if failed:
+            raise CommandError(f"wallet mutations broke: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS('no lost update and exact running balances on the journal path'))
+
+    # ================ MUTATION PATHS ================
+    @staticmethod
+    def read_modify_write(wallet_id):
+        """the old path: full-row read, python addition, full-row save, running balance from the read"""
+        with transaction.atomic():
+            wallet = Wallet.objects.get(id=wallet_id)
+            wallet.balance += DEPOSIT
+            wallet.save()
+            Transaction.objects.create(wallet=wallet, transaction_type=TransactionType.DEPOSIT, amount=DEPOSIT,
+                                       running_balance=wallet.balance)
+
+    @staticmethod
+    def journal(wallet_id):
+        WalletService.mutate_wallet(WALLET_USER_ID, CURRENCY, DEPOSIT, 0, TransactionType.DEPOSIT)
+
+    PATHS = {'read_modify_write': read_modify_write, 'journal': journal}
+
+    """*************************************************************************************************************
+    /*	function name:		    run
+    * 	function inputs:	    mutation path, number of writers, deposits per writer
+    * 	function outputs:	    True when every check of the path passed
+    * 	function description:	seed the wallet, start the writers together on a barrier, report the numbers,
+                                check the balance and the running balances, delete the rows
+    *   call back:              mutate(), verify()
+    */
+    *************************************************************************************************************"""
+    def run(self, path, writers, mutations):
+        wallet = self.seed(Decimal('0'))
+        results = {'latencies': [], 'errors': []}
+        try:
+            elapsed = self.start(writers, lambda: self.mutate(self.PATHS[path], wallet.id, mutations, results))
+            wallet.refresh_from_db()
+            expected = writers * mutations
+            lost = expected - int(wallet.balance)
+            self.report(path, writers, results, elapsed, f"{lost} lost updates")
+            return path != 'journal' or self.verify(wallet, expected, lost, results['errors'])
+        finally:
+            self.cleanup(wallet)
+
+    def run_escrow(self, writers, mutations):
+        """lock then unlock escrow in a loop, the wallet covers the locks of half of the writers at a time"""
+        amount = Decimal('10')
+        # locked_balance <= balance lets a wallet lock half of what it holds
+        wallet = self.seed(amount * writers)
+        results = {'latencies': [], 'errors': [], 'refused': []}
+
+        def lock_unlock(wallet_id):
+            # two commits, the locks of the other writers pile up in between
+            try:
+                WalletService.mutate_wallet(WALLET_USER_ID, CURRENCY, -amount, amount, TransactionType.LOCK_ESCROW)
+            except ValueError:
+                results['refused'].append(wallet_id)
+                return
+            WalletService.mutate_wallet(WALLET_USER_ID, CURRENCY, amount, -amount, TransactionType.CANCEL_ESCROW)
+
+        try:
+            elapsed = self.start(writers, lambda: self.mutate(lock_unlock, wallet.id, mutations, results))
+            wallet.refresh_from_db()
+            self.report('escrow', writers, results, elapsed, f"{len(results['refused'])} refused locks")
+            checks = [
+                (not results['errors'], f"{len(results['errors'])} database errors: {results['errors'][:1]}"),
+                ((wallet.balance, wallet.locked_balance) == (amount * writers, 0), "the escrow did not come back"),
+            ]
+            return self.passed(checks)
+        finally:
+            self.cleanup(wallet)
+
+    # ================ HELPERS ================
+    @staticmethod
+    def seed(balance):
+        wallet, _ = Wallet.objects.update_or_create(
+            user_id=WALLET_USER_ID, currency=CURRENCY, defaults={'balance': balance, 'locked_balance': 0}
+        )
+        return wallet
+
+    @staticmethod
+    def start(writers, target):
+        """run the writers together, returns the elapsed seconds"""
+        barrier = threading.Barrier(writers + 1)
+
+        def writer():
+            barrier.wait()
+            target()
+
+        threads = [threading.Thread(target=writer) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    @staticmethod
+    def mutate(mutation, wallet_id, mutations, results):
+        """one writer thread, its own connection"""
+        try:
+            for _ in range(mutations):
+                start = time.perf_counter()
+                try:
+                    mutation(wallet_id)
+                    results['latencies'].append(time.perf_counter() - start)
+                except DatabaseError as e:
+                    results['errors'].append(str(e))
+        finally:
+            connections.close_all()
+
+    def report(self, path, writers, results, elapsed, outcome):
+        latencies = sorted(results['latencies'])
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+        self.stdout.write(
+            f"{path:<17} {writers:>3} writers: {len(latencies)} mutations in {elapsed:.2f}s  "
+            f"{len(latencies) / elapsed:8.1f}/s  p50 {percentile(0.5):.1f} ms  p99 {percentile(0.99):.1f} ms  "
+            f"{outcome}"
+        )
+
+    def verify(self, wallet, expected, lost, errors):
+        running = sorted(
+            Transaction.objects.filter(wallet=wallet).values_list('running_balance', flat=True)
+        )
+        checks = [
+            (not errors, f"{len(errors)} database errors, first: {errors[0] if errors else ''}"),
+            (lost == 0, f"{lost} lost updates"),
+            (running == [Decimal(n) for n in range(1, expected + 1)],
+             "the running balances are not one per deposit from 1 to the final balance"),
+        ]
+        return self.passed(checks)
+
+    def passed(self, checks):
+        for ok, error in checks:
+            if not ok:
+                self.stdout.write(self.style.ERROR(f"     {error}"))
+        return all(ok for ok, _ in checks)
+
+    @staticmethod
+    def cleanup(wallet):
+        entries = list(JournalEntry.objects.filter(postings__wallet=wallet).values_list('id', flat=True).distinct())
+        Posting.objects.filter(entry_id__in=entries).delete()
+        JournalEntry.objects.filter(id__in=entries).delete()
+        Transaction.objects.filter(wallet=wallet).delete()
+        wallet.delete()
@@ -0,0 +1,41 @@
+# p2p_trading/management/commands/check_escrow.py
+"""compare the locked_balance of the wallets with the crypto of the open orders of their sellers
+
+    python manage.py check_escrow                   # every wallet
+    python manage.py check_escrow --incremental     # the wallets touched since the last finished run
+    python manage.py check_escrow --repair          # post the differences back as journal entries
+
+every run and every drifted wallet is kept (EscrowCheck, EscrowDrift). exits with an error when a drift
+is left unrepaired.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...engines.p2p_escrow_checker import ESCROW_CHECKER
+
+
+class Command(BaseCommand):
+    help = 'Diff the wallets locked balances against the open orders, optionally repair them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true', help='only the wallets touched since the last run')
+        parser.add_argument('--repair', action='store_true', help='move the differences with journal entries')
+        parser.add_argument('--limit', type=int, default=100, help='drifted wallets printed')
+
+    def handle(self, *args, **options):
+        result = ESCROW_CHECKER.run(options['incremental'], options['repair'])
+        drifts = result['drifts']
+        self.stdout.write(
+            f"{result['mode']} escrow check {result['check_id']}"
+            + (f" since {result['since']:%Y-%m-%d %H:%M:%S}" if result['since'] else '')
+            + f": {len(drifts)} drifted wallets, {result['repaired']} repaired, {result['seconds'] * 1000:.1f} ms"
+        )
+        for drift in drifts[:options['limit']]:
+            self.stdout.write(self.style.ERROR(
+                f"     user {drift['user_id']} {drift['currency']} (wallet {drift['wallet_id']}): "
+                f"{drift['actual']} locked, {drift['expected']} in open orders"
+            ))
+
+        if len(drifts) > result['repaired']:
+            raise CommandError(f"{len(drifts) - result['repaired']} wallets out of line with their open orders")
+        self.stdout.write(self.style.SUCCESS('every locked balance matches the open orders'))
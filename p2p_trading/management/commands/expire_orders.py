@@ -0,0 +1,40 @@
+# p2p_trading/management/commands/expire_orders.py
+"""cancel the UNPAID orders past their payment deadline and free their offers and escrow
+
+    python manage.py expire_orders                      # one pass
+    python manage.py expire_orders --chunk-size 1000    # orders per transaction
+    python manage.py expire_orders --loop 10            # keep running, one pass every 10 seconds
+
+safe to run on several nodes at once, the chunks are taken with SKIP LOCKED.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...engines.p2p_expiry_sweeper import EXPIRY_SWEEPER, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Cancel the expired UNPAID orders in chunks and release their offer amounts and escrow'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--max-chunks', type=int, default=None, help='stop a pass after this many chunks')
+        parser.add_argument('--loop', type=float, default=0, help='seconds between passes, 0 runs once')
+
+    def handle(self, *args, **options):
+        while True:
+            result = EXPIRY_SWEEPER.sweep(options['chunk_size'], options['max_chunks'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{result['orders']} orders expired in {result['chunks']} chunks, "
+                f"{result['seconds'] * 1000:.1f} ms ({result['orders_per_second']:.0f} orders/s)"
+            ))
+            if result['refused']:
+                self.stdout.write(self.style.WARNING(
+                    f"     {len(result['refused'])} orders left UNPAID, their seller escrow is short "
+                    f"(run check_escrow): {result['refused']}"
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,54 @@
+# p2p_trading/management/commands/provision_users.py
+"""give the main users their p2p profile and wallets, in bulk
+
+    python manage.py provision_users                            # every active main user, BTC USDT ETH
+    python manage.py provision_users --user-ids 12 13 14        # only these users
+    python manage.py provision_users --currencies USDT --no-profiles
+    python manage.py provision_users --chunk-size 5000          # users per query + insert
+
+the users are streamed from the main service, each chunk is one read of the existing rows and one insert
+of the missing ones, what already exists is left as it is. safe to run again.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from MainDashboard.models import MainUser
+
+from ...constants.constant import BASIC_WALLET_CURRENCIES
+from ...services.p2p_provisioning_service import ProvisioningService, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Create the missing p2p profiles and wallets of the main users with bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-ids', type=int, nargs='+', default=None, help='main user ids, default all active')
+        parser.add_argument('--currencies', nargs='+', default=BASIC_WALLET_CURRENCIES)
+        parser.add_argument('--no-profiles', action='store_true', help='wallets only')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        users = MainUser.objects.filter(is_active=True).order_by('id')
+        if options['user_ids']:
+            users = MainUser.objects.filter(id__in=options['user_ids']).order_by('id')
+
+        start = time.perf_counter()
+        if options['no_profiles']:
+            result = {'profiles': 0, 'skipped': [], 'wallets': ProvisioningService.provision_wallets(
+                users.values_list('id', flat=True).iterator(options['chunk_size']), options['currencies'],
+                chunk_size=options['chunk_size'],
+            )}
+        else:
+            result = ProvisioningService.provision_users(
+                users.values_list('id', 'username').iterator(options['chunk_size']), options['currencies'],
+                chunk_size=options['chunk_size'],
+            )
+        elapsed = time.perf_counter() - start
+
+        for user_id in result['skipped']:
+            self.stdout.write(self.style.WARNING(f"     user {user_id}: nickname taken, no profile created"))
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['profiles']} profiles and {result['wallets']} wallets created in {elapsed:.2f}s"
+        ))
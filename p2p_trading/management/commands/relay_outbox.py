@@ -0,0 +1,51 @@
+# p2p_trading/management/commands/relay_outbox.py
+"""deliver the pending outbox events to the registered consumers and report their lag
+
+    python manage.py relay_outbox                       # until every consumer caught up
+    python manage.py relay_outbox --batch-size 500      # events per consumer transaction
+    python manage.py relay_outbox --loop 2              # keep running, one pass every 2 seconds
+    python manage.py relay_outbox --prune-days 7        # then delete the delivered events older than 7 days
+
+safe to run on several nodes at once, a consumer checkpoint is held by one relay at a time (SKIP LOCKED).
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...engines.p2p_outbox_relay import OUTBOX_RELAY, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Deliver the outbox events to the in-process consumers in order, with their checkpoints and lag'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None, help='stop a pass after this many batches')
+        parser.add_argument('--loop', type=float, default=0, help='seconds between passes, 0 runs once')
+        parser.add_argument('--prune-days', type=int, default=None,
+                            help='delete the events older than this that every consumer passed')
+
+    def handle(self, *args, **options):
+        if not OUTBOX_RELAY.consumers:
+            self.stdout.write(self.style.WARNING('no outbox consumer is registered, the events stay pending'))
+        while True:
+            totals = OUTBOX_RELAY.relay(options['batch_size'], options['max_batches'])
+            for name, total in totals.items():
+                metrics = OUTBOX_RELAY.metrics['consumers'].get(name, {})
+                line = (
+                    f"{name}: {total['delivered']} delivered of {total['read']} read, "
+                    f"lag {metrics.get('lag_events', 0)} events / {metrics.get('lag_seconds', 0.0):.1f}s"
+                )
+                if total['failed']:
+                    self.stdout.write(self.style.ERROR(f"{line}, stopped at {total['failed']}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(line))
+            if options['prune_days'] is not None:
+                pruned = OUTBOX_RELAY.prune(timezone.now() - timedelta(days=options['prune_days']))
+                self.stdout.write(f"{pruned} delivered events pruned")
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
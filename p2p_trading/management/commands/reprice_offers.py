@@ -0,0 +1,47 @@
+# p2p_trading/management/commands/reprice_offers.py
+"""reprice the floating offers from the reference price feed
+
+    python manage.py reprice_offers                   # one pass over every pair
+    python manage.py reprice_offers --pair USDT/EGP   # one pair
+    python manage.py reprice_offers --loop 15         # keep running, one pass every 15 seconds
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...engines.p2p_price_engine import PRICE_ENGINE
+
+
+class Command(BaseCommand):
+    help = 'Recompute the effective price of the floating offers from the reference price feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pair', help='CRYPTO/FIAT, all the pairs if omitted')
+        parser.add_argument('--loop', type=float, default=0, help='seconds between passes, 0 runs once')
+
+    def handle(self, *args, **options):
+        pair = None
+        if options['pair']:
+            try:
+                crypto, fiat = options['pair'].split('/')
+            except ValueError:
+                raise CommandError('pair must look like USDT/EGP')
+            pair = (crypto.upper(), fiat)
+
+        while True:
+            start = time.perf_counter()
+            if pair:
+                PRICE_ENGINE.refresh([pair])
+                repriced = {pair: PRICE_ENGINE.reprice_pair(pair)}
+            else:
+                repriced = PRICE_ENGINE.reprice_all()
+
+            elapsed = (time.perf_counter() - start) * 1000
+            for (crypto, fiat), count in repriced.items():
+                self.stdout.write(f'{crypto}/{fiat}: {count} offers repriced')
+            self.stdout.write(self.style.SUCCESS(f'pass done in {elapsed:.1f} ms'))
+
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
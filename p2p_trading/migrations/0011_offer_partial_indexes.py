@@ -0,0 +1,21 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0010_alter_blockeduser_blocked_alter_blockeduser_blocker_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='p2poffer',
+            index=models.Index(condition=models.Q(('available_amount__gt', 0), ('is_deleted', False), ('status', 'ACTIVE')), fields=['crypto_currency', 'fiat_currency', 'trade_type', 'price', 'id'], name='p2p_offer_public_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='p2poffer',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user_id', '-created_at'], name='p2p_offer_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:20
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def copy_payment_methods(apps, schema_editor):
+    """fill the relation from payment_method_ids of the existing offers"""
+    P2POffer = apps.get_model('p2p_trading', 'P2POffer')
+    OfferPaymentMethod = apps.get_model('p2p_trading', 'OfferPaymentMethod')
+    PaymentMethods = apps.get_model('MainDashboard', 'PaymentMethods')
+
+    offers = list(P2POffer.objects.using(schema_editor.connection.alias).values_list('id', 'payment_method_ids'))
+    wanted = {int(pid) for _, ids in offers for pid in (ids or [])}
+    if not wanted:
+        return
+    types = dict(PaymentMethods.objects.using('main_db').filter(id__in=wanted).values_list('id', 'type'))
+
+    OfferPaymentMethod.objects.using(schema_editor.connection.alias).bulk_create([
+        OfferPaymentMethod(offer_id=offer_id, payment_method_id=pid, payment_type=types.get(pid) or 'Unknown')
+        for offer_id, ids in offers
+        for pid in dict.fromkeys(int(pid) for pid in (ids or []))
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0011_offer_partial_indexes'),
+        ('MainDashboard', '0002_paymentmethods_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfferPaymentMethod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_method_id', models.IntegerField()),
+                ('payment_type', models.CharField(max_length=255)),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_methods', to='p2p_trading.p2poffer')),
+            ],
+            options={
+                'db_table': 'p2p_offer_payment_method',
+                'ordering': ['id'],
+                'indexes': [models.Index(django.db.models.functions.text.Upper('payment_type'), models.F('offer'), name='p2p_offer_pm_type_idx')],
+                'constraints': [models.UniqueConstraint(fields=('offer', 'payment_method_id'), name='offer_payment_method_unique')],
+            },
+        ),
+        migrations.RunPython(copy_payment_methods, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0012_offer_payment_method'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='p2porder',
+            index=models.Index(condition=models.Q(('status', 'UNPAID')), fields=['payment_time_limit', 'id'], name='p2p_order_unpaid_deadline_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0013_order_unpaid_deadline_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='p2porder',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
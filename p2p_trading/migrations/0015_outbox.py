@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-18 03:06
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0014_order_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.CharField(max_length=100, unique=True)),
+                ('transaction_id', models.BigIntegerField(default=0)),
+                ('event_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'p2p_outbox_checkpoint',
+            },
+        ),
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('aggregate_type', models.CharField(max_length=20)),
+                ('aggregate_id', models.BigIntegerField()),
+                ('event_type', models.CharField(max_length=40)),
+                ('payload', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('transaction_id', models.BigIntegerField(db_default=models.Func(function='txid_current', output_field=models.BigIntegerField()))),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'p2p_outbox_event',
+                'ordering': ['transaction_id', 'id'],
+                'indexes': [models.Index(fields=['transaction_id', 'id'], name='p2p_outbox_position_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.3 on 2026-10-18 03:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# the balances held before the journal become one opening entry per wallet, brought in from the external
+# account, so the postings of every wallet add up to its balances from the start
+OPENING_ENTRIES_SQL = """
+    WITH opening AS MATERIALIZED (
+        SELECT id, currency, balance, locked_balance,
+            nextval(pg_get_serial_sequence('p2p_journal_entry', 'id')) AS entry_id
+        FROM p2p_wallet WHERE balance <> 0 OR locked_balance <> 0
+    ),
+    entries AS (
+        INSERT INTO p2p_journal_entry (id, event_type, created_at)
+        SELECT entry_id, 'DEPOSIT', now() FROM opening
+    )
+    INSERT INTO p2p_journal_posting (entry_id, wallet_id, currency, account, amount)
+    SELECT entry_id, id, currency, 'BALANCE', balance FROM opening WHERE balance <> 0
+    UNION ALL
+    SELECT entry_id, id, currency, 'LOCKED', locked_balance FROM opening WHERE locked_balance <> 0
+    UNION ALL
+    SELECT entry_id, NULL, currency, 'EXTERNAL', -(balance + locked_balance) FROM opening
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0015_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_type', models.CharField(choices=[('DEPOSIT', 'Deposit'), ('WITHDRAWAL', 'Withdrawal'), ('LOCK_ESCROW', 'Lock for Escrow'), ('RELEASE_ESCROW', 'Release from Escrow'), ('CANCEL_ESCROW', 'Cancel Escrow'), ('TRADE_FEE', 'Trade Fee')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('related_order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='p2p_trading.p2porder')),
+            ],
+            options={
+                'db_table': 'p2p_journal_entry',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Posting',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('currency', models.CharField(max_length=10)),
+                ('account', models.CharField(choices=[('BALANCE', 'Balance'), ('LOCKED', 'Locked'), ('EXTERNAL', 'External')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='p2p_trading.journalentry')),
+                ('wallet', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='p2p_trading.wallet')),
+            ],
+            options={
+                'db_table': 'p2p_journal_posting',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunSQL(OPENING_ENTRIES_SQL, migrations.RunSQL.noop),
+    ]
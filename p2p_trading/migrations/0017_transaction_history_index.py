@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0016_journal'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', 'created_at', 'id'], name='p2p_tx_wallet_history_idx'),
+        ),
+    ]
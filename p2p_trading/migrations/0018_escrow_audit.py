@@ -0,0 +1,66 @@
+# Generated by Django 5.2.3 on 2026-10-18 03:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0017_transaction_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EscrowCheck',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mode', models.CharField(max_length=12)),
+                ('since', models.DateTimeField(blank=True, null=True)),
+                ('resume_from', models.DateTimeField()),
+                ('wallets', models.PositiveIntegerField(default=0)),
+                ('repaired', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'p2p_escrow_check',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EscrowDrift',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('currency', models.CharField(max_length=10)),
+                ('expected', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('actual', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'p2p_escrow_drift',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='p2porder',
+            index=models.Index(fields=['updated_at'], name='p2p_order_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='escrowdrift',
+            name='check_run',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drifts', to='p2p_trading.escrowcheck'),
+        ),
+        migrations.AddField(
+            model_name='escrowdrift',
+            name='repair_entry',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='p2p_trading.journalentry'),
+        ),
+        migrations.AddField(
+            model_name='escrowdrift',
+            name='wallet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='p2p_trading.wallet'),
+        ),
+    ]
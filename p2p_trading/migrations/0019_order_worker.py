@@ -0,0 +1,24 @@
+# Generated by Django 5.2.3 on 2026-10-18 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0018_escrow_audit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='P2POrderWorker',
+            fields=[
+                ('worker_id', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=32)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'p2p_order_worker',
+            },
+        ),
+    ]
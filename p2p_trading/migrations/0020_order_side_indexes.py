@@ -0,0 +1,35 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:02
+
+from django.db import migrations, models
+
+# the (side, status, created_at) indexes of the order history, declared on P2POrder but never migrated.
+# a database that took them with an earlier 0011 keeps them, IF NOT EXISTS makes the migration a no-op there
+ORDER_INDEXES = [
+    ('p2p_order_maker_i_168443_idx', ['maker_id', 'status', 'created_at']),
+    ('p2p_order_taker_i_3ce1d5_idx', ['taker_id', 'status', 'created_at']),
+    ('p2p_order_status_62be55_idx', ['status', 'crypto_currency', 'created_at']),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p_trading', '0019_order_worker'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='p2porder', index=models.Index(fields=fields, name=name))
+                for name, fields in ORDER_INDEXES
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE INDEX IF NOT EXISTS "%s" ON "p2p_order" (%s)'
+                    % (name, ', '.join('"%s"' % field for field in fields)),
+                    f'DROP INDEX IF EXISTS "{name}"',
+                )
+                for name, fields in ORDER_INDEXES
+            ],
+        ),
+    ]
@@ -1,10 +1,13 @@
 
 from .p2p_BaseModel import  BaseModel
-from .p2p_offer_model import P2POffer
+from .p2p_offer_model import P2POffer, OfferPaymentMethod
 from .p2p_transaction_model import Transaction
 from .p2p_wallet_model import Wallet
-from  .p2p_order_model import P2POrder
+from  .p2p_order_model import P2POrder, P2POrderWorker
 from .p2p_profile_models import P2PProfile,Follow,Feedback,BlockedUser
+from .p2p_outbox_model import OutboxEvent, OutboxCheckpoint
+from .p2p_journal_model import JournalEntry, Posting
+from .p2p_escrow_audit_model import EscrowCheck, EscrowDrift
 
 
 __all__ = ['BlockedUser',
@@ -13,8 +16,16 @@ __all__ = ['BlockedUser',
            'Transaction',
            'Wallet',
            'P2POrder',
+           'P2POrderWorker',
            'Feedback',
            'Follow',
            'P2POffer',
+           'OfferPaymentMethod',
+           'OutboxEvent',
+           'OutboxCheckpoint',
+           'JournalEntry',
+           'Posting',
+           'EscrowCheck',
+           'EscrowDrift',
            'BlockedUser',]
 
@@ -0,0 +1,47 @@
+# p2p_trading/models/p2p_escrow_audit_model.py
+"""the runs of the escrow checker and the wallets they found out of line with the open orders"""
+
+from django.db import models
+
+
+class EscrowCheck(models.Model):
+    """one run of the checker, an incremental run starts from the resume_from of the last finished one"""
+    mode = models.CharField(max_length=12)  # 'full' or 'incremental'
+    since = models.DateTimeField(null=True, blank=True)  # changes looked at by an incremental run
+    # the next incremental run looks at the changes from here: the start of the run, or of the oldest
+    # transaction still writing when it started (its changes may commit after the run read the tables)
+    resume_from = models.DateTimeField()
+    wallets = models.PositiveIntegerField(default=0)  # drifted wallets found
+    repaired = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'p2p_escrow_check'
+        app_label = 'p2p_trading'
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"{self.mode} escrow check {self.id}: {self.wallets} drifted"
+
+
+class EscrowDrift(models.Model):
+    """a locked_balance that is not the crypto of the open orders of its seller, and what was done about it"""
+    check_run = models.ForeignKey(EscrowCheck, on_delete=models.CASCADE, related_name='drifts')
+    wallet = models.ForeignKey('Wallet', on_delete=models.PROTECT, null=True, blank=True)  # None: no wallet at all
+    user_id = models.IntegerField()
+    currency = models.CharField(max_length=10)
+    expected = models.DecimalField(max_digits=20, decimal_places=8)  # sum of the open orders
+    actual = models.DecimalField(max_digits=20, decimal_places=8)  # locked_balance found
+    # the journal entry moving the difference between balance and locked_balance, None when not repaired
+    repair_entry = models.ForeignKey('JournalEntry', on_delete=models.PROTECT, null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True, default='')  # why a repair was refused
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'p2p_escrow_drift'
+        app_label = 'p2p_trading'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.currency} escrow of {self.user_id}: {self.actual} locked, {self.expected} expected"
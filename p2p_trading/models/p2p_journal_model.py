@@ -0,0 +1,41 @@
+# p2p_trading/models/p2p_journal_model.py
+"""the double-entry journal of the wallets, every balance change is a balanced entry of postings"""
+
+from django.db import models
+
+from ..constants.constant import LedgerAccount, TransactionType
+
+
+class JournalEntry(models.Model):
+    """one business event (escrow lock, release, cancel, deposit ...), its postings sum to zero per currency"""
+    id = models.BigAutoField(primary_key=True)
+    event_type = models.CharField(max_length=20, choices=TransactionType.choices)
+    related_order = models.ForeignKey('P2POrder', on_delete=models.PROTECT, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'p2p_journal_entry'
+        app_label = 'p2p_trading'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.event_type} entry {self.id}"
+
+
+class Posting(models.Model):
+    """one leg of an entry, a signed amount on the balance or the locked balance of a wallet, or on the
+    external account (no wallet) for the money coming in or going out of the p2p wallets"""
+    id = models.BigAutoField(primary_key=True)
+    entry = models.ForeignKey(JournalEntry, on_delete=models.PROTECT, related_name='postings')
+    wallet = models.ForeignKey('Wallet', on_delete=models.PROTECT, null=True, blank=True, related_name='postings')
+    currency = models.CharField(max_length=10)
+    account = models.CharField(max_length=10, choices=LedgerAccount.choices)
+    amount = models.DecimalField(max_digits=20, decimal_places=8)
+
+    class Meta:
+        db_table = 'p2p_journal_posting'
+        app_label = 'p2p_trading'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.amount} {self.currency} on {self.account} of wallet {self.wallet_id}"
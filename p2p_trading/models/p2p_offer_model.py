@@ -3,6 +3,7 @@ from decimal import Decimal
 from .p2p_BaseModel import BaseModel
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models.functions import Upper
 from p2p_trading.constants.constant import TradeType, PriceType, OfferStatus
 
 class P2POffer(BaseModel):
@@ -84,10 +85,55 @@ class P2POffer(BaseModel):
                 condition=models.Q(available_amount__lte=models.F('total_amount')),
                 name='available_lte_total'
             ),]
+        indexes = [
+            # public feed: only the offers of PUBLIC_QUERY, one pair/side ordered by price
+            models.Index(
+                fields=['crypto_currency', 'fiat_currency', 'trade_type', 'price', 'id'],
+                condition=models.Q(status=OfferStatus.ACTIVE, is_deleted=False, available_amount__gt=0),
+                name='p2p_offer_public_feed_idx'
+            ),
+            # my offers: get_by_user_and_filters ordered by -created_at
+            models.Index(
+                fields=['user_id', '-created_at'],
+                condition=models.Q(is_deleted=False),
+                name='p2p_offer_user_created_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Offer by {self.user_id} - {self.crypto_currency}"
 
+    @property
+    def payment_types(self):
+        """payment types of the offer (uses the prefetched payment_methods when loaded)"""
+        return [method.payment_type for method in self.payment_methods.all()]
+
+
+class OfferPaymentMethod(models.Model):
+    """one payment method of an offer, the type is copied from the main dashboard when the offer is saved
+    so the feed can filter and show the payment types without reading the main database"""
+    offer = models.ForeignKey(P2POffer, on_delete=models.CASCADE, related_name='payment_methods')
+    # id of the PaymentMethods record in the main dashboard
+    payment_method_id = models.IntegerField()
+    # "Vodafone Cash", "InstaPay", "BANK_TRANSFER" ...
+    payment_type = models.CharField(max_length=255)
+
+    class Meta:
+        db_table = 'p2p_offer_payment_method'
+        app_label = 'p2p_trading'
+        # same order as payment_method_ids
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['offer', 'payment_method_id'], name='offer_payment_method_unique'),
+        ]
+        indexes = [
+            # payment type filter of the feed, case insensitive
+            models.Index(Upper('payment_type'), 'offer', name='p2p_offer_pm_type_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.payment_type} for offer {self.offer_id}"
+
 
 
 
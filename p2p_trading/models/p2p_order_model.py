@@ -5,6 +5,7 @@ from django.db import models
 from .p2p_offer_model import P2POffer
 from .p2p_BaseModel import BaseModel
 from ..constants.constant import OrderStatus
+from ..engines.p2p_order_number import ORDER_NUMBERS
 
 class P2POrder(BaseModel):
     order_number = models.CharField(max_length=20, unique=True) # رقم تسلسلي للطلب
@@ -30,6 +31,9 @@ class P2POrder(BaseModel):
     payment_time_limit=models.DateTimeField()
     chat_room_id = models.CharField(max_length=100, null=True, blank=True)
 
+    # bumped by every status transition, a client can make its transition conditional on it
+    version = models.PositiveIntegerField(default=0)
+
     class Meta:
         db_table = 'p2p_order'
         app_label = 'p2p_trading'
@@ -60,13 +64,34 @@ class P2POrder(BaseModel):
             models.Index(fields=['maker_id', 'status', 'created_at']),
             models.Index(fields=['taker_id', 'status', 'created_at']),
             models.Index(fields=['status', 'crypto_currency', 'created_at']),
+            # expiry sweeper, only the UNPAID orders are waiting for a payment deadline
+            models.Index(
+                fields=['payment_time_limit', 'id'],
+                condition=models.Q(status=OrderStatus.UNPAID),
+                name='p2p_order_unpaid_deadline_idx',
+            ),
+            # incremental escrow check, the orders changed since its last run
+            models.Index(fields=['updated_at'], name='p2p_order_updated_idx'),
         ]
 
 
     #create unique order_numbere
     def save(self, *args, **kwargs):
         if not self.order_number:
-            import time
-            self.order_number = f"{int(time.time() * 1000)}"[-12:]
+            # snowflake number (time + worker id + sequence), unique across the processes without a query
+            self.order_number = ORDER_NUMBERS.next()
         super().save(*args, **kwargs)
 
+
+class P2POrderWorker(models.Model):
+    """a worker id of the order numbers held by one process until expires_at (engines/p2p_order_number)"""
+    worker_id = models.PositiveSmallIntegerField(primary_key=True)
+    token = models.CharField(max_length=32)  # the process holding it
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'p2p_order_worker'
+        app_label = 'p2p_trading'
+
+    def __str__(self):
+        return f"order worker {self.worker_id} until {self.expires_at}"
@@ -0,0 +1,50 @@
+# p2p_trading/models/p2p_outbox_model.py
+"""the transactional outbox of the order and offer lifecycle events"""
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import Func
+
+
+class OutboxEvent(models.Model):
+    """one state change of an order or an offer, written in the transaction of the change itself
+    so an event exists if and only if its change was committed"""
+    id = models.BigAutoField(primary_key=True)
+    # 'order' or 'offer', and the id of that order/offer
+    aggregate_type = models.CharField(max_length=20)
+    aggregate_id = models.BigIntegerField()
+    # 'order.created', 'order.paid', 'offer.updated' ...
+    event_type = models.CharField(max_length=40)
+    payload = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    # id of the writing transaction, the relay reads the events of finished transactions only, in
+    # (transaction_id, id) order, so an event committed late is never skipped
+    transaction_id = models.BigIntegerField(
+        db_default=Func(function='txid_current', output_field=models.BigIntegerField())
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'p2p_outbox_event'
+        app_label = 'p2p_trading'
+        ordering = ['transaction_id', 'id']
+        indexes = [
+            models.Index(fields=['transaction_id', 'id'], name='p2p_outbox_position_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} of {self.aggregate_type} {self.aggregate_id}"
+
+
+class OutboxCheckpoint(models.Model):
+    """position of one consumer in the outbox, the last event it handled"""
+    consumer = models.CharField(max_length=100, unique=True)
+    transaction_id = models.BigIntegerField(default=0)
+    event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'p2p_outbox_checkpoint'
+        app_label = 'p2p_trading'
+
+    def __str__(self):
+        return f"{self.consumer} at {self.transaction_id}/{self.event_id}"
@@ -26,6 +26,10 @@ class Transaction(BaseModel):
         db_table = 'p2p_transaction_model'
         app_label = 'p2p_trading'
         ordering = ['-created_at']
+        indexes = [
+            # the history of a wallet in the order it was applied (ledger reconciliation)
+            models.Index(fields=['wallet', 'created_at', 'id'], name='p2p_tx_wallet_history_idx'),
+        ]
 
     def __str__(self):
         return f"{self.transaction_type} of {self.amount} {self.wallet.currency} for {self.wallet.user_id}"
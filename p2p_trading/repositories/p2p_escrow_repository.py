@@ -0,0 +1,114 @@
+# p2p_trading/repositories/p2p_escrow_repository.py
+
+from django.db import connections, router
+
+from ..constants.constant import PROCESSING_STATUSES, TradeType
+from ..models.p2p_escrow_audit_model import EscrowCheck, EscrowDrift
+from ..models.p2p_journal_model import JournalEntry
+from ..models.p2p_offer_model import P2POffer
+from ..models.p2p_order_model import P2POrder
+from ..models.p2p_wallet_model import Wallet
+
+# the seller of an order, the side whose wallet holds the escrow, same rule as GET_SELLER_BUYER
+ORDER_SELLER = f"CASE WHEN f.trade_type = '{TradeType.SELL}' THEN f.user_id ELSE o.taker_id END"
+ORDERS = f"{P2POrder._meta.db_table} o JOIN {P2POffer._meta.db_table} f ON f.id = o.offer_id"
+
+# the locked_balance expected of every seller and currency, the crypto of its open orders summed by one
+# GROUP BY, against the wallets: a wallet locking something else, or open orders without a wallet. the
+# scope keeps both sides to the same (user, currency) pairs
+ESCROW_DRIFT_SQL = f"""
+    WITH {{touched}}
+    expected AS (
+        SELECT {ORDER_SELLER} AS user_id, o.crypto_currency AS currency, SUM(o.crypto_amount) AS locked
+        FROM {ORDERS}
+        WHERE o.status IN ({', '.join(f"'{status}'" for status in PROCESSING_STATUSES)}) {{order_scope}}
+        GROUP BY 1, 2
+    )
+    SELECT w.id AS wallet_id, COALESCE(w.user_id, e.user_id) AS user_id,
+        COALESCE(w.currency, e.currency) AS currency, COALESCE(e.locked, 0) AS expected,
+        COALESCE(w.locked_balance, 0) AS actual
+    FROM (SELECT * FROM {Wallet._meta.db_table} {{wallet_scope}}) w
+        FULL JOIN expected e ON e.user_id = w.user_id AND e.currency = w.currency
+    WHERE COALESCE(e.locked, 0) <> COALESCE(w.locked_balance, 0)
+    ORDER BY 2, 3
+"""
+# the pairs changed since a time: wallets updated, and the sellers of the orders updated (opened or closed)
+TOUCHED_SQL = f"""touched AS (
+        SELECT user_id, currency FROM {Wallet._meta.db_table} WHERE updated_at >= %(since)s
+        UNION
+        SELECT {ORDER_SELLER}, o.crypto_currency FROM {ORDERS} WHERE o.updated_at >= %(since)s
+    ),"""
+IN_TOUCHED = lambda user_id, currency: f"({user_id}, {currency}) IN (SELECT user_id, currency FROM touched)"
+# touched, order_scope, wallet_scope of each scope of ESCROW_DRIFT_SQL
+DRIFT_SCOPES = {
+    'full': ('', '', ''),
+    'incremental': (
+        TOUCHED_SQL, f"AND {IN_TOUCHED(ORDER_SELLER, 'o.crypto_currency')}",
+        f"WHERE {IN_TOUCHED('user_id', 'currency')}",
+    ),
+    'wallet': (
+        '', f"AND {ORDER_SELLER} = %(user_id)s AND o.crypto_currency = %(currency)s",
+        'WHERE user_id = %(user_id)s AND currency = %(currency)s',
+    ),
+}
+# the start of the oldest transaction writing right now (its rows carry times from its start), or now
+RESUME_FROM_SQL = """
+    SELECT LEAST(now(), MIN(xact_start)) FROM pg_stat_activity
+    WHERE backend_xid IS NOT NULL AND datname = current_database()
+"""
+
+
+class P2PEscrowRepository:
+
+    """*************************************************************************************************************
+    /*	function name:		    get_drifts
+    * 	function inputs:	    scope ('full', 'incremental' or 'wallet'), since (incremental), user id and currency
+                                (wallet)
+    * 	function outputs:	    list of dicts (wallet_id, user_id, currency, expected, actual) of the drifted wallets,
+                                wallet_id is None for open orders whose seller has no wallet of their coin
+    * 	function description:	one statement, ESCROW_DRIFT_SQL in the scope. the incremental scope only groups the
+                                open orders of the pairs touched since the time
+    *   call back:              n/a
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def get_drifts(scope='full', since=None, user_id=None, currency=None):
+        touched, order_scope, wallet_scope = DRIFT_SCOPES[scope]
+        sql = ESCROW_DRIFT_SQL.format(touched=touched, order_scope=order_scope, wallet_scope=wallet_scope)
+        with connections[router.db_for_read(Wallet)].cursor() as cursor:
+            cursor.execute(sql, {'since': since, 'user_id': user_id, 'currency': currency})
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    @staticmethod
+    def get_resume_from():
+        """the time the next incremental run has to look back to, read before the tables"""
+        with connections[router.db_for_read(Wallet)].cursor() as cursor:
+            cursor.execute(RESUME_FROM_SQL)
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def get_last_finished_check():
+        return EscrowCheck.objects.filter(finished_at__isnull=False).order_by('-id').first()
+
+    @staticmethod
+    def create_check(mode, since, resume_from):
+        return EscrowCheck.objects.create(mode=mode, since=since, resume_from=resume_from)
+
+    @staticmethod
+    def finish_check(check, wallets, repaired, now):
+        check.wallets, check.repaired, check.finished_at = wallets, repaired, now
+        check.save(update_fields=['wallets', 'repaired', 'finished_at'])
+        return check
+
+    @staticmethod
+    def add_drift(check, drift, repair_entry=None, error=''):
+        return EscrowDrift.objects.create(
+            check_run=check, wallet_id=drift['wallet_id'], user_id=drift['user_id'], currency=drift['currency'],
+            expected=drift['expected'], actual=drift['actual'], repair_entry=repair_entry, error=error[:255],
+        )
+
+    @staticmethod
+    def get_last_wallet_entry(wallet_id):
+        """the newest journal entry of the wallet, the one just posted while its row is locked by the caller"""
+        return JournalEntry.objects.filter(postings__wallet_id=wallet_id).order_by('-id').first()
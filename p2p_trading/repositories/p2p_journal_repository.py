@@ -0,0 +1,144 @@
+# p2p_trading/repositories/p2p_journal_repository.py
+
+from itertools import chain
+
+from django.db import router
+from django.db.models import Sum
+
+from ..constants.constant import LedgerAccount
+from ..models.p2p_journal_model import JournalEntry, Posting
+from ..models.p2p_transaction_model import Transaction
+from ..models.p2p_wallet_model import Wallet
+
+# typed VALUES rows of POST_ENTRIES_SQL, the order ids are bigint so an order id never overflows the cast
+LEG_ROW = '(%s::integer, %s::integer, %s::varchar, %s::varchar, %s::numeric)'
+ENTRY_ROW = '(%s::integer, %s::varchar, %s::bigint)'
+TRANSACTION_ROW = '(%s::integer, %s::integer, %s::varchar, %s::varchar, %s::numeric, %s::numeric)'
+
+# a batch of journal entries in one statement: the wallets touched are locked in id order, then each one is
+# updated with its summed deltas when it keeps its constraints (balance >= 0, 0 <= locked_balance <= balance),
+# checked by the UPDATE on the current row (the values a locking sub-select returns may be the ones of the
+# statement snapshot). the entries, their postings and the transactions (running balance taken from the
+# updated wallet, minus the later entries of the batch) are inserted only when every wallet was updated. the
+# transactions are stamped once the wallets are locked and inserted in entry order, so (created_at, id) of
+# the transactions of a wallet follows the order its changes were applied
+POST_ENTRIES_SQL = f"""
+    WITH legs (entry, user_id, currency, account, amount) AS (VALUES {{legs}}),
+    entries (entry, id, event_type, order_id) AS MATERIALIZED (
+        SELECT entry, nextval(pg_get_serial_sequence('{JournalEntry._meta.db_table}', 'id')), event_type, order_id
+        FROM (VALUES {{entries}}) AS e (entry, event_type, order_id)
+    ),
+    deltas AS (
+        SELECT user_id, currency,
+            COALESCE(SUM(amount) FILTER (WHERE account = '{LedgerAccount.BALANCE}'), 0) AS balance_delta,
+            COALESCE(SUM(amount) FILTER (WHERE account = '{LedgerAccount.LOCKED}'), 0) AS locked_delta
+        FROM legs WHERE user_id IS NOT NULL GROUP BY user_id, currency
+    ),
+    locked AS MATERIALIZED (
+        SELECT w.id FROM {Wallet._meta.db_table} w JOIN deltas d ON w.user_id = d.user_id AND w.currency = d.currency
+        ORDER BY w.id FOR UPDATE OF w
+    ),
+    updated AS (
+        UPDATE {Wallet._meta.db_table} w
+        SET balance = w.balance + d.balance_delta, locked_balance = w.locked_balance + d.locked_delta,
+            updated_at = now()
+        FROM deltas d
+        WHERE w.user_id = d.user_id AND w.currency = d.currency
+            AND (SELECT count(*) FROM locked) = (SELECT count(*) FROM deltas)
+            AND w.balance + d.balance_delta >= 0 AND w.locked_balance + d.locked_delta >= 0
+            AND w.locked_balance + d.locked_delta <= w.balance + d.balance_delta
+        RETURNING w.*
+    ),
+    complete AS (
+        SELECT count(*) = (SELECT count(*) FROM deltas) AS posted FROM updated
+    ),
+    new_entries AS (
+        INSERT INTO {JournalEntry._meta.db_table} (id, event_type, related_order_id, created_at)
+        SELECT id, event_type, order_id, now() FROM entries WHERE (SELECT posted FROM complete)
+    ),
+    new_postings AS (
+        INSERT INTO {Posting._meta.db_table} (entry_id, wallet_id, currency, account, amount)
+        SELECT e.id, u.id, l.currency, l.account, l.amount
+        FROM legs l JOIN entries e ON e.entry = l.entry
+            LEFT JOIN updated u ON u.user_id = l.user_id AND u.currency = l.currency
+        WHERE (SELECT posted FROM complete)
+    ),
+    new_transactions AS (
+        INSERT INTO {Transaction._meta.db_table} (wallet_id, related_order_id, transaction_type, amount,
+            running_balance, created_at, updated_at, is_deleted)
+        SELECT u.id, e.order_id, t.tx_type, t.amount,
+            u.balance - COALESCE(SUM(t.balance_delta) OVER (
+                PARTITION BY u.id ORDER BY t.entry DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+            ), 0),
+            clock_timestamp(), clock_timestamp(), false
+        FROM (VALUES {{transactions}}) AS t (entry, user_id, currency, tx_type, amount, balance_delta)
+            JOIN entries e ON e.entry = t.entry
+            JOIN updated u ON u.user_id = t.user_id AND u.currency = t.currency
+        WHERE (SELECT posted FROM complete)
+        ORDER BY t.entry
+    )
+    SELECT * FROM updated
+"""
+
+
+class P2PJournalRepository:
+
+    """*************************************************************************************************************
+    /*	function name:		    post_entries
+    * 	function inputs:	    list of entries (event type, order id, legs), each leg is
+                                (user id or None for the external account, currency, account, amount, transaction type)
+    * 	function outputs:	    dict {(user_id, currency): wallet} of the updated wallets with their new balances,
+                                None when a wallet is missing or cannot take the change, then no entry was written
+                                and the wallets that could take it were updated (the caller rolls back)
+    * 	function description:	the whole batch in one round trip (POST_ENTRIES_SQL): wallets, entries, postings
+                                and one transaction per entry and wallet (amount = its balance legs, or its locked
+                                legs when the balance does not move). ValueError for an entry that does not
+                                balance to zero per currency
+    *   call back:              n/a
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def post_entries(entries):
+        legs, rows, transactions = [], [], []
+        for position, (event_type, order_id, entry_legs) in enumerate(entries):
+            entry_legs = [leg for leg in entry_legs if leg[3]]
+            totals = {}
+            for _, currency, _, amount, _ in entry_legs:
+                totals[currency] = totals.get(currency, 0) + amount
+            if any(totals.values()):
+                raise ValueError(f"Unbalanced {event_type} journal entry: {totals}")
+
+            rows.append((position, event_type, order_id))
+            wallets = {}
+            for user_id, currency, account, amount, tx_type in entry_legs:
+                legs.append((position, user_id, currency, account, amount))
+                if user_id is not None:
+                    deltas = wallets.setdefault((user_id, currency), [tx_type, 0, 0])
+                    deltas[1 if account == LedgerAccount.BALANCE else 2] += amount
+            transactions.extend(
+                (position, user_id, currency, tx_type, balance_delta or locked_delta, balance_delta)
+                for (user_id, currency), (tx_type, balance_delta, locked_delta) in wallets.items()
+            )
+        if not transactions:
+            return {}
+
+        sql = POST_ENTRIES_SQL.format(
+            legs=', '.join([LEG_ROW] * len(legs)), entries=', '.join([ENTRY_ROW] * len(rows)),
+            transactions=', '.join([TRANSACTION_ROW] * len(transactions)),
+        )
+        wallets = {
+            (wallet.user_id, wallet.currency): wallet
+            for wallet in Wallet.objects.db_manager(router.db_for_write(Wallet)).raw(
+                sql, list(chain(*legs, *rows, *transactions))
+            )
+        }
+        return wallets if len(wallets) == len({(t[1], t[2]) for t in transactions}) else None
+
+    @staticmethod
+    def get_unbalanced_entries(after_id=0):
+        """(entry id, currency, total) of the entries after after_id whose postings do not sum to zero, one GROUP BY"""
+        return list(
+            Posting.objects.filter(entry_id__gt=after_id).values('entry_id', 'currency')
+            .annotate(total=Sum('amount')).exclude(total=0).order_by('entry_id')
+            .values_list('entry_id', 'currency', 'total')
+        )
@@ -1,8 +1,15 @@
 # p2p_trading/repositories/p2p_offer_repository.py
 
+from django.db import connections, router
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+from rest_framework.exceptions import PermissionDenied
+
 from ..constants.constant import OfferStatus
-from ..models.p2p_offer_model import P2POffer
+from ..models.p2p_offer_model import P2POffer, OfferPaymentMethod
 from ..models.p2p_profile_models import  P2PProfile
+from ..engines.p2p_order_book_engine import ORDER_BOOK
+from ..engines.p2p_payment_method_cache import PAYMENT_METHOD_CACHE
 from MainDashboard.models import PaymentMethods
 
 # ================ HELPER MACROS ================
@@ -11,6 +18,19 @@ from ..helpers import (
                        apply_filters,
                        )
 
+# lock-free order intake, the amount leaves the offer only if the offer still holds it at the price the order
+# was priced at (the SET expressions read the old row), sold out offers become COMPLETED in the same statement
+RESERVE_SQL = f"""
+    UPDATE {P2POffer._meta.db_table}
+    SET available_amount = available_amount - %(amount)s,
+        status = CASE WHEN available_amount - %(amount)s <= 0 THEN %(completed)s ELSE status END,
+        updated_at = %(now)s
+    WHERE id = %(id)s AND status = %(active)s AND NOT is_deleted AND available_amount >= %(amount)s
+        AND price = %(price)s
+    RETURNING available_amount, status, updated_at
+"""
+
+
 # ================ REPOSITORY CLASS ================
 class P2POfferRepository:
     #filter according to the is_deleted , all records that not deleted from the database
@@ -21,7 +41,11 @@ class P2POfferRepository:
 
     @staticmethod
     def create_offer(data):
-        return P2POffer.objects.create(**data)
+        offer = P2POffer.objects.create(**data)
+        P2POfferRepository.set_payment_methods(offer, offer.payment_method_ids)
+        # add the offer to the public order book once the transaction commits
+        ORDER_BOOK.sync_on_commit(offer)
+        return offer
 
 
     """*************************************************************************************************************
@@ -37,8 +61,34 @@ class P2POfferRepository:
         for field, value in data.items():
             setattr(offer, field, value)
         offer.save()
+        if 'payment_method_ids' in data:
+            P2POfferRepository.set_payment_methods(offer, offer.payment_method_ids)
+        ORDER_BOOK.sync_on_commit(offer)
         return offer
 
+    """*************************************************************************************************************
+    /*	function name:		    set_payment_methods
+    * 	function inputs:	    offer object, list of payment method ids
+    * 	function outputs:	    n/a
+    * 	function description:	replace the payment method rows of the offer, the type of each method is read once
+                                from the main dashboard here so the feed never needs to read it
+    *   call back:              n/a
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def set_payment_methods(offer, payment_ids):
+        payment_ids = list(dict.fromkeys(int(pid) for pid in (payment_ids or [])))
+        types = dict(
+            PaymentMethods.objects.using('main_db').filter(id__in=payment_ids).values_list('id', 'type')
+        )
+        OfferPaymentMethod.objects.filter(offer=offer).delete()
+        OfferPaymentMethod.objects.bulk_create([
+            OfferPaymentMethod(offer=offer, payment_method_id=pid, payment_type=types.get(pid) or 'Unknown')
+            for pid in payment_ids
+        ])
+        # the prefetched rows (if any) are stale now
+        getattr(offer, '_prefetched_objects_cache', {}).pop('payment_methods', None)
+
     """*************************************************************************************************************
     /*	function name:		    soft_delete
     * 	function inputs:	    offer object, validated data
@@ -52,29 +102,75 @@ class P2POfferRepository:
         offer.is_deleted = True
         offer.status = OfferStatus.INACTIVE
         offer.save(update_fields=['is_deleted', 'status'])
+        ORDER_BOOK.sync_on_commit(offer)
         return offer
 
 
+    @staticmethod
+    def lock_offers(offer_ids):
+        """
+            lock the offers in id order until the commit, the order every writer takes them in so a transaction
+            holding several offers never waits on another one in a cycle
+            arg:
+                offer ids
+            return:
+                list of the locked offer ids
+        """
+        return list(
+            P2POffer.objects.select_for_update().filter(id__in=offer_ids).order_by('id').values_list('id', flat=True)
+        )
+
+    """*************************************************************************************************************
+    /*	function name:		    restore_available_amounts
+    * 	function inputs:	    dict {offer_id: crypto amount to give back}
+    * 	function outputs:	    number of offers updated
+    * 	function description:	give the amounts of cancelled orders back to their offers with one update, sold
+                                out (COMPLETED) offers become ACTIVE again like in cancel_order. the offers are
+                                locked in id order first so concurrent sweeps never wait on each other in a cycle
+    *   call back:              lock_offers(), ORDER_BOOK.reload_offers()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def restore_available_amounts(amounts):
+        if not amounts:
+            return 0
+        offer_ids = P2POfferRepository.lock_offers(amounts)
+        restored = P2POffer.objects.filter(id__in=offer_ids).update(
+            available_amount=F('available_amount') + Case(
+                *[When(id=offer_id, then=Value(amounts[offer_id])) for offer_id in offer_ids],
+                output_field=DecimalField(max_digits=20, decimal_places=8)
+            ),
+            status=Case(
+                When(status=OfferStatus.COMPLETED, then=Value(OfferStatus.ACTIVE)), default=F('status')
+            ),
+        )
+        ORDER_BOOK.reload_offers(offer_ids)
+        return restored
+
     """*************************************************************************************************************
     /*	function name:		    get_public_offers
-    * 	function inputs:	    filters from the url frontend 
-    * 	function outputs:	    queryset of the offer model  
-    * 	function description:	delete the offer but keep the data in the database 
-    *   call back:              n/a
+    * 	function inputs:	    filters from the url frontend, (price, id) key of the previous page, page size,
+                                viewer stats to hide the offers the viewer cannot take
+    * 	function outputs:	    list of offer instances ordered by price, key of the last offer in the page
+    * 	function description:	serve the active offers from the in-memory order book instead of running
+                                PUBLIC_QUERY, -price for BUY and price otherwise
+    *   call back:              ORDER_BOOK.get_page()
     */
     *************************************************************************************************************"""
     @staticmethod
-    def get_public_offers(filters):
-        #get queryset that is active, not deleted
-        queryset = P2POfferRepository.PUBLIC_QUERY
-        #apply filters
-        queryset = apply_filters(queryset, filters)
+    def get_public_offers(filters, after=None, limit=None, viewer=None):
+        return ORDER_BOOK.get_page(filters, after, limit, viewer)
 
-        # order according to the price
-        trade_type = filters.get('trade_type', '').upper()
-        order_by = '-price' if trade_type == 'BUY' else 'price'
+    @staticmethod
+    def count_public_offers(filters, viewer=None):
+        """cheap estimate of the number of offers in the feed"""
+        return ORDER_BOOK.count(filters, viewer)
 
-        return queryset.order_by(order_by)
+    @staticmethod
+    def public_offers_version(filters, viewer=None):
+        """changes on every write to the pairs of the feed (create/update/delete, orders, admin actions),
+        and tells if the viewer stats change the feed"""
+        return ORDER_BOOK.feed_version(filters, viewer)
 
 
     @staticmethod
@@ -87,6 +183,53 @@ class P2POfferRepository:
             is_deleted=False,
             status=OfferStatus.ACTIVE
     )
+    """*************************************************************************************************************
+    /*	function name:		    lock_public_offer
+    * 	function inputs:	    offer id
+    * 	function outputs:	    offer instance locked until the end of the transaction, or raise 403
+    * 	function description:	get_public_offer_by_id with the row lock of the order intake, the offer is the first
+                                row locked by the order creation, the seller wallet comes after it
+    *   call back:              n/a
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def lock_public_offer(offer_id):
+        offer = P2POffer.objects.select_for_update().filter(
+            pk=offer_id, is_deleted=False, status=OfferStatus.ACTIVE
+        ).first()
+        if offer is None:
+            raise PermissionDenied("Offer not found or not available.")
+        return offer
+
+    """*************************************************************************************************************
+    /*	function name:		    reserve_available_amount
+    * 	function inputs:	    offer instance read without a lock, crypto amount of the order
+    * 	function outputs:	    the offer with its new available_amount and status, None when it cannot give it
+    * 	function description:	the lock-free reservation, one conditional update that takes the amount only when
+                                the offer is still public, holds it and still has the price that was read (the
+                                repricing pass may have moved it), and flips a sold out offer to COMPLETED in the
+                                same statement. the row lock lasts from the update to the commit only
+    *   call back:              ORDER_BOOK.sync_on_commit()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def reserve_available_amount(offer, amount):
+        connection = connections[router.db_for_write(P2POffer)]
+        amount = P2POffer._meta.get_field('available_amount').get_db_prep_save(amount, connection)
+        with connection.cursor() as cursor:
+            cursor.execute(RESERVE_SQL, {
+                'amount': amount, 'id': offer.id, 'now': timezone.now(),
+                'price': P2POffer._meta.get_field('price').get_db_prep_save(offer.price, connection),
+                'active': OfferStatus.ACTIVE.value, 'completed': OfferStatus.COMPLETED.value,
+            })
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        offer.available_amount, offer.status, offer.updated_at = row
+        # the available amount changed, update the public order book
+        ORDER_BOOK.sync_on_commit(offer)
+        return offer
+
     """*************************************************************************************************************
     /*	function name:		    get_by_id_and_owner
     * 	function inputs:	    offer id  , user id 
@@ -146,7 +289,8 @@ class P2POfferRepository:
     * 	function description:	get the details of the payment method from the main-dashboard according to the id
                                 - Type + holder name if available
                                 - Type + last 4 digits if number availabl
-    *   call back:              get_offer_detail(),  P2POfferDetailSerializer()
+                                served from PAYMENT_METHOD_CACHE, only the misses reach the main-dashboard
+    *   call back:              get_offer_detail(),  P2POfferDetailSerializer(), load_payment_methods_details()
     */
     *************************************************************************************************************"""
     @staticmethod
@@ -154,31 +298,36 @@ class P2POfferRepository:
         if not payment_ids:
             return {}
         try:
-            #filter based on id if included in payment_ids and return list of dict.
-            payment_methods = PaymentMethods.objects.using('main_db').filter(
-                id__in=payment_ids
-            ).values('id', 'type', 'holder_name', 'number', 'payment_method_id')
-
-            #empty dict.
-            payment_map = {}
-            #loop over list of dict.
-            #validate if the id/record has value of type, holder_name,number
-            for pm in payment_methods:
-                display_name = pm['type'] or 'Unknown'
-                if pm.get('holder_name'):
-                    display_name = f"{pm['type']} ({pm['holder_name']})"
-                elif pm.get('number') and len(pm['number']) > 4:
-                    display_name = f"{pm['type']} (****{pm['number'][-4:]})"
-
-                #append the dict ,
-                payment_map[pm['id']] = {
-                    'id': pm['id'],
-                    'type': pm['type'],
-                    'display_name': display_name,
-                    'payment_method_id': pm.get('payment_method_id')
-                }
-            return payment_map
+            # per id read-through cache, only the ids never seen are read from the main dashboard
+            return PAYMENT_METHOD_CACHE.get_many(payment_ids, P2POfferRepository.load_payment_methods_details)
         except Exception as e:
             print(f"Error fetching payment methods: {str(e)}")
             return {}
 
+    @staticmethod
+    def load_payment_methods_details(payment_ids):
+        """read the payment methods from the main dashboard and build their display projection"""
+        #filter based on id if included in payment_ids and return list of dict.
+        payment_methods = PaymentMethods.objects.using('main_db').filter(
+            id__in=payment_ids
+        ).values('id', 'type', 'holder_name', 'number', 'payment_method_id')
+
+        #empty dict.
+        payment_map = {}
+        #loop over list of dict.
+        #validate if the id/record has value of type, holder_name,number
+        for pm in payment_methods:
+            display_name = pm['type'] or 'Unknown'
+            if pm.get('holder_name'):
+                display_name = f"{pm['type']} ({pm['holder_name']})"
+            elif pm.get('number') and len(pm['number']) > 4:
+                display_name = f"{pm['type']} (****{pm['number'][-4:]})"
+
+            #append the dict ,
+            payment_map[pm['id']] = {
+                'id': pm['id'],
+                'type': pm['type'],
+                'display_name': display_name,
+                'payment_method_id': pm.get('payment_method_id')
+            }
+        return payment_map
@@ -4,23 +4,42 @@ from django.db import transaction
 from django.db.models.functions import Coalesce
 
 from ..models.p2p_order_model import P2POrder
-from ..models.p2p_offer_model import P2POffer
-from ..constants.constant import OfferStatus, OrderStatus
+from ..constants.constant import OfferStatus, OrderStatus, PROCESSING_STATUSES, COMPLETED_STATUSES
+from ..engines.p2p_order_book_engine import ORDER_BOOK
 
-from django.db.models import Count, Sum, Value, DecimalField
+from django.db.models import Count, F, Sum, Value, DecimalField
 from django.utils import timezone
 from datetime import timedelta
 
 # ================ HELPER MACROS ================
 from ..helpers import (ORDER_FILTER_MAP,
-                       STATUS_TIME_FIELDS,
+                       ORDER_TRANSITIONS,
                        USER_FILTER,
+                       USER_SIDES,
+                       ORDER_HISTORY_AFTER,
+                       apply_order_filters,
                        get_or_403,
                        buy_filter,
                        sell_filter
                        )
 
 
+# the side of the order that moves it, the taker side is stored on the order (BUY: the taker buys)
+ACTOR_SQL = {
+    'buyer': "CASE WHEN trade_type = 'BUY' THEN taker_id ELSE maker_id END",
+    'seller': "CASE WHEN trade_type = 'BUY' THEN maker_id ELSE taker_id END",
+    'maker': "maker_id",
+}
+# the locked row of the sub-select gives the status before the update (previous_status), the counters move from it
+TRANSITION_SQL = f"""
+    UPDATE {P2POrder._meta.db_table} AS o
+    SET status = %(status)s, version = version + 1, updated_at = %(now)s, {{time_field}} = %(now)s
+    FROM (SELECT id, status FROM {P2POrder._meta.db_table} WHERE id = %(id)s FOR UPDATE) AS previous
+    WHERE o.id = previous.id AND NOT o.is_deleted AND o.status = ANY(%(allowed)s)
+        AND {{actor}} = %(user_id)s{{conditions}}
+    RETURNING o.*, previous.status AS previous_status
+"""
+
 # ================ REPOSITORY CLASS ================
 
 class P2POrderRepository:
@@ -51,41 +70,41 @@ class P2POrderRepository:
         #     print(f"Order not found with ID: {order_id}")  # debugging
         #     raise NotFound("Order not found.")
 
+    """*************************************************************************************************************
+    /*	function name:		    create_order
+    * 	function inputs:	    offer locked by lock_public_offer, taker id, dict of the order details
+    * 	function outputs:	    the created order instance
+    * 	function description:	insert the order and take its amount from the offer, the caller checked the amount
+                                against the locked offer so nothing is read again here, one insert + one update
+    *   call back:              ORDER_BOOK.sync_on_commit()
+    */
+    *************************************************************************************************************"""
     @staticmethod
-    @transaction.atomic
+    @transaction.atomic(savepoint=False)
     def create_order(offer, taker_id, order_data):
-        """
-        Create a new order and update the offer's available amount
-        args:
-            offer: P2POffer instance
-            taker_id: ID of user accepting the offer
-            order_data: Dictionary with order details
-        returns:
-            P2POrder: The created order instance
+        # create the order and update the offer
+        order = P2POrderRepository.insert_order(offer, taker_id, order_data)
 
-        """
-        # lock and validate the amount of the user
-        offer_locked = P2POffer.objects.select_for_update().get(id=offer.id)
+        # update the suffient amount
+        offer.available_amount -= order.crypto_amount
+        if offer.available_amount <= 0:
+            offer.status = OfferStatus.COMPLETED
+        offer.save(update_fields=['available_amount', 'status', 'updated_at'])
+        # the available amount changed, update the public order book
+        ORDER_BOOK.sync_on_commit(offer)
 
-        if offer_locked.available_amount < order_data['crypto_amount']:
-            raise ValueError("Insufficient available amount in offer")
+        return order
 
-        # create the order and update the offer
-        order = P2POrder.objects.create(
-            offer=offer_locked,
-            maker_id=offer_locked.user_id,
+    @staticmethod
+    def insert_order(offer, taker_id, order_data):
+        """insert the order only, the amount already left the offer (reserve_available_amount)"""
+        return P2POrder.objects.create(
+            offer=offer,
+            maker_id=offer.user_id,
             taker_id=taker_id,
             **order_data
         )
 
-        # update the suffient amount
-        offer_locked.available_amount -= order.crypto_amount
-        if offer_locked.available_amount <= 0:
-            offer_locked.status = OfferStatus.COMPLETED
-        offer_locked.save()
-
-        return order
-
     @staticmethod
     def get_orders_for_user(user_id, filters, status_list):
         """
@@ -110,40 +129,118 @@ class P2POrderRepository:
 
         return queryset
 
+    """*************************************************************************************************************
+    /*	function name:		    get_order_history_page
+    * 	function inputs:	    user id, filters, (created_at, id) key of the last order seen, page size
+    * 	function outputs:	    list of the orders of the page newest first, key of the last order in the page
+    * 	function description:	one query over every status, a UNION ALL of the maker branch and the taker branch
+                                (each one served by its (side, status, created_at) index and limited on its own)
+                                ordered by (created_at, id) in the database, a user is never maker and taker of
+                                the same order so the branches do not overlap
+    *   call back:              apply_order_filters(), ORDER_HISTORY_AFTER
+    */
+    *************************************************************************************************************"""
     @staticmethod
-    def update_order_status(order, new_status):
-        """
-        update the order status and time
-        args:
+    def get_order_history_page(user_id, filters, after=None, limit=None):
+        # read one more order to know if there is a next page, limit None returns the whole history
+        end = None if limit is None else limit + 1
+        branches = [
+            P2POrderRepository.history_branch(user_id, side, filters, after).order_by('-created_at', '-id')[:end]
+            for side in USER_SIDES
+        ]
+        page = list(branches[0].union(*branches[1:], all=True).order_by('-created_at', '-id')[:end])
+
+        if limit is not None and len(page) > limit:
+            page = page[:limit]
+            return page, (page[-1].created_at, page[-1].id)
+        return page, None
 
-        order: P2POrder instance
-        new_status: New order status
-
-        returns:
-        instance of order with updated status
-
-        """
-        print(f"Updating order {order.id} status from {order.status} to {new_status}")  # just for debugging
-
-
-        order.status = new_status
-        update_fields = ['status']
-
-        # update time fields
-        if new_status in STATUS_TIME_FIELDS:
-            field_name, time_func = STATUS_TIME_FIELDS[new_status]
-            setattr(order, field_name, time_func())
-            update_fields.append(field_name)
-
-        print(f"Update fields: {update_fields}")  # debugging
+    @staticmethod
+    def count_order_history(user_id, filters):
+        """number of orders of the user in the history, one index count per side"""
+        return sum(P2POrderRepository.history_branch(user_id, side, filters).count() for side in USER_SIDES)
 
-        #create the instance and update the status
-        order.save(update_fields=update_fields)
-        print(f"Order saved successfully. New status: {order.status}")  # debugging
+    @staticmethod
+    def count_orders_by_status(user_id):
+        """number of orders of the user in each status, one GROUP BY over both sides"""
+        return dict(
+            P2POrder.objects.filter(USER_FILTER(user_id)).values_list('status').annotate(count=Count('id')).order_by()
+        )
 
-        return order
+    @staticmethod
+    def history_branch(user_id, side, filters, after=None):
+        """orders of the user on one side (maker_id or taker_id) with the filters and the keyset applied"""
+        queryset = apply_order_filters(
+            P2POrder.objects.filter(**{side: user_id}, status__in=PROCESSING_STATUSES + COMPLETED_STATUSES),
+            filters
+        )
+        return queryset.filter(ORDER_HISTORY_AFTER(*after)) if after else queryset
+
+    """*************************************************************************************************************
+    /*	function name:		    lock_expired_unpaid
+    * 	function inputs:	    current time, chunk size, ids of orders to leave out (optional)
+    * 	function outputs:	    list of dict rows (id, order_number, version, offer_id, crypto_amount, crypto_currency,
+                                maker_id, taker_id, seller_id)
+    * 	function description:	lock the oldest UNPAID orders past their payment deadline, read from the partial
+                                deadline index. SKIP LOCKED leaves the rows of another sweeper (or of a user
+                                acting on the order) to them, so several nodes can sweep at the same time.
+                                must run inside a transaction
+    *   call back:              n/a
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def lock_expired_unpaid(now, limit, exclude_ids=()):
+        rows = (
+            P2POrder.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(status=OrderStatus.UNPAID, payment_time_limit__lt=now)
+            .exclude(id__in=exclude_ids)
+            .order_by('payment_time_limit', 'id')
+            .values('id', 'order_number', 'version', 'offer_id', 'crypto_amount', 'crypto_currency', 'taker_id',
+                    'maker_id', 'offer__user_id', 'offer__trade_type')[:limit]
+        )
+        # the seller holds the escrow, same rule as GET_SELLER_BUYER
+        return [
+            {**row, 'seller_id': row['offer__user_id'] if row['offer__trade_type'] == 'SELL' else row['taker_id']}
+            for row in rows
+        ]
 
+    @staticmethod
+    def cancel_orders(order_ids, now):
+        """cancel a set of locked orders with one update"""
+        return P2POrder.objects.filter(id__in=order_ids, status=OrderStatus.UNPAID).update(
+            status=OrderStatus.CANCELLED, cancelled_at=now, updated_at=now, version=F('version') + 1
+        )
 
+    """*************************************************************************************************************
+    /*	function name:		    transition_order
+    * 	function inputs:	    order id, new status, id of the user moving it, version the user saw (optional)
+    * 	function outputs:	    the order after the transition (with its previous_status), None when the transition
+                                was refused
+    * 	function description:	one conditional update per transition of ORDER_TRANSITIONS, the status, the
+                                version, updated_at and the time field of the new status are written only when
+                                the order is in an allowed status, the user is the right side (and the deadline
+                                and the version still match), two racing transitions cannot both pass. the row
+                                stays locked until the commit for the side effects of the caller
+    *   call back:              n/a
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def transition_order(order_id, new_status, user_id, version=None):
+        allowed, actor, time_field, before_deadline = ORDER_TRANSITIONS[new_status]
+        if not str(order_id).isdigit():
+            return None
+
+        conditions = ''
+        if before_deadline:
+            conditions += ' AND payment_time_limit >= %(now)s'
+        if version is not None:
+            conditions += ' AND version = %(version)s'
+        sql = TRANSITION_SQL.format(time_field=time_field, actor=ACTOR_SQL[actor], conditions=conditions)
+        params = {
+            'id': int(order_id), 'status': new_status, 'allowed': list(allowed), 'user_id': user_id,
+            'version': version, 'now': timezone.now(),
+        }
+        return next(iter(P2POrder.objects.raw(sql, params)), None)
 
     @staticmethod
     def get_pnl_statement_data(user_id, filters):
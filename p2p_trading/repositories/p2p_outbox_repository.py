@@ -0,0 +1,71 @@
+# p2p_trading/repositories/p2p_outbox_repository.py
+
+from django.db.models import Count, Min, Q
+from django.db.models.expressions import RawSQL
+
+from ..models.p2p_outbox_model import OutboxEvent, OutboxCheckpoint
+
+# oldest transaction still running, the events of the transactions before it are all final
+FINISHED_TRANSACTIONS = RawSQL('txid_snapshot_xmin(txid_current_snapshot())', [])
+# events after a checkpoint, in the (transaction_id, id) order of the relay
+AFTER_CHECKPOINT = lambda checkpoint: (
+    Q(transaction_id__gt=checkpoint.transaction_id)
+    | Q(transaction_id=checkpoint.transaction_id, id__gt=checkpoint.event_id)
+)
+
+
+class P2POutboxRepository:
+
+    @staticmethod
+    def add_event(aggregate_type, aggregate_id, event_type, payload):
+        """write one event, in the transaction of the change it tells about"""
+        return OutboxEvent.objects.create(
+            aggregate_type=aggregate_type, aggregate_id=aggregate_id, event_type=event_type, payload=payload
+        )
+
+    @staticmethod
+    def add_events(events):
+        """write many events with one insert, each item is (aggregate_type, aggregate_id, event_type, payload)"""
+        return OutboxEvent.objects.bulk_create([
+            OutboxEvent(aggregate_type=aggregate_type, aggregate_id=aggregate_id, event_type=event_type,
+                        payload=payload)
+            for aggregate_type, aggregate_id, event_type, payload in events
+        ])
+
+    @staticmethod
+    def lock_checkpoint(consumer):
+        """checkpoint of the consumer locked for one relay pass, None while another relay holds it"""
+        OutboxCheckpoint.objects.get_or_create(consumer=consumer)
+        return OutboxCheckpoint.objects.select_for_update(skip_locked=True).filter(consumer=consumer).first()
+
+    @staticmethod
+    def save_checkpoint(checkpoint, event):
+        checkpoint.transaction_id, checkpoint.event_id = event.transaction_id, event.id
+        checkpoint.save(update_fields=['transaction_id', 'event_id', 'updated_at'])
+
+    @staticmethod
+    def get_batch(checkpoint, limit):
+        """next events of the consumer, only from the finished transactions so the order never changes behind it"""
+        return list(
+            OutboxEvent.objects.filter(AFTER_CHECKPOINT(checkpoint), transaction_id__lt=FINISHED_TRANSACTIONS)
+            .order_by('transaction_id', 'id')[:limit]
+        )
+
+    @staticmethod
+    def get_lag(checkpoint):
+        """events waiting for the consumer and the creation time of the oldest one"""
+        return OutboxEvent.objects.filter(AFTER_CHECKPOINT(checkpoint)).aggregate(
+            events=Count('id'), oldest=Min('created_at')
+        )
+
+    @staticmethod
+    def prune(before, consumers=()):
+        """delete the events older than before that every consumer already passed, consumers are the names of
+        the registered ones: one without a checkpoint yet has passed nothing, every event is kept for it"""
+        checkpoints = list(OutboxCheckpoint.objects.all())
+        if set(consumers) - {checkpoint.consumer for checkpoint in checkpoints}:
+            return 0
+        events = OutboxEvent.objects.filter(created_at__lt=before)
+        for checkpoint in checkpoints:
+            events = events.exclude(AFTER_CHECKPOINT(checkpoint))
+        return events.delete()[0]
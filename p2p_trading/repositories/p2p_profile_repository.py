@@ -1,9 +1,14 @@
 # p2p_trading/repositories/p2p_profile_repository.py
 import time
 
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
 
-from ..models import P2PProfile,Feedback,BlockedUser,P2POrder,Follow
+from ..models import P2PProfile,Feedback,BlockedUser,P2POrder,Follow,Wallet
+from ..engines.p2p_payment_method_cache import PAYMENT_METHOD_CACHE
+from ..engines.p2p_block_cache import BLOCK_CACHE
 #from ..models.p2p_order_model import P2POrder
 
 from ..helpers import get_or_403, validate_and_raise
@@ -15,6 +20,10 @@ GET_OR_CREATE_PROFILE = lambda user_id: P2PProfile.objects.get_or_create(
     defaults={'nickname': f'P2P-{user_id[:8]}' if isinstance(user_id, str) else f'P2P-user-{user_id}'}
 )[0]
 
+# short-lived nickname cache of the order lists, a nickname change drops the entry
+NICKNAME_KEY = lambda user_id: f"p2p_nickname_{user_id}"
+NICKNAME_TTL = 60
+
 
 class P2PProfileRepository:
 
@@ -32,6 +41,21 @@ class P2PProfileRepository:
             'username'
         ).first()
 
+    @staticmethod
+    def get_viewer_stats(user_id):
+        """
+        what the offer restrictions are checked against, two queries whatever the number of offers
+        args:
+            user_id (int): user id
+        return:
+            dict: registration_days (age of the p2p profile) and holdings {currency: balance}
+        """
+        joined = P2PProfile.objects.filter(user_id=user_id).values_list('created_at', flat=True).first()
+        return {
+            'registration_days': (timezone.now() - joined).days if joined else 0,
+            'holdings': dict(Wallet.objects.filter(user_id=user_id).values_list('currency', 'balance')),
+        }
+
     @staticmethod
     def is_nickname_taken(nickname):
         """
@@ -96,6 +120,48 @@ class P2PProfileRepository:
 
         return P2PProfile.objects.filter(user_id__in=user_ids)
 
+    @staticmethod
+    def get_missing_profiles(user_ids):
+        """the user ids without a profile, one query"""
+        existing = set(P2PProfile.objects.filter(user_id__in=user_ids).order_by().values_list('user_id', flat=True))
+        return [user_id for user_id in user_ids if user_id not in existing]
+
+    @staticmethod
+    def bulk_create_profiles(nicknames):
+        """
+        profiles of {user_id: nickname} with one insert
+        returns:
+        the user ids still without a profile, their nickname was taken by another one
+        """
+        P2PProfile.objects.bulk_create(
+            [P2PProfile(user_id=user_id, nickname=nickname) for user_id, nickname in nicknames.items()],
+            ignore_conflicts=True,
+        )
+        return P2PProfileRepository.get_missing_profiles(list(nicknames))
+
+    """*************************************************************************************************************
+    /*	function name:		    get_nicknames
+    * 	function inputs:	    user ids
+    * 	function outputs:	    dict {user_id: nickname} of the ids that have a profile
+    * 	function description:	nicknames of a whole page of orders, served from the nickname cache and the
+                                missing ones read with one query (ids without a profile are not cached)
+    *   call back:              n/a
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def get_nicknames(user_ids):
+        user_ids = set(user_ids)
+        cached = cache.get_many([NICKNAME_KEY(user_id) for user_id in user_ids])
+        nicknames = {
+            user_id: cached[NICKNAME_KEY(user_id)] for user_id in user_ids if NICKNAME_KEY(user_id) in cached
+        }
+        missing = user_ids - nicknames.keys()
+        if missing:
+            loaded = dict(P2PProfile.objects.filter(user_id__in=missing).values_list('user_id', 'nickname'))
+            cache.set_many({NICKNAME_KEY(user_id): nickname for user_id, nickname in loaded.items()}, NICKNAME_TTL)
+            nicknames.update(loaded)
+        return nicknames
+
     @staticmethod
     def update_profile(profile, **kwargs):
         """
@@ -111,6 +177,8 @@ class P2PProfileRepository:
             setattr(profile, key, value)
         #retrun object from the profile with the edited fileds
         profile.save()
+        if 'nickname' in kwargs:
+            transaction.on_commit(lambda: cache.delete(NICKNAME_KEY(profile.user_id)))
         return profile
 
     @staticmethod
@@ -149,6 +217,8 @@ class P2PProfileRepository:
             number=method_data.get('account_number', ''),
             primary=False
         )
+        # the id may be cached as missing
+        PAYMENT_METHOD_CACHE.invalidate([payment_method.id])
 
         return payment_method
 
@@ -169,6 +239,7 @@ class P2PProfileRepository:
             setattr(method, key, value)
         #get the object of the payment method
         method.save()
+        PAYMENT_METHOD_CACHE.invalidate([method.id])
         return method
 
 
@@ -220,7 +291,9 @@ class P2PProfileRepository:
 
         """
         method = get_or_403(PaymentMethods, id=method_id, user_id=profile.user_id)
+        method_pk = method.id
         method.delete()
+        PAYMENT_METHOD_CACHE.invalidate([method_pk])
         return method
 
 
@@ -370,6 +443,15 @@ class P2PProfileRepository:
             Q(blocker=profile2, blocked=profile1)
         ).exists()
 
+    @staticmethod
+    def is_blocked_between(user_id, other_user_id):
+        """one EXISTS query on the (blocker, blocked) unique index, a block in either direction of the two users"""
+        return BlockedUser.objects.filter(
+            Q(blocker__user_id=user_id, blocked__user_id=other_user_id) |
+            Q(blocker__user_id=other_user_id, blocked__user_id=user_id)
+        ).exists()
+
+
 
     @staticmethod
     def get_blocked_users(profile):
@@ -378,17 +460,22 @@ class P2PProfileRepository:
 
     @staticmethod
     def block_user(blocker_profile, blocked_profile):
-        return BlockedUser.objects.get_or_create(
+        block, created = BlockedUser.objects.get_or_create(
             blocker=blocker_profile,
             blocked=blocked_profile
-        )[0]
+        )
+        if created:
+            BLOCK_CACHE.refresh(blocker_profile.user_id, blocked_profile.user_id)
+        return block
 
     @staticmethod
     def unblock_user(blocker_profile, blocked_profile):
-        BlockedUser.objects.filter(
+        deleted, _ = BlockedUser.objects.filter(
             blocker=blocker_profile,
             blocked=blocked_profile
         ).delete()
+        if deleted:
+            BLOCK_CACHE.refresh(blocker_profile.user_id, blocked_profile.user_id)
 
     @staticmethod
     def get_followers(profile):
@@ -1,9 +1,27 @@
 # p2p_trading/repositories/p2p_wallet_repository.py
 
+from django.db import connections, router
+from django.db.models import Case, Max, Min, OuterRef, Subquery, When
+from django.utils import timezone
+
+from ..constants.constant import TransactionType
+from ..models.p2p_order_model import P2POrder
 from ..models.p2p_transaction_model import Transaction
+from ..models.p2p_wallet_model import Wallet
 
 from  ..helpers import CREATE_WALLET
 
+# empty wallets of (user_id, currency) pairs with one insert, a pair another writer created first is skipped by
+# the unique key and left out of the rows returned
+CREATE_WALLETS_SQL = f"""
+    INSERT INTO {Wallet._meta.db_table} (user_id, currency, balance, locked_balance, created_at, updated_at,
+        is_deleted)
+    SELECT user_id, currency, 0, 0, %(now)s, %(now)s, false
+    FROM unnest(%(user_ids)s::integer[], %(currencies)s::varchar[]) AS pairs (user_id, currency)
+    ON CONFLICT (user_id, currency) DO NOTHING
+    RETURNING user_id, currency
+"""
+
 
 class P2PWalletRepository:
 
@@ -13,38 +31,69 @@ class P2PWalletRepository:
         return CREATE_WALLET(user_id, currency)
 
     @staticmethod
-    def update_wallet_balance(wallet, balance_delta=0, locked_delta=0):
-        """
-        this function to update the wallet balance
-        args:
-            wallet: the wallet to update
-            balance_delta: the amount of the wallet balance
-            locked_delta: the amount of the wallet locked
-        return:
-            the updated wallet balance
-        """
-        wallet.balance += balance_delta
-        wallet.locked_balance += locked_delta
-        wallet.save()
-        return wallet
+    def lock_wallet(user_id, currency):
+        """the wallet row locked until the end of the transaction, an empty wallet is created when there is none"""
+        wallet = Wallet.objects.select_for_update().filter(user_id=user_id, currency=currency).first()
+        return wallet or CREATE_WALLET(user_id, currency)
+
+    # ================ PROVISIONING ================
+    @staticmethod
+    def get_missing_wallets(user_ids, currencies):
+        """(user_id, currency) pairs of user_ids x currencies without a wallet, one query"""
+        existing = set(
+            Wallet.objects.filter(user_id__in=user_ids, currency__in=currencies).order_by()
+            .values_list('user_id', 'currency')
+        )
+        return [(user_id, currency) for user_id in user_ids for currency in currencies
+                if (user_id, currency) not in existing]
+
+    @staticmethod
+    def bulk_create_wallets(pairs):
+        """empty wallets of the pairs with one insert, returns the (user_id, currency) pairs this insert created
+        (a wallet created meanwhile by another writer is skipped and not returned)"""
+        with connections[router.db_for_write(Wallet)].cursor() as cursor:
+            cursor.execute(CREATE_WALLETS_SQL, {
+                'user_ids': [user_id for user_id, _ in pairs], 'currencies': [currency for _, currency in pairs],
+                'now': timezone.now(),
+            })
+            return [tuple(row) for row in cursor.fetchall()]
+
+    # ================ RECONCILIATION READS ================
+    @staticmethod
+    def get_wallet_id_bounds():
+        """(smallest, largest) wallet id, (None, None) without wallets"""
+        bounds = Wallet.objects.aggregate(first=Min('id'), last=Max('id'))
+        return bounds['first'], bounds['last']
+
+    @staticmethod
+    def stream_wallets(first_id, last_id, chunk_size):
+        """(id, user_id, currency, balance, locked_balance) of the wallets first_id <= id < last_id in id order,
+        read with a server-side cursor chunk_size rows at a time"""
+        return (
+            Wallet.objects.filter(id__gte=first_id, id__lt=last_id).order_by('id')
+            .values_list('id', 'user_id', 'currency', 'balance', 'locked_balance').iterator(chunk_size=chunk_size)
+        )
 
+    """*************************************************************************************************************
+    /*	function name:		    stream_history
+    * 	function inputs:	    first wallet id, last wallet id (excluded), rows per fetch
+    * 	function outputs:	    iterator of (id, wallet_id, transaction_type, amount, running_balance, order amount)
+    * 	function description:	the transactions of the wallets of the range in the order they were applied
+                                (wallet, created_at, id), walked on the history index with a server-side cursor.
+                                the order amount is only read for the RELEASE_ESCROW rows written with an amount
+                                of 0 before the journal, the locked amount they released is the crypto of their order
+    *   call back:              n/a
+    */
+    *************************************************************************************************************"""
     @staticmethod
-    def create_transaction(wallet, order=None, tx_type=None, amount=0):
-        """
-        this functiom that create transaction
-        args:
-            wallet: the wallet to create
-            order: the order to create the transaction
-            tx_type: the transaction type
-            amount: the amount of the transaction
-        return:
-            the created transaction
-
-        """
-        return Transaction.objects.create(
-            wallet=wallet,
-            related_order=order,
-            transaction_type=tx_type,
-            amount=amount,
-            running_balance=wallet.balance
-        )
\ No newline at end of file
+    def stream_history(first_id, last_id, chunk_size):
+        order_amount = P2POrder.objects.filter(id=OuterRef('related_order_id')).values('crypto_amount')
+        return (
+            Transaction.objects.filter(wallet_id__gte=first_id, wallet_id__lt=last_id)
+            .annotate(order_amount=Case(When(
+                transaction_type=TransactionType.RELEASE_ESCROW, amount=0, then=Subquery(order_amount)
+            )))
+            .order_by('wallet_id', 'created_at', 'id')
+            .values_list('id', 'wallet_id', 'transaction_type', 'amount', 'running_balance', 'order_amount')
+            .iterator(chunk_size=chunk_size)
+        )
@@ -0,0 +1,200 @@
+# p2p_trading/serializers/p2p_offer_fast_serializer.py
+"""compiled output path of the offer serializers
+
+the DRF serializers (P2POfferPublicSerializer, P2POfferListSerializer, P2POfferDetailSerializer) stay the
+reference of the output, this module reads their field lists once and compiles each field into a plain
+converter (decimal quantize and format, int, str, identity). an offer is then rendered with one dict
+comprehension over the compiled fields plus the extra keys of its to_representation, no bound field,
+no get_attribute and no ReturnDict per offer.
+
+the source of an offer can be a model instance (order book entries, querysets) or a `.values()` row,
+both are read as a mapping (the instance __dict__ holds the field values and the attached user_profile).
+the json of both paths is byte-identical, checked by the equivalence tests.
+"""
+
+import datetime
+import decimal
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from ..constants.constant import PriceType
+from .p2p_offer_serilaizer import P2POfferPublicSerializer, P2POfferListSerializer, P2POfferDetailSerializer
+
+# ================ HELPER MACROS ================
+from ..helpers import (
+    format_currency,
+    get_user_display_name,
+    get_profile_stats
+)
+
+NO_PAYMENT_METHOD = "there no payment method provided"
+# instance or .values() row -> mapping of the field values
+AS_ROW = lambda obj: obj if isinstance(obj, dict) else obj.__dict__
+
+
+"""*************************************************************************************************************
+/*	function name:		    compile_field
+* 	function inputs:	    bound DRF field of the reference serializer, current time zone
+* 	function outputs:	    function value -> primitive, same result as field.to_representation(value)
+* 	function description:	plain converter for the field types of the offer serializers, any other type,
+                            option or unexpected value keeps the DRF to_representation
+*   call back:              n/a
+*/
+*************************************************************************************************************"""
+def compile_field(field, tz):
+    if isinstance(field, serializers.DecimalField):
+        coerce = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+        if not coerce or field.localize or field.normalize_output or field.decimal_places is None:
+            return field.to_representation
+        exponent = Decimal('.1') ** field.decimal_places
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        rounding, fallback = field.rounding, field.to_representation
+        return lambda value: (
+            '{:f}'.format(value.quantize(exponent, rounding=rounding, context=context))
+            if type(value) is Decimal else fallback(value)
+        )
+    if isinstance(field, serializers.DateTimeField):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if not settings.USE_TZ or hasattr(field, 'timezone') or (output_format or '').lower() != ISO_8601:
+            return field.to_representation
+        fallback = field.to_representation
+
+        def convert(value):
+            if type(value) is not datetime.datetime or value.tzinfo is None:
+                return fallback(value)
+            text = value.astimezone(tz).isoformat()
+            return text[:-6] + 'Z' if text.endswith('+00:00') else text
+        return convert
+    if isinstance(field, serializers.ChoiceField):
+        choices = field.choice_strings_to_values
+        return lambda value: choices.get(str(value), value)
+    if isinstance(field, serializers.IntegerField):
+        return int
+    if isinstance(field, serializers.CharField):
+        return str
+    if isinstance(field, serializers.JSONField) and not field.binary:
+        return lambda value: value
+    return field.to_representation
+
+
+# ================ BASE CLASS ================
+class CompiledOfferSerializer(ABC):
+    """fields of the reference serializer compiled once, subclasses add the keys of its to_representation"""
+    serializer_class = None
+
+    def __init__(self):
+        self._compiled = {}     # time zone -> compiled fields
+
+    def fields(self):
+        """(output name, source attribute, converter) of each readable field, compiled once per time zone"""
+        tz = timezone.get_current_timezone()
+        fields = self._compiled.get(tz)
+        if fields is None:
+            fields = self._compiled[tz] = tuple(
+                (name, field.source, compile_field(field, tz))
+                for name, field in self.serializer_class().fields.items() if not field.write_only
+            )
+        return fields
+
+    @property
+    def sources(self):
+        """field names to pass to .values() when the offers are read as rows"""
+        return [source for _, source, _ in self.fields()]
+
+    def render(self, obj, context=None, fields=None):
+        row = AS_ROW(obj)
+        data = {
+            name: None if (value := row[source]) is None else convert(value)
+            for name, source, convert in fields or self.fields()
+        }
+        self.extend(data, row, obj, context or {})
+        return data
+
+    def render_many(self, objs, context=None):
+        context, fields = context or {}, self.fields()
+        return [self.render(obj, context, fields) for obj in objs]
+
+    @abstractmethod
+    def extend(self, data, row, obj, context):
+        """add the computed keys, row is the mapping of obj"""
+
+    @staticmethod
+    def advertiser(row):
+        profile, user_id = row.get('user_profile'), row['user_id']
+        return {
+            'user_id': user_id,
+            'nickname': get_user_display_name(profile, user_id),
+            **get_profile_stats(profile)
+        }
+
+
+# ================ PUBLIC ================
+class CompiledPublicSerializer(CompiledOfferSerializer):
+    """P2POfferPublicSerializer, the public feed renders the order book entries (instances) with it"""
+    serializer_class = P2POfferPublicSerializer
+
+    def extend(self, data, row, obj, context):
+        fiat = row['fiat_currency']
+        payment_map = context.get('payment_details_map')
+        if payment_map is None:
+            payment_types = obj.payment_types or [NO_PAYMENT_METHOD]
+        elif not payment_map:
+            payment_types = [NO_PAYMENT_METHOD]
+        else:
+            payment_types = [payment_map.get(pid, {}).get('type', 'Unknown') for pid in row['payment_method_ids']]
+
+        data['advertiser'] = self.advertiser(row)
+        data['order_limit'] = f"{row['min_order_limit']:.2f} - {row['max_order_limit']:.2f} {fiat}"
+        data['available_order_limit'] = format_currency(row['available_amount'] * row['price'], fiat, 2)
+        data['payment_methods'] = payment_types
+
+
+# ================ LIST ================
+class CompiledListSerializer(CompiledOfferSerializer):
+    """P2POfferListSerializer, the my offers page renders .values() rows with it"""
+    serializer_class = P2POfferListSerializer
+
+    def extend(self, data, row, obj, context):
+        payment_map = context.get('payment_details_map', {})
+        total, available = row['total_amount'], row['available_amount']
+        if row['price_type'] == PriceType.FIXED:
+            price_display = format_currency(row['price'], row['fiat_currency'], 2)
+        else:
+            margin = row['price_margin'] or Decimal('0')
+            price_display = f"Market {'+' if margin >= 0 else ''}{margin}%"
+
+        data['offer_no'] = str(row['id']).replace('-', '')[:8].upper()
+        data['total_amount_display'] = format_currency(total, row['crypto_currency'])
+        data['price_display'] = price_display
+        data['completed_rate'] = "0.0%" if total <= 0 else f"{((total - available) / total) * 100:.1f}%"
+        data['payment_methods_details'] = [
+            payment_map.get(pid, {}).get('display_name', f"Payment Method #{pid}")
+            for pid in (row['payment_method_ids'] or [])
+        ]
+
+
+# ================ DETAIL ================
+class CompiledDetailSerializer(CompiledOfferSerializer):
+    """P2POfferDetailSerializer, one offer with its advertiser and limits"""
+    serializer_class = P2POfferDetailSerializer
+
+    def extend(self, data, row, obj, context):
+        data['advertiser'] = self.advertiser(row)
+        data['order_limit'] = {
+            'min': format_currency(row['min_order_limit'], row['fiat_currency'], 2),
+            'max': format_currency(row['max_order_limit'], row['fiat_currency'], 2),
+            'available': format_currency(row['available_amount'], row['crypto_currency'])
+        }
+        data['payment_methods'] = row['payment_method_ids'] or []
+
+
+FAST_PUBLIC_SERIALIZER = CompiledPublicSerializer()
+FAST_LIST_SERIALIZER = CompiledListSerializer()
+FAST_DETAIL_SERIALIZER = CompiledDetailSerializer()
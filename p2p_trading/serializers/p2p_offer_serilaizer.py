@@ -89,12 +89,15 @@ class BaseOfferSerializer(serializers.ModelSerializer):
     /*	function name:		    _get_payment_types
     * 	function inputs:	    instance of model
     * 	function outputs:	    return payment_method 
-    * 	function description:	return the payment method id and deatils for each    
+    * 	function description:	return the payment method id and deatils for each, without payment_details_map
+                                the types stored with the offer are used (no call to the main dashboard)
     *   call back:              n/a
     */
     *************************************************************************************************************"""
     def _get_payment_types(self, obj):
-        payment_map = self.context.get('payment_details_map', {})
+        payment_map = self.context.get('payment_details_map')
+        if payment_map is None:
+            return obj.payment_types or ["there no payment method provided"]
         if not payment_map:
             return ["there no payment method provided"]
         return [payment_map.get(payment_id, {}).get('type', 'Unknown') for payment_id in obj.payment_method_ids]
@@ -53,8 +53,11 @@ class P2POrderListSerializer(serializers.ModelSerializer):
         }
 
     def get_counterparty(self, obj):
-        """get the counterparty"""
+        """get the counterparty, from the counterparty_names of the page when the caller resolved them"""
         counterparty_id = get_counterparty_id(obj, self.context['request'].user.id)
+        names = self.context.get('counterparty_names')
+        if names is not None:
+            return names.get(counterparty_id) or f"User{counterparty_id}"
         try:
             return P2PProfile.objects.get(user_id=counterparty_id).nickname
         except P2PProfile.DoesNotExist:
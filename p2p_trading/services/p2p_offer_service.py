@@ -1,18 +1,41 @@
 # p2p_trading/services/p2p_offer_service.py
 
+from decimal import Decimal
+
+from django.core.cache import cache
 from django.db import transaction
 
+from ..constants.constant import PriceType
+from ..engines.p2p_price_engine import PRICE_ENGINE
+from ..engines.p2p_block_cache import BLOCK_CACHE
 from ..repositories.p2p_offer_repository import P2POfferRepository
+from ..repositories.p2p_outbox_repository import P2POutboxRepository
 from ..repositories.p2p_profile_repository import P2PProfileRepository
 from ..serializers.p2p_offer_serilaizer import P2POfferCreateSerializer
+from ..serializers.p2p_offer_fast_serializer import FAST_PUBLIC_SERIALIZER
 
 
 # ================ HELPER MACROS ================
 from ..helpers import (
     validate_and_raise,
     OfferValidator,
-    enrich_offers_with_profiles
+    enrich_offers_with_profiles,
+    ENCODE_CURSOR,
+    decode_cursor,
+    NORMALIZE_FEED_FILTERS,
+    FEED_CACHE_KEY,
+    CAN_TAKE_OFFER,
+    IS_RESTRICTED,
+    OFFER_EVENT,
 )
+
+# seconds a rendered feed page is kept, writes never wait for it (the key holds the pair versions),
+# it only bounds how old the advertiser stats of a cached page can be
+FEED_CACHE_TTL = 60
+# seconds the viewer stats used by the feed eligibility are kept
+VIEWER_STATS_TTL = 60
+VIEWER_STATS_KEY = lambda user_id: f"p2p_viewer_stats_{user_id}"
+
 # ================ SERVICE CLASS ================
 class P2POfferService:
     repo = P2POfferRepository()  # Repository instance
@@ -51,9 +74,15 @@ class P2POfferService:
             'user_id': user_id,
             'available_amount': validated_data['total_amount']
         })
+        if validated_data.get('price_type') == PriceType.FLOATING:
+            # floating offers store the effective price, the repricing pass keeps it up to date
+            validated_data['price'] = PRICE_ENGINE.effective_price(
+                validated_data['crypto_currency'], validated_data['fiat_currency'],
+                validated_data.get('price_margin'), validated_data.get('price')
+            )
 
-        # 4. Create offer
-        return P2POfferService.repo.create_offer(validated_data)
+        # 4. Create offer, its event is written in the same transaction
+        return P2POfferService.record_event(P2POfferService.repo.create_offer(validated_data), 'offer.created')
 
     """*************************************************************************************************************
     /*	function name:		    get_user_offers
@@ -94,7 +123,11 @@ class P2POfferService:
         offer = P2POfferService.repo.get_by_id_and_owner(user_id,offer_id)
         #apply validations over offer status, total amount
         OfferValidator.validate_offer_update(offer, data)
-        return P2POfferService.repo.update_offer(offer, data)
+        if offer.price_type == PriceType.FLOATING and 'price_margin' in data:
+            data = {**data, 'price': PRICE_ENGINE.effective_price(
+                offer.crypto_currency, offer.fiat_currency, data['price_margin'], data.get('price', offer.price)
+            )}
+        return P2POfferService.record_event(P2POfferService.repo.update_offer(offer, data), 'offer.updated')
 
     """*************************************************************************************************************
     /*	function name:		    delete_offer
@@ -111,26 +144,97 @@ class P2POfferService:
         offer = P2POfferService.repo.get_by_id_and_owner(user_id, offer_id)
         #apply validations to check if there are active orders within this offer
         OfferValidator.validate_offer_deletion(offer)
-        return P2POfferService.repo.soft_delete(offer)
+        return P2POfferService.record_event(P2POfferService.repo.soft_delete(offer), 'offer.deleted')
+
+    @staticmethod
+    def record_event(offer, event_type):
+        """write the outbox event of an offer change inside the transaction of the change, returns the offer"""
+        P2POutboxRepository.add_event('offer', offer.id, event_type, OFFER_EVENT(offer))
+        return offer
 
     """*************************************************************************************************************
     /*	function name:		    get_public_offers
-    * 	function inputs:	    user id, offer_id 
-    * 	function outputs:	    instance of the offer model
-    * 	function description:	function to get all the objects/records of offer model 
+    * 	function inputs:	    filters, cursor of the previous page, page size
+    * 	function outputs:	    dict of the page offers, the cursor of the next page and the count estimate
+    * 	function description:	keyset page of the public offers on (price, id), the cost of the page does not
+                                depend on how deep the cursor is
     *    call back:             get_public_offers(),enrich_offers_with_profiles(),get_profiles_by_user_ids()
     */
     *************************************************************************************************************"""
     @staticmethod
-    def get_public_offers(filters):
+    def get_public_offers(filters, cursor=None, page_size=None, viewer=None):
+        clean_filters = {k: v for k, v in filters.items() if v}
+        after = decode_cursor(cursor, Decimal, int)
+        offers, last_key = P2POfferService.repo.get_public_offers(clean_filters, after, page_size, viewer)
+        return {
+            'offers': enrich_offers_with_profiles(offers, P2PProfileRepository.get_profiles_by_user_ids),
+            'next_cursor': ENCODE_CURSOR(*last_key) if last_key else None,
+            'count': P2POfferService.repo.count_public_offers(clean_filters, viewer),
+        }
+
+
+    """*************************************************************************************************************
+    /*	function name:		    get_public_feed
+    * 	function inputs:	    filters, cursor of the previous page, page size, id of the authenticated viewer
+    * 	function outputs:	    dict of the rendered page, the count estimate and the cursor of the next page
+    * 	function description:	response cache of the public feed keyed on the normalized filters, the page and
+                                the versions of the pairs, any write to a pair changes the key so a cached page
+                                is never older than the book. authenticated viewers only get the offers they
+                                can take and never the offers of the users on the other side of a block, their
+                                signature is part of the key only when they have blocks or the pairs have
+                                restrictions
+    *    call back:             public_offers_version(), get_public_offers(), FAST_PUBLIC_SERIALIZER,
+                                get_viewer_stats(), BLOCK_CACHE.get()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def get_public_feed(filters, cursor=None, page_size=None, viewer_id=None):
         clean_filters = {k: v for k, v in filters.items() if v}
-        offers = P2POfferService.repo.get_public_offers(clean_filters)
-        return enrich_offers_with_profiles(offers, P2PProfileRepository.get_profiles_by_user_ids)
+        # the block set is read on every request, a block must apply at once and not after the stats ttl
+        viewer = {
+            **P2POfferService.get_viewer_stats(viewer_id), 'hidden': BLOCK_CACHE.get(viewer_id)
+        } if viewer_id else None
+        # read the version before the page, a write in between only makes the cached page fresher
+        version, personal = P2POfferService.repo.public_offers_version(clean_filters, viewer)
+        key = FEED_CACHE_KEY(NORMALIZE_FEED_FILTERS(clean_filters), cursor, page_size, version)
+
+        feed = cache.get(key)
+        if feed is None:
+            page = P2POfferService.get_public_offers(clean_filters, cursor, page_size,
+                                                     viewer if personal else None)
+            feed = {
+                'data': FAST_PUBLIC_SERIALIZER.render_many(page['offers']),
+                'count': page['count'],
+                'next_cursor': page['next_cursor'],
+            }
+            cache.set(key, feed, FEED_CACHE_TTL)
+        return feed
 
+    @staticmethod
+    def get_viewer_stats(user_id):
+        """account age and holdings of the viewer, loaded once for the whole feed and cached"""
+        stats = cache.get(VIEWER_STATS_KEY(user_id))
+        if stats is None:
+            stats = P2PProfileRepository.get_viewer_stats(user_id)
+            cache.set(VIEWER_STATS_KEY(user_id), stats, VIEWER_STATS_TTL)
+        return stats
+
+    @staticmethod
+    def validate_counterparty(offer, user_id):
+        """order intake check of the blocks and the offer restrictions, always on the database and not on the
+        cached block sets of the feed"""
+        validate_and_raise(
+            P2PProfileRepository.is_blocked_between(user_id, offer.user_id), "You cannot trade with this user"
+        )
+        if IS_RESTRICTED(offer):
+            validate_and_raise(
+                not CAN_TAKE_OFFER(P2PProfileRepository.get_viewer_stats(user_id), offer),
+                "You do not meet the counterparty requirements of this offer"
+            )
 
     """*************************************************************************************************************
     /*	function name:		    get_payment_methods_for_offers
-    * 	function inputs:	    queryset/objects of offer model
+    * 	function inputs:	    queryset/objects of offer model or .values() rows
     * 	function outputs:	    list of unique_ids
     * 	function description:	get id for each offer and pass the ids to the repository
     *   call back:              get_payment_methods_details()
@@ -143,8 +247,9 @@ class P2POfferService:
         all_payment_ids = []
         #loop all the offers/queryset to append the payment-method-id
         for offer in offers:
-            if offer.payment_method_ids:
-                all_payment_ids.extend(offer.payment_method_ids)
+            payment_ids = offer['payment_method_ids'] if isinstance(offer, dict) else offer.payment_method_ids
+            if payment_ids:
+                all_payment_ids.extend(payment_ids)
 
         # remove the repeats
         unique_ids = list(set(all_payment_ids))
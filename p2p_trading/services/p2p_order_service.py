@@ -1,15 +1,24 @@
 # p2p_trading/services/p2p_order_service.py
 
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.utils import timezone
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from django.db import transaction
 from django.core.cache import cache
 
 from ..constants.constant import OrderStatus, COMPLETED_STATUSES, PROCESSING_STATUSES
+from ..engines.p2p_order_counters import ORDER_COUNTERS
+from ..engines.p2p_order_stream import ORDER_STREAM, STATUS_MESSAGE
 from ..repositories.p2p_offer_repository import P2POfferRepository
 from ..repositories.p2p_order_repository import P2POrderRepository
+from ..repositories.p2p_outbox_repository import P2POutboxRepository
+from ..repositories.p2p_profile_repository import P2PProfileRepository
 from ..serializers.p2p_order_serializer import P2POrderCreateSerializer
 from ..services.p2p_wallet_service import WalletService
+from ..services.p2p_offer_service import P2POfferService
 
 
 # ================ HELPER MACROS ================
@@ -18,39 +27,145 @@ from ..helpers import (
     validate_and_raise,
     GET_TAKER_TYPE,
     PAYMENT_DEADLINE,
-    GET_SELLER_BUYER,
+    GET_OFFER_SELLER,
+    GET_ORDER_SELLER_BUYER,
+    ORDER_FILTER_MAP,
+    ORDER_EVENT,
+    get_counterparty_id,
+    ENCODE_CURSOR,
+    decode_cursor,
 
 )
 
 # ================SERVICE CLASS ================
 
 # Repository mapping
-REPO = {'offer': P2POfferRepository, 'order': P2POrderRepository}
+REPO = {'offer': P2POfferRepository, 'order': P2POrderRepository, 'profile': P2PProfileRepository,
+        'outbox': P2POutboxRepository}
+
+# details of a new order taken from an offer, passed validation
+ORDER_DATA = lambda offer, price, crypto_amount, fiat_amount: {
+    'trade_type': GET_TAKER_TYPE(offer.trade_type),
+    'crypto_currency': offer.crypto_currency,
+    'fiat_currency': offer.fiat_currency,
+    'price': price,
+    'crypto_amount': crypto_amount,
+    'fiat_amount': fiat_amount,
+    'payment_time_limit': PAYMENT_DEADLINE(offer.payment_time_limit_minutes),
+    'status': OrderStatus.UNPAID
+}
 
 class P2POrderService:
 
+    """*************************************************************************************************************
+    /*	function name:		    create_order_from_offer
+    * 	function inputs:	    taker id, request data (offer_id, fiat_amount), reservation path (P2P_ORDER_RESERVATION
+                                when None)
+    * 	function outputs:	    the created order instance with its funds locked
+    * 	function description:	validate the request and take the order through the reservation path:
+                                    lock         row locks, create_locked_order()
+                                    conditional  conditional updates, create_reserved_order()
+    *   call back:              create_locked_order(), create_reserved_order()
+    */
+    *************************************************************************************************************"""
     @staticmethod
-    @transaction.atomic
-    def create_order_from_offer(taker_id, data):
-        """
-        Create a new P2P order from an existing offer
-
-        args:
-            taker_id (int): ID of the user accepting the offer
-            data (dict): Request data
-
-        returns:
-            P2POrder: The created order instance with locked funds
-        """
+    def create_order_from_offer(taker_id, data, reservation=None):
         # validate the data
         serializer = P2POrderCreateSerializer(data=data)
         validate_and_raise(not serializer.is_valid(), serializer.errors)
 
-        # get the instance of offer
-        offer = REPO['offer'].get_public_offer_by_id(data['offer_id'])
+        reservation = reservation or settings.P2P_ORDER_RESERVATION
+        if reservation not in RESERVATIONS:
+            raise ImproperlyConfigured(f"P2P_ORDER_RESERVATION must be one of {', '.join(RESERVATIONS)}")
+        create = RESERVATIONS[reservation]
+        return create(taker_id, serializer.validated_data['offer_id'], serializer.validated_data['fiat_amount'])
+
+    """*************************************************************************************************************
+    /*	function name:		    create_locked_order
+    * 	function inputs:	    taker id, offer id, fiat amount
+    * 	function outputs:	    the created order instance with its funds locked
+    * 	function description:	one transaction with a fixed lock order, the offer row then the seller wallet row,
+                                every check runs on the locked rows before the first write so a rejected order
+                                is never written:
+                                    SELECT offer FOR UPDATE -> checks -> SELECT wallet FOR UPDATE -> balance check
+                                    -> INSERT order, UPDATE offer, LOCK_ESCROW journal entry, INSERT event
+    *   call back:              lock_public_offer(), validate_intake(), lock_seller_wallet(), create_order(),
+                                lock_funds_for_order(), record_event()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def create_locked_order(taker_id, offer_id, fiat_amount):
+        with transaction.atomic():
+            # get the instance of offer, locked until the commit
+            offer = REPO['offer'].lock_public_offer(offer_id)
+            price, crypto_amount = P2POrderService.validate_intake(offer, taker_id, fiat_amount)
+
+            # the second lock, the wallet of the seller must cover the escrow
+            try:
+                wallet = WalletService.lock_seller_wallet(
+                    GET_OFFER_SELLER(offer, taker_id), offer.crypto_currency, crypto_amount
+                )
+            except ValueError as e:
+                raise ValidationError(f"Failed to lock funds: {str(e)}")
+
+            order_data = ORDER_DATA(offer, price, crypto_amount, fiat_amount)
+            order = REPO['order'].create_order(offer, taker_id, order_data)
+            # lock the crypto-escrow concept began
+            WalletService.lock_funds_for_order(order, wallet)
+            P2POrderService.record_event(order, 'order.created')
+
+        return order
 
-        fiat_amount = serializer.validated_data['fiat_amount']
-        crypto_amount = fiat_amount / offer.price
+    """*************************************************************************************************************
+    /*	function name:		    create_reserved_order
+    * 	function inputs:	    taker id, offer id, fiat amount
+    * 	function outputs:	    the created order instance with its funds locked
+    * 	function description:	lock-free intake for the hot offers, the checks run on a plain read of the offer and
+                                the amounts are taken by conditional updates that re-check them in the database,
+                                in the same order as the lock path (offer then wallet):
+                                    UPDATE offer ... WHERE available_amount >= x AND price = p RETURNING
+                                    -> INSERT order
+                                    -> LOCK_ESCROW journal entry, the wallet update checks the balance covers x
+                                    -> INSERT event
+                                a refused update raises and the rollback gives back what was already taken
+    *   call back:              get_public_offer_by_id(), validate_intake(), reserve_available_amount(),
+                                insert_order(), lock_funds_for_order(), record_event()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def create_reserved_order(taker_id, offer_id, fiat_amount):
+        with transaction.atomic():
+            offer = REPO['offer'].get_public_offer_by_id(offer_id)
+            price, crypto_amount = P2POrderService.validate_intake(offer, taker_id, fiat_amount)
+            validate_and_raise(
+                REPO['offer'].reserve_available_amount(offer, crypto_amount) is None,
+                "Insufficient available amount or the offer price changed, please try again"
+            )
+            order = REPO['order'].insert_order(offer, taker_id, ORDER_DATA(offer, price, crypto_amount, fiat_amount))
+            try:
+                WalletService.lock_funds_for_order(order)
+            except ValueError as e:
+                raise ValidationError(f"Failed to lock funds: {str(e)}")
+            P2POrderService.record_event(order, 'order.created')
+
+        return order
+
+    @staticmethod
+    def validate_intake(offer, taker_id, fiat_amount):
+        """
+        the checks of the order intake on one offer
+        args:
+            offer: P2POffer instance, taker_id (int), fiat_amount (Decimal)
+        returns:
+            tuple: price of the order and its crypto amount
+        """
+        # the stored price, the one the order book and the offer feed sort on and show (the repricing pass keeps
+        # the effective price of the floating offers in it)
+        price = offer.price
+        crypto_amount = fiat_amount / price
+
+        # the offer may ask a minimum account age or holdings from the taker
+        P2POfferService.validate_counterparty(offer, taker_id)
 
         # validate the data before creation by adding all the validations in list
         validations = [
@@ -63,27 +178,7 @@ class P2POrderService:
         #loop over the validations list
         for condition, error in validations:
             validate_and_raise(condition, error)
-
-        # passed the validation success
-        order_data = {
-            'trade_type': GET_TAKER_TYPE(offer.trade_type),
-            'crypto_currency': offer.crypto_currency,
-            'fiat_currency': offer.fiat_currency,
-            'price': offer.price,
-            'crypto_amount': crypto_amount,
-            'fiat_amount': fiat_amount,
-            'payment_time_limit': PAYMENT_DEADLINE(offer.payment_time_limit_minutes),
-            'status': OrderStatus.UNPAID
-        }
-        order = REPO['order'].create_order(offer, taker_id, order_data)
-        # lock the crypto-escrow concept began
-        try:
-            WalletService.lock_funds_for_order(order)
-        except ValueError as e:
-            order.delete()
-            raise ValidationError(f"Failed to lock funds: {str(e)}")
-
-        return order
+        return price, crypto_amount
 
     @staticmethod
     def get_processing_orders(user_id, filters):
@@ -97,6 +192,45 @@ class P2POrderService:
         """
         return REPO['order'].get_orders_for_user(user_id, filters, PROCESSING_STATUSES)
 
+    """*************************************************************************************************************
+    /*	function name:		    get_order_history
+    * 	function inputs:	    user id, filters, cursor of the previous page, page size
+    * 	function outputs:	    dict of the page orders, the cursor of the next page and the total count
+    * 	function description:	processing and finished orders of the user newest first, keyset page on
+                                (created_at, id) read with one query ordered by the database, the count comes
+                                from the cached order counters unless the history is filtered
+    *   call back:              get_order_history_page(), ORDER_COUNTERS.summary(), count_order_history()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def get_order_history(user_id, filters, cursor=None, page_size=None):
+        after = decode_cursor(cursor, datetime.fromisoformat, int)
+        orders, last_key = REPO['order'].get_order_history_page(user_id, filters, after, page_size)
+        # the cached counters cover the whole history, a filtered history is counted in the database
+        filtered = any(filters.get(key) for key in ORDER_FILTER_MAP)
+        return {
+            'orders': orders,
+            'next_cursor': ENCODE_CURSOR(last_key[0].isoformat(), last_key[1]) if last_key else None,
+            'count': REPO['order'].count_order_history(user_id, filters) if filtered
+            else ORDER_COUNTERS.summary(user_id)['total'],
+        }
+
+    @staticmethod
+    def get_order_counters(user_id):
+        """
+        number of orders of the user in each status, with the processing/completed totals
+        args:
+            user_id (int): ID of the user
+        returns:
+            dict: statuses {status: count}, processing, completed, total
+        """
+        return ORDER_COUNTERS.summary(user_id)
+
+    @staticmethod
+    def get_counterparty_names(orders, user_id):
+        """nicknames of all the counterparties of a page of orders, one query at most"""
+        return REPO['profile'].get_nicknames({get_counterparty_id(order, user_id) for order in orders})
+
     @staticmethod
     def get_historical_orders(user_id, filters):
         """
@@ -111,119 +245,120 @@ class P2POrderService:
         return REPO['order'].get_orders_for_user(user_id, filters, COMPLETED_STATUSES)
 
     @staticmethod
-    def mark_order_as_paid(user_id, order_id):
+    def mark_order_as_paid(user_id, order_id, version=None):
         """mark-as-paid , it should be done by the buyer
         args:
             user_id (int): ID of the user
             order_id (int): ID of the order
+            version (int): version of the order seen by the user, optional
         returns:
-            bool: True if marked as paid
+            P2POrder: the order marked as paid
 
         """
-        print(f"Service - mark_as_paid: user_id={user_id}, order_id={order_id}")  # debugging
-
-        order = REPO['order'].get_by_id(order_id)
-        print(f"Found order: {order.id}, taker_id: {order.taker_id}, status: {order.status}")  # debugging
-
-        seller_id, buyer_id = GET_SELLER_BUYER(order)
-
-        # validate that the user is seller
-        validate_and_raise(
-            user_id != buyer_id,
-            "Only buyer can mark order as paid"
-        )
-
-        #validate that the order status is paid
-        validate_and_raise(
-            order.status != OrderStatus.UNPAID,
-            "Order is not in unpaid status",
-            field='status'
-        )
-
-        #validate the time
-        validate_and_raise(
-            timezone.now() > order.payment_time_limit,
-            "Payment time has expired",
-            field='payment_time'
-        )
-
-        print(f"About to update order status to PAID")  # just for debugging
-        #update the status of the  order
-        updated_order = REPO['order'].update_order_status(order, OrderStatus.PAID)
-        print(f"Order updated successfully: {updated_order.status}")  # just for debugging
-        return updated_order
-
-
+        return P2POrderService.transition(user_id, order_id, OrderStatus.PAID, version)
 
     @staticmethod
-    def confirm_payment_received(user_id, order_id):
+    def confirm_payment_received(user_id, order_id, version=None):
         """
         confirm receive money, it should be done by the seller
         args:
             user_id (int): ID of the user
             order_id (int): ID of the order
+            version (int): version of the order seen by the user, optional
         returns:
-            bool: True if confirmed, else False
+            P2POrder: the completed order, its crypto released to the buyer
 
         """
-        order = REPO['order'].get_by_id(order_id)
-        seller_id, buyer_id = GET_SELLER_BUYER(order)
-        # validate if user is the buyer
-        validate_and_raise(
-            user_id != seller_id,
-            "Only seller can confirm payment"
-        )
-        #validate that the order status is unpaid
-        validate_and_raise(
-            order.status != OrderStatus.PAID,
-            "Order is not marked as paid",
-            field='status'
-        )
-
-        # update the status and release the crypto
-        order = REPO['order'].update_order_status(order, OrderStatus.COMPLETED)
-        WalletService.release_funds_to_buyer(order)
+        with transaction.atomic():
+            # update the status and release the crypto
+            order = P2POrderService.transition(user_id, order_id, OrderStatus.COMPLETED, version)
+            WalletService.release_funds_to_buyer(order)
         return order
 
     @staticmethod
-    def cancel_order(user_id, order_id):
+    def cancel_order(user_id, order_id, version=None):
         """this function handle the logic to cancel the order
         args:
             user_id (int): ID of the user
             order_id (int): ID of the order
+            version (int): version of the order seen by the user, optional
         returns:
-            bool: True if canceled, else False
+            P2POrder: the cancelled order, its amount back in the offer and in the seller wallet
         """
-        order = REPO['order'].get_by_id(order_id)
-
-        # validation
-        validate_and_raise(
-            order.maker_id != user_id,
-            "You are not part of this order"
-        )
-
-        validate_and_raise(
-            order.status in COMPLETED_STATUSES,
-            "Cannot cancel this order"
-        )
-
         #use it to make sure that below logic dealed as one block
         with transaction.atomic():
             # update status to CANCEL
-            order = REPO['order'].update_order_status(order, OrderStatus.CANCELLED)
-
-            # edit the avail. amount of the offer back to the offer again
-            offer = order.offer
-            offer.available_amount += order.crypto_amount
-            #if the status of the offer was completed, return it back to active
-            if offer.status == 'COMPLETED':
-                offer.status = 'ACTIVE'
-            offer.save()
-
-        # release back the crypto to the seller
-        WalletService.cancel_order_and_unlock_funds(order)
+            order = P2POrderService.transition(user_id, order_id, OrderStatus.CANCELLED, version)
+
+            # edit the avail. amount of the offer back to the offer again, a sold out offer becomes active again
+            REPO['offer'].restore_available_amounts({order.offer_id: order.crypto_amount})
+
+            # release back the crypto to the seller
+            seller_id, _ = GET_ORDER_SELLER_BUYER(order)
+            WalletService.unlock_funds_for_orders([{
+                'id': order.id, 'seller_id': seller_id,
+                'crypto_currency': order.crypto_currency, 'crypto_amount': order.crypto_amount,
+            }])
+        return order
+
+    """*************************************************************************************************************
+    /*	function name:		    transition
+    * 	function inputs:	    user id, order id, new status, version seen by the user (optional)
+    * 	function outputs:	    the order after the transition
+    * 	function description:	one conditional update moves the order (ORDER_TRANSITIONS) and its outbox event
+                                is written in the same transaction, the order is read only when the update was
+                                refused, to tell the user why
+    *   call back:              transition_order(), record_event(), explain_refused_transition()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def transition(user_id, order_id, new_status, version=None):
+        if version is not None:
+            validate_and_raise(not str(version).isdigit(), "Version must be a number", field='version')
+            version = int(version)
+        with transaction.atomic(savepoint=False):
+            order = REPO['order'].transition_order(order_id, new_status, user_id, version)
+            if order is None:
+                P2POrderService.explain_refused_transition(user_id, order_id, new_status, version)
+            P2POrderService.record_event(order, f"order.{new_status.lower()}", order.previous_status)
         return order
 
+    @staticmethod
+    def record_event(order, event_type, previous_status=None):
+        """write the outbox event of an order change, then once the change commits move the order counters
+        of both sides and push them the new status, the caller holds the transaction of the change"""
+        sides = (order.maker_id, order.taker_id)
+        ORDER_COUNTERS.move_on_commit([(sides, previous_status, order.status)])
+        ORDER_STREAM.publish_on_commit([(sides, STATUS_MESSAGE(order))])
+        return REPO['outbox'].add_event('order', order.id, event_type, ORDER_EVENT(order))
+
+    @staticmethod
+    def explain_refused_transition(user_id, order_id, new_status, version):
+        """raise the error of a refused transition from the current order, in the order of the old checks"""
+        order = REPO['order'].get_by_id(order_id)
+        seller_id, buyer_id = GET_ORDER_SELLER_BUYER(order)
+        refusals = {
+            OrderStatus.PAID: [
+                (user_id != buyer_id, "Only buyer can mark order as paid", None),
+                (order.status != OrderStatus.UNPAID, "Order is not in unpaid status", 'status'),
+                (timezone.now() > order.payment_time_limit, "Payment time has expired", 'payment_time'),
+            ],
+            OrderStatus.COMPLETED: [
+                (user_id != seller_id, "Only seller can confirm payment", None),
+                (order.status != OrderStatus.PAID, "Order is not marked as paid", 'status'),
+            ],
+            OrderStatus.CANCELLED: [
+                (order.maker_id != user_id, "You are not part of this order", None),
+                (order.status in COMPLETED_STATUSES, "Cannot cancel this order", None),
+            ],
+        }[new_status]
+        for condition, error, field in refusals:
+            validate_and_raise(condition, error, field=field)
+        validate_and_raise(
+            version is not None and order.version != version, "The order was changed, reload it", field='version'
+        )
+        # the order changed between the update and this read
+        validate_and_raise(True, "The order was changed by another request, try again", field='status')
 
     @staticmethod
     def get_order_detail(user_id, order_id):
@@ -259,4 +394,11 @@ class P2POrderService:
         # Cache for 5 minutes
         cache.set(cache_key, data, 300)
 
-        return data
\ No newline at end of file
+        return data
+
+
+# order intake paths selected by P2P_ORDER_RESERVATION
+RESERVATIONS = {
+    'lock': P2POrderService.create_locked_order,
+    'conditional': P2POrderService.create_reserved_order,
+}
@@ -0,0 +1,99 @@
+# p2p_trading/services/p2p_provisioning_service.py
+
+from itertools import islice
+
+from django.db import transaction as db_transaction
+
+from ..constants.constant import BASIC_WALLET_CURRENCIES, TransactionType
+from ..repositories.p2p_profile_repository import P2PProfileRepository
+from ..repositories.p2p_wallet_repository import P2PWalletRepository
+from .p2p_wallet_service import WalletService
+
+# ================ HELPER MACROS ================
+
+from ..helpers import WALLET_MUTATION_ENTRY
+
+DEFAULT_CHUNK_SIZE = 1000
+# nickname of a profile provisioned for a main user
+PROVISIONED_NICKNAME = lambda username: f"{username}_p2p"
+# the items of an iterable in lists of size items
+CHUNKS = lambda items, size: iter(lambda iterator=iter(items): list(islice(iterator, size)), [])
+
+
+# ================P2P PROVISIONING SERVICE CLASS ================
+class ProvisioningService:
+    """profiles and wallets of many users at once, a chunk of users is one read of what exists and one insert"""
+    wallets = P2PWalletRepository()
+    profiles = P2PProfileRepository()
+
+    """*************************************************************************************************************
+    /*	function name:		    provision_wallets
+    * 	function inputs:	    user ids (any iterable), currencies, opening balance of the new wallets, users per chunk
+    * 	function outputs:	    number of wallets created
+    * 	function description:	per chunk of users: the missing (user, currency) pairs with one query, inserted with
+                                one bulk insert (a wallet created meanwhile by another writer is skipped by the unique
+                                key). only the wallets the insert returned are counted and get the opening balance,
+                                one DEPOSIT journal entry per new wallet, all of the chunk in one statement, so the
+                                wallets keep their history
+    *   call back:              get_missing_wallets(), bulk_create_wallets(), WalletService.post_entries()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def provision_wallets(user_ids, currencies=BASIC_WALLET_CURRENCIES, opening_balance=0,
+                          chunk_size=DEFAULT_CHUNK_SIZE):
+        created = 0
+        for chunk in CHUNKS(user_ids, chunk_size):
+            with db_transaction.atomic():
+                missing = ProvisioningService.wallets.get_missing_wallets(chunk, currencies)
+                if not missing:
+                    continue
+                inserted = ProvisioningService.wallets.bulk_create_wallets(missing)
+                if opening_balance and inserted:
+                    WalletService.post_entries([
+                        WALLET_MUTATION_ENTRY(user_id, currency, opening_balance, 0, TransactionType.DEPOSIT)
+                        for user_id, currency in inserted
+                    ], "The opening balance of a new wallet was refused")
+                created += len(inserted)
+        return created
+
+    @staticmethod
+    def provision_profiles(users, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+            profiles of the users without one, per chunk one query for the missing ones and one bulk insert
+            arg:
+                iterable of (user id, username), the nickname is PROVISIONED_NICKNAME(username)
+            return:
+                (profiles created, user ids skipped because their nickname is taken)
+        """
+        created, skipped = 0, []
+        for chunk in CHUNKS(users, chunk_size):
+            usernames = dict(chunk)
+            missing = ProvisioningService.profiles.get_missing_profiles(list(usernames))
+            if not missing:
+                continue
+            taken = ProvisioningService.profiles.bulk_create_profiles(
+                {user_id: PROVISIONED_NICKNAME(usernames[user_id]) for user_id in missing}
+            )
+            created += len(missing) - len(taken)
+            skipped.extend(taken)
+        return created, skipped
+
+    @staticmethod
+    def provision_users(users, currencies=BASIC_WALLET_CURRENCIES, opening_balance=0, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+            the complete p2p setup (profile + wallets) of many users
+            arg:
+                iterable of (user id, username), currencies, opening balance of the new wallets, users per chunk
+            return:
+                dict of the profiles and wallets created and the user ids whose profile was skipped
+        """
+        profiles = wallets = 0
+        skipped = []
+        for chunk in CHUNKS(users, chunk_size):
+            created, taken = ProvisioningService.provision_profiles(chunk, chunk_size)
+            profiles += created
+            skipped.extend(taken)
+            wallets += ProvisioningService.provision_wallets(
+                [user_id for user_id, _ in chunk], currencies, opening_balance, chunk_size
+            )
+        return {'profiles': profiles, 'wallets': wallets, 'skipped': skipped}
@@ -1,15 +1,20 @@
 # p2p_trading/services/p2p_wallet_service.py
 
 from django.db import transaction as db_transaction
-from ..constants.constant import TransactionType
+from ..repositories.p2p_journal_repository import P2PJournalRepository
 from ..repositories.p2p_wallet_repository import P2PWalletRepository
 
 
 # ================ HELPER MACROS ================
 
 from ..helpers import (
-    GET_SELLER_BUYER,
-    VALIDATE_BALANCE
+    GET_ORDER_SELLER_BUYER,
+    VALIDATE_BALANCE,
+    ESCROW_LOCK_ENTRY,
+    ESCROW_RELEASE_ENTRY,
+    ESCROW_CANCEL_ENTRY,
+    ESCROW_REPAIR_ENTRY,
+    WALLET_MUTATION_ENTRY,
 
 )
 
@@ -17,94 +22,149 @@ from ..helpers import (
 class WalletService:
     #common object of P2PWalletRepository
     repo = P2PWalletRepository()
+    #common object of P2PJournalRepository, every balance change is a journal entry
+    journal = P2PJournalRepository()
 
     @staticmethod
     def get_or_create_wallet(user_id, currency):
         """create wallet"""
         return WalletService.repo.get_or_create_wallet(user_id, currency)
 
+    """*************************************************************************************************************
+    /*	function name:		    post_entries
+    * 	function inputs:	    list of journal entries (ESCROW_*_ENTRY, WALLET_MUTATION_ENTRY), error message
+    * 	function outputs:	    dict {(user_id, currency): wallet} with the new balances
+    * 	function description:	one round trip for the whole batch, the wallets, the balanced entries with their
+                                postings and the transactions with their running balances. ValueError(error) when
+                                a wallet is missing or would leave its constraints, the transaction rolls back what
+                                the other wallets of the batch took
+    *   call back:              post_entries()
+    */
+    *************************************************************************************************************"""
     @staticmethod
-    @db_transaction.atomic
-    def lock_funds_for_order(order):
+    @db_transaction.atomic(savepoint=False)
+    def post_entries(entries, error):
+        wallets = WalletService.journal.post_entries(entries)
+        if wallets is None:
+            raise ValueError(error)
+        return wallets
+
+    @staticmethod
+    def mutate_wallet(user_id, currency, balance_delta, locked_delta, tx_type, order=None):
         """
-            lock the crypto amount of funds
+            any change of one wallet, the deltas are applied by the database and the part that does not move
+            between balance and locked_balance is posted against the external account
             arg:
-                instance of the order
+                user id, currency, balance delta, locked_balance delta, transaction type, order (optional)
             return:
-            locking the amount of funds in the wallet
+                the wallet with its new balances, ValueError when it would leave its constraints
+                (balance >= 0, locked_balance <= balance)
 
         """
-        seller_id, _ = GET_SELLER_BUYER(order)
-        wallet = WalletService.repo.get_or_create_wallet(seller_id, order.crypto_currency)
-        amount = order.crypto_amount
+        entry = WALLET_MUTATION_ENTRY(user_id, currency, balance_delta, locked_delta, tx_type, order and order.id)
+        wallets = WalletService.post_entries(
+            [entry], f"Insufficient balance. Required: {max(-balance_delta, locked_delta)}"
+        )
+        return wallets[(user_id, currency)]
+
+    @staticmethod
+    def lock_seller_wallet(seller_id, currency, amount):
+        """
+            lock the wallet that pays the escrow and check it covers the amount, before anything is written
+            arg:
+                seller id, crypto currency, crypto amount of the order
+            return:
+                the locked wallet, ValueError when the balance is too low
+
+        """
+        wallet = WalletService.repo.lock_wallet(seller_id, currency)
 
         # validata the suffeient amount
         error = VALIDATE_BALANCE(wallet, amount)
         if error: raise error
+        return wallet
 
-        # update the balance of the wallet
-        WalletService.repo.update_wallet_balance(wallet, -amount, amount)
+    """*************************************************************************************************************
+    /*	function name:		    lock_funds_for_order
+    * 	function inputs:	    instance of the order, seller wallet already locked by lock_seller_wallet (optional)
+    * 	function outputs:	    the seller wallet with its new balances
+    * 	function description:	LOCK_ESCROW entry of the order, balance -> locked_balance of the seller wallet.
+                                without a locked wallet the entry itself checks the balance in the database (the
+                                lock-free intake), ValueError when it does not cover the amount
+    *   call back:              post_entries()
+    */
+    *************************************************************************************************************"""
+    @staticmethod
+    def lock_funds_for_order(order, wallet=None):
+        amount = order.crypto_amount
+        seller_id, _ = GET_ORDER_SELLER_BUYER(order)
 
-        # create a transaction
-        WalletService.repo.create_transaction(
-            wallet, order, TransactionType.LOCK_ESCROW, -amount
+        wallets = WalletService.post_entries(
+            [ESCROW_LOCK_ENTRY(order.id, seller_id, order.crypto_currency, amount)],
+            f"Insufficient balance. Required: {amount}"
+        )
+        locked = wallets[(seller_id, order.crypto_currency)]
+        if wallet is None:
+            return locked
+        wallet.balance, wallet.locked_balance, wallet.updated_at = (
+            locked.balance, locked.locked_balance, locked.updated_at
         )
         return wallet
 
+    """*************************************************************************************************************
+    /*	function name:		    release_funds_to_buyer
+    * 	function inputs:	    order completed in the current transaction
+    * 	function outputs:	    True
+    * 	function description:	release the crypto to the buyer once the order completed, one RELEASE_ESCROW entry:
+                                the seller locked_balance -> the buyer balance, with the seller RELEASE_ESCROW and
+                                the buyer DEPOSIT transactions, in the statement that updates both wallets
+    *   call back:              get_or_create_wallet(), post_entries()
+    */
+    *************************************************************************************************************"""
     @staticmethod
-    @db_transaction.atomic
     def release_funds_to_buyer(order):
-        """release the crypto to the seller once the order completed"""
-        seller_id, buyer_id = GET_SELLER_BUYER(order)
-        seller_wallet = WalletService.repo.get_or_create_wallet(seller_id, order.crypto_currency)
-        buyer_wallet = WalletService.repo.get_or_create_wallet(buyer_id, order.crypto_currency)
-        amount = order.crypto_amount
-
-        # validate the amount in the user wallet
-        error = VALIDATE_BALANCE(seller_wallet, amount, 'locked_balance')
-        if error: raise error
-
-        # update the wallet
-        WalletService.repo.update_wallet_balance(seller_wallet, 0, -amount)
-        WalletService.repo.update_wallet_balance(buyer_wallet, amount, 0)
+        seller_id, buyer_id = GET_ORDER_SELLER_BUYER(order)
 
-        # create transaction
-        WalletService.repo.create_transaction(
-            seller_wallet, order, TransactionType.RELEASE_ESCROW, 0
+        # the buyer may have no wallet of this coin yet, the seller one holds the escrow
+        WalletService.repo.get_or_create_wallet(buyer_id, order.crypto_currency)
+        WalletService.post_entries(
+            [ESCROW_RELEASE_ENTRY(order.id, seller_id, buyer_id, order.crypto_currency, order.crypto_amount)],
+            f"The escrow of the order {order.id} is not in the seller wallet"
         )
-        WalletService.repo.create_transaction(
-            buyer_wallet, order, TransactionType.DEPOSIT, amount
-        )
-
         return True
 
+    """*************************************************************************************************************
+    /*	function name:		    unlock_funds_for_orders
+    * 	function inputs:	    list of order rows (id, seller_id, crypto_currency, crypto_amount)
+    * 	function outputs:	    number of wallets updated
+    * 	function description:	give the escrow of a batch of cancelled orders back to their sellers, one
+                                CANCEL_ESCROW entry per order and all of them in one statement, the wallets are
+                                updated once with the sum of their orders
+    *   call back:              post_entries()
+    */
+    *************************************************************************************************************"""
     @staticmethod
-    @db_transaction.atomic
-    def cancel_order_and_unlock_funds(order):
+    def unlock_funds_for_orders(orders):
+        wallets = WalletService.post_entries(
+            [ESCROW_CANCEL_ENTRY(order['id'], order['seller_id'], order['crypto_currency'], order['crypto_amount'])
+             for order in orders],
+            "The escrow of a cancelled order is not in its seller wallet"
+        )
+        return len(wallets)
+
+    @staticmethod
+    def repair_escrow(seller_id, currency, drift):
         """
-        this handle the logic to cancel the order and unlock the wallet
-        args:
-            instance of the order
-        return:
-            instance of the wallet
+            bring the locked_balance of a wallet back to the crypto of its open orders, one journal entry
+            arg:
+                seller id, currency, drift (locked_balance - expected)
+            return:
+                the wallet with its new balances, ValueError when the balance cannot cover a short escrow
         """
-        #get seller id , seller who need to get the currencies back
-        seller_id, _ = GET_SELLER_BUYER(order)
-        #get the wallet of the seller
-        wallet = WalletService.repo.get_or_create_wallet(seller_id, order.crypto_currency)
-        #the locked amount
-        amount = order.crypto_amount
-
-        # release the fund back
-        WalletService.repo.update_wallet_balance(wallet, amount, -amount)
-
-        # create transaction
-        WalletService.repo.create_transaction(
-            wallet, order, TransactionType.CANCEL_ESCROW, amount
+        wallets = WalletService.post_entries(
+            [ESCROW_REPAIR_ENTRY(seller_id, currency, drift)], f"Insufficient balance. Required: {-drift}"
         )
-        return wallet
-
-
+        return wallets[(seller_id, currency)]
 
 
 '''
@@ -113,15 +173,9 @@ class WalletService:
     def transfer_from_main_wallet(user_id, currency, amount):
         """ transfer the crypto from the main-wallet to P2P-wallet"""
 
-        #  add to P2P-wallet
-        p2p_wallet = WalletService.repo.get_or_create_wallet(user_id, currency)
-        WalletService.repo.update_wallet_balance(p2p_wallet, amount, 0)
-
-        # create transaction for p2p-transaction
-        WalletService.repo.create_transaction(
-            p2p_wallet, None, TransactionType.DEPOSIT, amount
-        )
-        return p2p_wallet
+        #  add to P2P-wallet, with its DEPOSIT transaction
+        WalletService.repo.get_or_create_wallet(user_id, currency)
+        return WalletService.mutate_wallet(user_id, currency, amount, 0, TransactionType.DEPOSIT)
 
     @staticmethod
     @db_transaction.atomic
@@ -133,13 +187,8 @@ class WalletService:
         if p2p_wallet.available_balance < amount:
             raise ValueError("Insufficient available balance")
 
-        # update the p2p-wallet
-        WalletService.repo.update_wallet_balance(p2p_wallet, -amount, 0)
-
-        #create transaction
-        WalletService.repo.create_transaction(
-            p2p_wallet, None, TransactionType.WITHDRAWAL, -amount
-        )
+        # update the p2p-wallet, with its WITHDRAWAL transaction
+        p2p_wallet = WalletService.mutate_wallet(user_id, currency, -amount, 0, TransactionType.WITHDRAWAL)
 
         # update the main-wallet through the service at the main
         MainWalletService.deposit(user_id, currency, amount)
@@ -0,0 +1,114 @@
+# tests/integration_test_p2p_offer_serializers.py
+
+import pytest
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework import status
+from p2p_trading.models import Wallet, P2POffer, P2POrder, P2PProfile
+from p2p_trading.engines.p2p_order_book_engine import ORDER_BOOK
+from p2p_trading.repositories.p2p_offer_repository import P2POfferRepository
+from p2p_trading.serializers.p2p_offer_serilaizer import (
+    P2POfferPublicSerializer, P2POfferListSerializer, P2POfferDetailSerializer
+)
+from p2p_trading.serializers.p2p_offer_fast_serializer import (
+    FAST_PUBLIC_SERIALIZER, FAST_LIST_SERIALIZER, FAST_DETAIL_SERIALIZER, CompiledOfferSerializer
+)
+from MainDashboard.models import PaymentMethods
+
+User = get_user_model()
+
+RENDER = JSONRenderer().render
+
+
+@pytest.mark.django_db(databases=['default', 'main_db'], transaction=True)
+class TestP2POfferSerializersIntegration:
+    """the compiled serializers render the same json as the DRF serializers"""
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, db):
+        P2POrder.objects.all().delete()
+        P2POffer.objects.all().delete()
+        Wallet.objects.all().delete()
+        PaymentMethods.objects.all().delete()
+        User.objects.all().delete()
+        ORDER_BOOK.warm(force=True)
+
+    @pytest.fixture
+    def offers(self):
+        """fixed, floating and restricted offers of a maker with a profile and one without"""
+        maker = User.objects.create_user(username='render_maker', password='pass123')
+        other = User.objects.create_user(username='render_other', password='pass123')
+        P2PProfile.objects.create(user_id=maker.id, nickname='render_maker')
+        payment_method = PaymentMethods.objects.create(
+            user=maker, payment_method_id='BANK_RENDER', type='BANK_TRANSFER',
+            number='1234567890', holder_name='Render Maker', primary=True
+        )
+        common = dict(crypto_currency='USDT', fiat_currency='EGP', min_order_limit=Decimal('100'),
+                      max_order_limit=Decimal('1000'), payment_method_ids=[payment_method.id])
+        created = [
+            P2POffer.objects.create(user_id=maker.id, trade_type='SELL', price_type='FIXED', price=Decimal('50.5'),
+                                    total_amount=Decimal('100'), available_amount=Decimal('33.33333333'),
+                                    **common),
+            P2POffer.objects.create(user_id=maker.id, trade_type='BUY', price_type='FLOATING',
+                                    price=Decimal('49.34'), price_margin=Decimal('-1.33'),
+                                    total_amount=Decimal('0.00001'), available_amount=Decimal('0'), **common),
+            P2POffer.objects.create(user_id=other.id, trade_type='SELL', price_type='FLOATING',
+                                    price=Decimal('51.25'), price_margin=Decimal('2.50'),
+                                    total_amount=Decimal('250.12345678'), available_amount=Decimal('250.12345678'),
+                                    counterparty_min_holding_amount=Decimal('10'),
+                                    **{**common, 'payment_method_ids': []}),
+        ]
+        for offer in created:
+            P2POfferRepository.set_payment_methods(offer, offer.payment_method_ids)
+        return P2POffer.objects.filter(id__in=[offer.id for offer in created]).order_by('id'), maker, payment_method
+
+    def test_compiled_output_is_identical(self, offers):
+        """🧾 Test 1: public, list and detail json is byte-identical for instances and .values() rows"""
+        queryset, _, payment_method = offers
+        instances = list(queryset.prefetch_related('payment_methods'))
+        profiles = {p.user_id: p for p in P2PProfile.objects.all()}
+        for offer in instances:
+            offer.user_profile = profiles.get(offer.user_id)
+
+        for context in ({}, {'payment_details_map': {}},
+                        {'payment_details_map': {payment_method.id: {'type': 'BANK_TRANSFER',
+                                                                     'display_name': 'BANK - Render'}}}):
+            for reference, compiled in ((P2POfferPublicSerializer, FAST_PUBLIC_SERIALIZER),
+                                        (P2POfferListSerializer, FAST_LIST_SERIALIZER),
+                                        (P2POfferDetailSerializer, FAST_DETAIL_SERIALIZER)):
+                expected = RENDER(reference(instances, many=True, context=context).data)
+                assert RENDER(compiled.render_many(instances, context)) == expected
+                assert RENDER(compiled.render(instances[0], context)) == RENDER(
+                    reference(instances[0], context=context).data
+                )
+
+            rows = list(queryset.values(*FAST_LIST_SERIALIZER.sources))
+            assert RENDER(FAST_LIST_SERIALIZER.render_many(rows, context)) == RENDER(
+                P2POfferListSerializer(instances, many=True, context=context).data
+            )
+
+        # a compiled serializer without extend() fails when it is built, not on its first offer
+        with pytest.raises(TypeError):
+            type('IncompleteSerializer', (CompiledOfferSerializer,), {'serializer_class': P2POfferListSerializer})()
+
+    def test_endpoints_render_compiled_output(self, offers):
+        """🌐 Test 2: my offers and offer detail answer with the DRF serializer output"""
+        queryset, maker, payment_method = offers
+        client = APIClient()
+        client.force_authenticate(user=maker)
+        context = {'payment_details_map': P2POfferRepository.get_payment_methods_details([payment_method.id])}
+
+        response = client.get('/api/p2p/offers/')
+        assert response.status_code == status.HTTP_200_OK
+        mine = queryset.filter(user_id=maker.id).order_by('-created_at')
+        assert RENDER(response.data['data']) == RENDER(
+            P2POfferListSerializer(mine, many=True, context=context).data
+        )
+        assert response.data['count'] == 2
+
+        offer = P2POfferRepository.get_offer_with_profile(maker.id, mine[0].id)
+        response = client.get(f'/api/p2p/offers/{offer.id}/')
+        assert response.status_code == status.HTTP_200_OK
+        assert RENDER(response.data['data']) == RENDER(P2POfferDetailSerializer(offer).data)
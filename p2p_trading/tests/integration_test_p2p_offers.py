@@ -3,9 +3,13 @@
 import pytest
 from decimal import Decimal
 from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from rest_framework import status
 from p2p_trading.models import Wallet, P2POffer
+from p2p_trading.engines.p2p_payment_method_cache import PAYMENT_METHOD_CACHE
+from p2p_trading.repositories.p2p_offer_repository import P2POfferRepository
 from MainDashboard.models import PaymentMethods
 
 User = get_user_model()
@@ -376,4 +380,35 @@ class TestP2POffersIntegration:
             offers = response.data['data']
             if offers:  # إذا كان فيه عروض
                 for offer in offers:
-                    assert offer.get('trade_type') == 'SELL'
\ No newline at end of file
+                    assert offer.get('trade_type') == 'SELL'
+
+    def test_payment_details_cached(self, auth_client):
+        """🗄️ payment method details are read from the main db once and refreshed after an update"""
+        client, payment_method = auth_client
+        response = client.post('/api/p2p/offers/', self.create_valid_offer_data(payment_method.id), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        client.get('/api/p2p/offers/')
+
+        with CaptureQueriesContext(connections['main_db']) as ctx:
+            response = client.get('/api/p2p/offers/')
+        assert response.data['data'][0]['payment_methods_details'] == ['BANK_TRANSFER (Test User)']
+        assert not [q for q in ctx.captured_queries if 'payment_methods' in q['sql']]
+
+        response = client.patch(f'/api/p2p/profiles/payment-methods/{payment_method.id}/update/',
+                                {'holder_name': 'New Holder'}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        response = client.get('/api/p2p/offers/')
+        assert response.data['data'][0]['payment_methods_details'] == ['BANK_TRANSFER (New Holder)']
+
+        # a load that read the row before a write committed is served once and not cached over the write
+        def racing_loader(payment_ids):
+            details = P2POfferRepository.load_payment_methods_details(payment_ids)
+            PaymentMethods.objects.filter(id=payment_method.id).update(holder_name='Racing Holder')
+            PAYMENT_METHOD_CACHE.invalidate([payment_method.id])
+            return details
+
+        PAYMENT_METHOD_CACHE.invalidate([payment_method.id])
+        details = PAYMENT_METHOD_CACHE.get_many([payment_method.id], racing_loader)
+        assert details[payment_method.id]['display_name'] == 'BANK_TRANSFER (New Holder)'
+        response = client.get('/api/p2p/offers/')
+        assert response.data['data'][0]['payment_methods_details'] == ['BANK_TRANSFER (Racing Holder)']
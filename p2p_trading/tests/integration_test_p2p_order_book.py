@@ -0,0 +1,268 @@
+# tests/integration_test_p2p_order_book.py
+
+import pytest
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework import status
+from p2p_trading.models import Wallet, P2POffer, P2POrder, OfferPaymentMethod
+from p2p_trading.engines.p2p_block_cache import BLOCK_CACHE, BLOCK_SET_KEY
+from p2p_trading.engines.p2p_order_book_engine import ORDER_BOOK
+from MainDashboard.models import PaymentMethods
+
+User = get_user_model()
+
+PUBLIC_URL = '/api/p2p/offers/public_offers/'
+
+
+@pytest.mark.django_db(databases=['default', 'main_db'], transaction=True)
+class TestP2POrderBookIntegration:
+    """Integration tests for the public feed served from the order book"""
+
+    DEFAULT_CRYPTO = 'USDT'
+    DEFAULT_FIAT = 'EGP'
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, db):
+        """clean the database and rebuild the book before each test"""
+        P2POrder.objects.all().delete()
+        P2POffer.objects.all().delete()
+        Wallet.objects.all().delete()
+        PaymentMethods.objects.all().delete()
+        User.objects.all().delete()
+        ORDER_BOOK.warm(force=True)
+
+    @pytest.fixture
+    def seller_client(self):
+        seller = User.objects.create_user(username='book_seller', password='pass123')
+        Wallet.objects.create(user_id=seller.id, currency=self.DEFAULT_CRYPTO, balance=Decimal('5000'))
+        payment_method = PaymentMethods.objects.create(
+            user=seller, payment_method_id='BANK_BOOK', type='BANK_TRANSFER',
+            number='1234567890', holder_name='Book Seller', primary=True
+        )
+        client = APIClient()
+        client.force_authenticate(user=seller)
+        return client, seller, payment_method
+
+    @pytest.fixture
+    def buyer_client(self):
+        buyer = User.objects.create_user(username='book_buyer', password='pass123')
+        client = APIClient()
+        client.force_authenticate(user=buyer)
+        return client, buyer
+
+    def create_offer(self, client, payment_method_id, price, trade_type='SELL'):
+        data = {
+            "trade_type": trade_type,
+            "crypto_currency": self.DEFAULT_CRYPTO,
+            "fiat_currency": self.DEFAULT_FIAT,
+            "price_type": "FIXED",
+            "price": price,
+            "total_amount": "100",
+            "min_order_limit": "100",
+            "max_order_limit": "1000",
+            "payment_method_ids": [payment_method_id],
+            "payment_time_limit_minutes": 30
+        }
+        response = client.post('/api/p2p/offers/', data, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        return P2POffer.objects.filter(price=Decimal(price)).latest('id')
+
+    def get_feed(self, trade_type='SELL', **params):
+        params.update({'trade_type': trade_type,
+                       'crypto_currency': self.DEFAULT_CRYPTO,
+                       'fiat_currency': self.DEFAULT_FIAT})
+        response = APIClient().get(PUBLIC_URL, params)
+        assert response.status_code == status.HTTP_200_OK
+        return response.data['data']
+
+    def test_feed_sorted_by_price(self, seller_client):
+        """✅ Test 1: SELL feed ascending, BUY feed descending"""
+        client, _, payment_method = seller_client
+        for price in ['61.00', '59.50', '60.25']:
+            self.create_offer(client, payment_method.id, price)
+        for price in ['58.00', '58.90']:
+            self.create_offer(client, payment_method.id, price, trade_type='BUY')
+
+        assert [o['price'] for o in self.get_feed('SELL')] == ['59.50', '60.25', '61.00']
+        assert [o['price'] for o in self.get_feed('BUY')] == ['58.90', '58.00']
+
+    def test_feed_does_not_query_offers_table(self, seller_client):
+        """⚡ Test 2: the feed is served from memory"""
+        client, _, payment_method = seller_client
+        self.create_offer(client, payment_method.id, '60.00')
+        # first read may load the pair once
+        self.get_feed('SELL')
+
+        with CaptureQueriesContext(connections['default']) as ctx:
+            offers = self.get_feed('SELL')
+
+        assert len(offers) == 1
+        assert not [q for q in ctx.captured_queries if 'p2p_offer' in q['sql']]
+
+    def test_payment_method_filter(self, seller_client):
+        """🔍 Test 3: payment method filter applied on the book"""
+        client, _, payment_method = seller_client
+        self.create_offer(client, payment_method.id, '60.00')
+
+        assert len(self.get_feed('SELL', payment_method=payment_method.id)) == 1
+        assert self.get_feed('SELL', payment_method=payment_method.id + 1000) == []
+
+    def test_book_follows_orders_and_deletes(self, seller_client, buyer_client):
+        """🔄 Test 4: order create/cancel and soft delete update the book"""
+        client, _, payment_method = seller_client
+        buyer, _ = buyer_client
+        offer = self.create_offer(client, payment_method.id, '50.00')
+
+        response = buyer.post('/api/p2p/orders/', {"offer_id": offer.id, "fiat_amount": "500"}, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        assert self.get_feed('SELL')[0]['available_amount'] == '90.00000000'
+
+        order = P2POrder.objects.get(offer=offer)
+        response = client.post(f'/api/p2p/orders/{order.id}/cancel/')
+        assert response.status_code == status.HTTP_200_OK
+        assert self.get_feed('SELL')[0]['available_amount'] == '100.00000000'
+
+        response = client.delete(f'/api/p2p/offers/{offer.id}/')
+        assert response.status_code in [status.HTTP_200_OK, status.HTTP_204_NO_CONTENT]
+        assert self.get_feed('SELL') == []
+
+    def test_cursor_pagination(self, seller_client):
+        """📄 Test 5: keyset pages walk the whole feed without gaps or duplicates"""
+        client, _, payment_method = seller_client
+        prices = ['60.00', '59.00', '61.00', '60.00', '58.50']
+        for price in prices:
+            self.create_offer(client, payment_method.id, price)
+
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': 2, 'trade_type': 'SELL',
+                      'crypto_currency': self.DEFAULT_CRYPTO, 'fiat_currency': self.DEFAULT_FIAT}
+            if cursor:
+                params['cursor'] = cursor
+            response = APIClient().get(PUBLIC_URL, params)
+            assert response.status_code == status.HTTP_200_OK
+            assert response.data['count'] == len(prices)
+            assert len(response.data['data']) <= 2
+            seen += response.data['data']
+            cursor = response.data.get('next_cursor')
+            if not cursor:
+                break
+
+        assert [o['price'] for o in seen] == ['58.50', '59.00', '60.00', '60.00', '61.00']
+        assert len({o['id'] for o in seen}) == len(prices)
+
+    def test_invalid_cursor(self):
+        """❌ Test 6: a broken cursor is rejected"""
+        response = APIClient().get(PUBLIC_URL, {'trade_type': 'SELL', 'cursor': 'not-a-cursor'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_payment_type_filter_and_render(self, seller_client):
+        """💳 Test 7: payment types are stored with the offer, filtered and rendered without the main db"""
+        client, seller, payment_method = seller_client
+        wallet_method = PaymentMethods.objects.create(
+            user=seller, payment_method_id='VF_BOOK', type='Vodafone Cash', number='01000000000'
+        )
+        bank_offer = self.create_offer(client, payment_method.id, '60.00')
+        self.create_offer(client, wallet_method.id, '61.00')
+        assert OfferPaymentMethod.objects.get(offer=bank_offer).payment_type == 'BANK_TRANSFER'
+        self.get_feed('SELL')
+
+        with CaptureQueriesContext(connections['main_db']) as ctx:
+            offers = self.get_feed('SELL', payment_type='vodafone cash')
+
+        assert [o['price'] for o in offers] == ['61.00']
+        assert offers[0]['payment_methods'] == ['Vodafone Cash']
+        assert not [q for q in ctx.captured_queries if 'payment_methods' in q['sql']]
+
+    def test_feed_response_cache(self, seller_client, buyer_client):
+        """🗄️ Test 8: a hot pair is served from the response cache and every write is seen at once"""
+        client, _, payment_method = seller_client
+        buyer, _ = buyer_client
+        offer = self.create_offer(client, payment_method.id, '60.00')
+        self.get_feed('SELL')
+
+        with CaptureQueriesContext(connections['default']) as ctx:
+            assert len(self.get_feed('SELL')) == 1
+        assert not ctx.captured_queries
+
+        # order creation changes the pair version, the cached page is not used anymore
+        response = buyer.post('/api/p2p/orders/', {"offer_id": offer.id, "fiat_amount": "600"}, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        assert self.get_feed('SELL')[0]['available_amount'] == '90.00000000'
+
+        self.create_offer(client, payment_method.id, '59.00')
+        assert [o['price'] for o in self.get_feed('SELL')] == ['59.00', '60.00']
+
+    def test_counterparty_eligibility(self, seller_client, buyer_client):
+        """🛂 Test 9: signed in viewers only see and take the offers they meet the restrictions of"""
+        client, _, payment_method = seller_client
+        buyer, buyer_user = buyer_client
+        open_offer = self.create_offer(client, payment_method.id, '60.00')
+        data = {
+            "trade_type": "SELL", "crypto_currency": self.DEFAULT_CRYPTO, "fiat_currency": self.DEFAULT_FIAT,
+            "price_type": "FIXED", "price": "59.00", "total_amount": "100", "min_order_limit": "100",
+            "max_order_limit": "1000", "payment_method_ids": [payment_method.id],
+            "counterparty_min_holding_amount": "1000"
+        }
+        assert client.post('/api/p2p/offers/', data, format='json').status_code == status.HTTP_201_CREATED
+        restricted = P2POffer.objects.get(price=Decimal('59.00'))
+        params = {'trade_type': 'SELL', 'crypto_currency': self.DEFAULT_CRYPTO, 'fiat_currency': self.DEFAULT_FIAT}
+
+        # anonymous feed is not filtered
+        assert [o['id'] for o in self.get_feed('SELL')] == [restricted.id, open_offer.id]
+        response = buyer.get(PUBLIC_URL, params)
+        assert [o['id'] for o in response.data['data']] == [open_offer.id]
+        assert response.data['count'] == 1
+
+        response = buyer.post('/api/p2p/orders/', {"offer_id": restricted.id, "fiat_amount": "590"}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        rich = User.objects.create_user(username='book_rich', password='pass123')
+        Wallet.objects.create(user_id=rich.id, currency=self.DEFAULT_CRYPTO, balance=Decimal('2000'))
+        rich_client = APIClient()
+        rich_client.force_authenticate(user=rich)
+        response = rich_client.get(PUBLIC_URL, params)
+        assert [o['id'] for o in response.data['data']] == [restricted.id, open_offer.id]
+
+    def test_blocked_users(self, monkeypatch, seller_client, buyer_client):
+        """🚫 Test 10: offers of the users on either side of a block are hidden and cannot be taken"""
+        client, seller, payment_method = seller_client
+        buyer, buyer_user = buyer_client
+        offer = self.create_offer(client, payment_method.id, '60.00')
+        params = {'trade_type': 'SELL', 'crypto_currency': self.DEFAULT_CRYPTO, 'fiat_currency': self.DEFAULT_FIAT}
+        assert [o['id'] for o in buyer.get(PUBLIC_URL, params).data['data']] == [offer.id]
+
+        # the seller blocks the buyer, the buyer does not see the seller offers anymore
+        response = client.post('/api/p2p/profiles/block-user/', {'user_id': buyer_user.id}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        response = buyer.get(PUBLIC_URL, params)
+        assert response.data['data'] == []
+        assert response.data['count'] == 0
+        assert [o['id'] for o in self.get_feed('SELL')] == [offer.id]
+
+        # the intake checks the block in the database, a stale cached set of another worker lets nothing through
+        cache.set(BLOCK_SET_KEY(buyer_user.id), frozenset())
+        response = buyer.post('/api/p2p/orders/', {"offer_id": offer.id, "fiat_amount": "600"}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'You cannot trade with this user' in str(response.data)
+        assert not P2POrder.objects.exists()
+        # a set loaded before the block committed does not replace the one the block wrote meanwhile
+        def stale_load(user_id):
+            cache.set(BLOCK_SET_KEY(user_id), frozenset([seller.id]))
+            return frozenset()
+
+        cache.delete(BLOCK_SET_KEY(buyer_user.id))
+        monkeypatch.setattr(BLOCK_CACHE, '_load', stale_load)
+        BLOCK_CACHE.get(buyer_user.id)
+        monkeypatch.undo()
+        assert BLOCK_CACHE.get(buyer_user.id) == {seller.id}
+
+        response = client.post('/api/p2p/profiles/unblock-user/', {'user_id': buyer_user.id}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert [o['id'] for o in buyer.get(PUBLIC_URL, params).data['data']] == [offer.id]
+        response = buyer.post('/api/p2p/orders/', {"offer_id": offer.id, "fiat_amount": "600"}, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
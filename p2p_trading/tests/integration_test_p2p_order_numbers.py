@@ -0,0 +1,163 @@
+# tests/integration_test_p2p_order_numbers.py
+
+import multiprocessing
+import pytest
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.utils import timezone
+from p2p_trading.models import Wallet, P2POffer, P2POrder, P2POrderWorker
+from p2p_trading.engines.p2p_order_number import (
+    ORDER_NUMBERS, OrderNumberAllocator, PARSE_ORDER_NUMBER, MAX_SEQUENCE, NUMBER_DIGITS
+)
+
+User = get_user_model()
+
+PROCESSES = 4
+ORDERS_PER_PROCESS = 25000
+
+
+def create_orders(worker_id, offer_id, maker_id, taker_id, queue, orders=ORDERS_PER_PROCESS):
+    """child process, numbers the orders with the process allocator and inserts them
+    worker_id None: no P2P_ORDER_WORKER_ID, the process claims its id"""
+    settings.P2P_ORDER_WORKER_ID = worker_id if worker_id is not None else ''
+    now = timezone.now()
+    numbers = [ORDER_NUMBERS.next() for _ in range(orders)]
+    P2POrder.objects.bulk_create([
+        P2POrder(order_number=number, offer_id=offer_id, maker_id=maker_id, taker_id=taker_id, trade_type='SELL',
+                 crypto_currency='USDT', fiat_currency='EGP', price=Decimal('50'), crypto_amount=Decimal('1'),
+                 fiat_amount=Decimal('50'), payment_time_limit=now)
+        for number in numbers
+    ], batch_size=5000)
+    connections.close_all()
+    queue.put((worker_id, numbers == sorted(numbers), {PARSE_ORDER_NUMBER(n)[1] for n in numbers}))
+
+
+def create_offer(maker):
+    return P2POffer.objects.create(
+        user_id=maker.id, trade_type='SELL', crypto_currency='USDT', fiat_currency='EGP', price_type='FIXED',
+        price=Decimal('50'), total_amount=Decimal('1000'), available_amount=Decimal('1000'),
+        min_order_limit=Decimal('10'), max_order_limit=Decimal('1000'),
+    )
+
+
+@pytest.mark.django_db(databases=['default', 'main_db'], transaction=True)
+class TestP2POrderNumbersIntegration:
+    """order numbers stay unique across processes"""
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, db):
+        P2POrder.objects.all().delete()
+        P2POrderWorker.objects.all().delete()
+        P2POffer.objects.all().delete()
+        Wallet.objects.all().delete()
+        User.objects.all().delete()
+
+    def test_multiprocess_orders_have_no_collision(self):
+        """🧾 Test 1: 4 processes create 100k orders, the unique order_number index never fails"""
+        maker = User.objects.create_user(username='numbers_maker', password='pass123')
+        taker = User.objects.create_user(username='numbers_taker', password='pass123')
+        offer = create_offer(maker)
+        # the children open their own connections
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [
+            context.Process(target=create_orders, args=(worker_id, offer.id, maker.id, taker.id, queue))
+            for worker_id in range(1, PROCESSES + 1)
+        ]
+        for worker in workers:
+            worker.start()
+        results = [queue.get(timeout=300) for _ in workers]
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+
+        assert sorted(worker_id for worker_id, _, _ in results) == list(range(1, PROCESSES + 1))
+        for worker_id, ordered, worker_ids in results:
+            assert ordered
+            assert worker_ids == {worker_id}
+
+        numbers = list(P2POrder.objects.values_list('order_number', flat=True))
+        assert len(numbers) == PROCESSES * ORDERS_PER_PROCESS
+        assert len(set(numbers)) == len(numbers)
+        assert all(12 <= len(number) <= 20 and number.isdigit() for number in numbers)
+
+    def test_allocator_sequence_clock_and_worker_claim(self, monkeypatch, settings):
+        """🔢 Test 2: sequence overflow and a clock going back never repeat a number, claimed ids differ"""
+        allocator = OrderNumberAllocator(worker_id=7)
+        clock = iter([1_800_000_000_000] * (MAX_SEQUENCE + 1) + [1_800_000_000_000, 1_800_000_000_001]
+                     + [1_799_999_999_000, 1_800_000_000_001, 1_800_000_000_002])
+        monkeypatch.setattr(allocator, '_now', lambda: next(clock))
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+
+        numbers = [allocator.next() for _ in range(MAX_SEQUENCE + 3)]
+        assert len(set(numbers)) == len(numbers) and numbers == sorted(numbers)
+        assert all(len(number) == NUMBER_DIGITS for number in numbers)
+        assert PARSE_ORDER_NUMBER(numbers[-2]) == (1_800_000_000_001, 7, 0)
+        # the last number came after the clock went back a second
+        assert PARSE_ORDER_NUMBER(numbers[-1]) == (1_800_000_000_001, 7, 1)
+
+        settings.P2P_ORDER_WORKER_ID = ''
+        monkeypatch.delenv('P2P_ORDER_WORKER_ID', raising=False)
+        first, second = OrderNumberAllocator(), OrderNumberAllocator()
+        assert first.worker_id != second.worker_id
+        assert set(P2POrderWorker.objects.values_list('worker_id', flat=True)) >= {first.worker_id, second.worker_id}
+
+        # the lease of first ran out and another process took its id: the next number is built with a new id
+        lost = first.worker_id
+        P2POrderWorker.objects.filter(worker_id=lost).update(token='another process')
+        first._renew_at = 0.0
+        number = first.next()
+        assert PARSE_ORDER_NUMBER(number)[1] == first.worker_id != lost
+        assert P2POrderWorker.objects.get(worker_id=lost).token == 'another process'
+        # a renewal due on an id still held keeps it
+        second_id, second._renew_at = second.worker_id, 0.0
+        assert PARSE_ORDER_NUMBER(second.next())[1] == second_id
+        assert second._renew_at > 0
+
+        maker = User.objects.create_user(username='numbers_saver', password='pass123')
+        taker = User.objects.create_user(username='numbers_buyer', password='pass123')
+        offer = P2POffer.objects.create(
+            user_id=maker.id, trade_type='SELL', crypto_currency='USDT', fiat_currency='EGP', price_type='FIXED',
+            price=Decimal('50'), total_amount=Decimal('10'), available_amount=Decimal('10'),
+            min_order_limit=Decimal('10'), max_order_limit=Decimal('100'),
+        )
+        order = P2POrder.objects.create(
+            offer=offer, maker_id=maker.id, taker_id=taker.id, trade_type='SELL', crypto_currency='USDT',
+            fiat_currency='EGP', price=Decimal('50'), crypto_amount=Decimal('1'), fiat_amount=Decimal('50'),
+            payment_time_limit=timezone.now()
+        )
+        assert len(order.order_number) == NUMBER_DIGITS
+
+    def test_multiprocess_orders_claim_their_worker_ids(self, monkeypatch):
+        """🪪 Test 3: without P2P_ORDER_WORKER_ID the processes claim different ids, the numbers never collide"""
+        monkeypatch.delenv('P2P_ORDER_WORKER_ID', raising=False)
+        maker = User.objects.create_user(username='claims_maker', password='pass123')
+        taker = User.objects.create_user(username='claims_taker', password='pass123')
+        offer = create_offer(maker)
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [
+            context.Process(target=create_orders, args=(None, offer.id, maker.id, taker.id, queue, 5000))
+            for _ in range(PROCESSES)
+        ]
+        for worker in workers:
+            worker.start()
+        results = [queue.get(timeout=300) for _ in workers]
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+
+        claimed = [worker_ids for _, _, worker_ids in results]
+        assert all(len(worker_ids) == 1 for worker_ids in claimed)
+        assert len(set.union(*claimed)) == PROCESSES
+        assert set.union(*claimed) <= set(P2POrderWorker.objects.values_list('worker_id', flat=True))
+        assert all(ordered for _, ordered, _ in results)
+
+        numbers = list(P2POrder.objects.values_list('order_number', flat=True))
+        assert len(numbers) == len(set(numbers)) == PROCESSES * 5000
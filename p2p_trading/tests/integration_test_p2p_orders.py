@@ -1,11 +1,40 @@
 # tests/integration_test_p2p_orders.py
 
+import asyncio
+import json
 import pytest
+import threading
+import time
+from datetime import timedelta
 from decimal import Decimal
+from io import StringIO
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
-from p2p_trading.models import Wallet, P2POffer, P2POrder
+from rest_framework.exceptions import ValidationError
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from p2p_trading.models import (Wallet, P2POffer, P2POrder, P2PProfile, Transaction, OutboxEvent, OutboxCheckpoint,
+                                JournalEntry, Posting, EscrowCheck, EscrowDrift)
+from p2p_trading.engines.p2p_escrow_checker import ESCROW_CHECKER
+from p2p_trading.engines.p2p_expiry_sweeper import EXPIRY_SWEEPER
+from p2p_trading.engines.p2p_ledger_reconciler import LEDGER_RECONCILER
+from p2p_trading.engines.p2p_outbox_relay import OUTBOX_RELAY
+from p2p_trading.engines.p2p_order_stream import ORDER_STREAM
+from p2p_trading.controllers.p2p_order_stream_controller import OrderStreamRouter
+from rest_framework_simplejwt.tokens import AccessToken
+from p2p_trading.services.p2p_order_service import P2POrderService
+from p2p_trading.services.p2p_wallet_service import WalletService
+from p2p_trading.services.p2p_provisioning_service import ProvisioningService
+from p2p_trading.repositories.p2p_journal_repository import P2PJournalRepository
+from p2p_trading.constants.constant import TransactionType, LedgerAccount
+from p2p_trading.helpers import ESCROW_RELEASE_ENTRY
 from MainDashboard.models import PaymentMethods
 
 User = get_user_model()
@@ -24,6 +53,8 @@ class TestP2POrdersIntegration:
     @pytest.fixture(autouse=True)
     def setup_method(self, db):
         """تنظيف قاعدة البيانات قبل كل test"""
+        OutboxEvent.objects.all().delete()
+        OutboxCheckpoint.objects.all().delete()
         P2POrder.objects.all().delete()
         P2POffer.objects.all().delete()
         Wallet.objects.all().delete()
@@ -626,4 +657,669 @@ class TestP2POrdersIntegration:
         # محاولة بدون trailing slash
         response2 = client.post('/api/p2p/orders', order_data, format='json')
         # يجب أن يعمل أو يعطي redirect
-        assert response2.status_code in [200, 201, 301, 302]
\ No newline at end of file
+        assert response2.status_code in [200, 201, 301, 302]
+
+    def test_counterparty_names_batched(self, auth_seller_client):
+        """⚡ Test 22: the order pages resolve all the counterparty nicknames with one query"""
+        client, seller, offer, _ = auth_seller_client
+
+        def add_buyers(count):
+            for _ in range(count):
+                index = P2PProfile.objects.count()
+                buyer = User.objects.create_user(username=f'batch_buyer{index}', password='pass123')
+                P2PProfile.objects.create(user_id=buyer.id, nickname=f'batch_buyer{index}')
+                buyer_client = APIClient()
+                buyer_client.force_authenticate(user=buyer)
+                response = buyer_client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount='100'),
+                                             format='json')
+                assert response.status_code == status.HTTP_201_CREATED
+
+        def queries(url):
+            cache.clear()
+            with CaptureQueriesContext(connections['default']) as ctx:
+                response = client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            return len(ctx.captured_queries), response.data['data']
+
+        add_buyers(2)
+        small = {url: queries(url)[0] for url in ('/api/p2p/orders/', '/api/p2p/orders/processing/')}
+        add_buyers(4)
+        for url, count in small.items():
+            assert queries(url)[0] == count
+        _, orders = queries('/api/p2p/orders/processing/')
+        assert sorted(order['counterparty'] for order in orders) == [f'batch_buyer{i}' for i in range(6)]
+
+        # a second page read is served from the nickname cache
+        with CaptureQueriesContext(connections['default']) as ctx:
+            client.get('/api/p2p/orders/processing/')
+        assert not any('p2p_profile' in query['sql'] for query in ctx.captured_queries)
+
+    def test_order_history_keyset_pages(self, auth_seller_client):
+        """📜 Test 23: the order list pages the maker and taker orders of every status newest first"""
+        client, seller, offer, _ = auth_seller_client
+        other = User.objects.create_user(username='history_other', password='pass123')
+        now = timezone.now()
+        statuses = ['UNPAID', 'PAID', 'APPEAL', 'COMPLETED', 'CANCELLED']
+        # orders 2 and 3 share the same time, the id breaks the tie
+        minutes_ago = [0, 1, 2, 2, 3, 4, 5]
+        for i in range(7):
+            # the seller is maker of the even orders and taker of the odd ones
+            maker, taker = (seller.id, other.id) if i % 2 == 0 else (other.id, seller.id)
+            order = P2POrder.objects.create(
+                order_number=f'HIST{i:04d}', offer=offer, maker_id=maker, taker_id=taker, status=statuses[i % 5],
+                trade_type='SELL', crypto_currency=self.DEFAULT_CRYPTO, fiat_currency=self.DEFAULT_FIAT,
+                price=Decimal(self.DEFAULT_PRICE), crypto_amount=Decimal('1'), fiat_amount=Decimal('60.4'),
+                payment_time_limit=now
+            )
+            P2POrder.objects.filter(id=order.id).update(created_at=now - timedelta(minutes=minutes_ago[i]))
+        expected = list(P2POrder.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': 3, **({'cursor': cursor} if cursor else {})}
+            with CaptureQueriesContext(connections['default']) as ctx:
+                response = client.get('/api/p2p/orders/', params)
+            assert response.status_code == status.HTTP_200_OK
+            assert response.data['count'] == 7
+            assert any('UNION ALL' in query['sql'] for query in ctx.captured_queries)
+            seen += [int(order['id']) for order in response.data['data']]
+            cursor = response.data.get('next_cursor')
+            if not cursor:
+                break
+        assert seen == expected
+
+        response = client.get('/api/p2p/orders/', {'order_type': 'buy'})
+        assert response.data['data'] == [] and response.data['count'] == 0
+        assert client.get('/api/p2p/orders/', {'cursor': 'broken'}).status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_expiry_sweeper_releases_offer_and_escrow(self, auth_buyer_client, seller_with_wallet_and_offer):
+        """⏰ Test 24: expired UNPAID orders are cancelled in chunks and their reservations are freed"""
+        client, buyer, _ = auth_buyer_client
+        seller, offer, _ = seller_with_wallet_and_offer
+        wallet_before = Wallet.objects.get(user_id=seller.id, currency=self.DEFAULT_CRYPTO)
+
+        for amount in ('500', '300', '200'):
+            response = client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount=amount),
+                                   format='json')
+            assert response.status_code == status.HTTP_201_CREATED
+        orders = list(P2POrder.objects.order_by('id'))
+        expired, alive = orders[:2], orders[2]
+        P2POrder.objects.filter(id__in=[o.id for o in expired]).update(
+            payment_time_limit=timezone.now() - timedelta(minutes=1)
+        )
+
+        result = EXPIRY_SWEEPER.sweep(chunk_size=1)
+        assert result['orders'] == 2 and result['chunks'] == 2
+        assert EXPIRY_SWEEPER.metrics['last_pass'] == result
+
+        assert set(P2POrder.objects.filter(status='CANCELLED').values_list('id', flat=True)) == {o.id for o in expired}
+        assert P2POrder.objects.get(id=alive.id).status == 'UNPAID'
+        offer.refresh_from_db()
+        assert offer.available_amount == Decimal(self.DEFAULT_AMOUNT) - alive.crypto_amount
+        wallet = Wallet.objects.get(id=wallet_before.id)
+        assert wallet.locked_balance == wallet_before.locked_balance + alive.crypto_amount
+        assert wallet.balance == wallet_before.balance - alive.crypto_amount
+        cancels = Transaction.objects.filter(transaction_type='CANCEL_ESCROW', wallet=wallet)
+        assert {t.related_order_id for t in cancels} == {o.id for o in expired}
+        assert max(t.running_balance for t in cancels) == wallet.balance
+
+        # nothing left to expire
+        assert EXPIRY_SWEEPER.sweep()['orders'] == 0
+
+    def test_order_intake_is_fused_and_deadlock_free(self, auth_buyer_client, seller_with_wallet_and_offer):
+        """🔒 Test 25: a refused order writes nothing, parallel takers never deadlock nor oversell"""
+        client, _, _ = auth_buyer_client
+        seller, offer, _ = seller_with_wallet_and_offer
+        Wallet.objects.filter(user_id=seller.id).update(balance=Decimal('1'))
+
+        response = client.post('/api/p2p/orders/', self.create_order_data(offer.id), format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'Failed to lock funds' in str(response.data)
+        assert not P2POrder.objects.exists() and not Transaction.objects.exists()
+        offer.refresh_from_db()
+        assert offer.available_amount == Decimal(self.DEFAULT_AMOUNT)
+
+        out = StringIO()
+        call_command('benchmark_order_intake', takers=[1, 8], orders=5, capacity=0.5, stdout=out)
+        assert 'no deadlock and no oversell' in out.getvalue()
+        assert ' 8 takers: 20 created, 20 refused' in out.getvalue()
+
+    def test_conditional_reservation_path(self, settings, auth_buyer_client, seller_with_wallet_and_offer):
+        """🎯 Test 26: the conditional updates take the offer and the escrow amounts, refusals roll both back"""
+        settings.P2P_ORDER_RESERVATION = 'conditional'
+        client, buyer, _ = auth_buyer_client
+        seller, offer, _ = seller_with_wallet_and_offer
+        Wallet.objects.filter(user_id=seller.id).update(balance=Decimal('20'))
+        # 10 USDT for the first order, the seller wallet (20) can lock half of its balance only
+        fiat = str(Decimal(self.DEFAULT_PRICE) * 10)
+
+        response = client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount=fiat), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        order = P2POrder.objects.get()
+        offer.refresh_from_db()
+        wallet = Wallet.objects.get(user_id=seller.id)
+        assert offer.available_amount == Decimal(self.DEFAULT_AMOUNT) - order.crypto_amount
+        assert (wallet.balance, wallet.locked_balance) == (Decimal('10'), Decimal('10'))
+        escrow = Transaction.objects.get(related_order=order)
+        assert escrow.transaction_type == 'LOCK_ESCROW' and escrow.running_balance == wallet.balance
+
+        # the wallet cannot lock more, the amount taken from the offer is rolled back
+        response = client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount='200'), format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'Failed to lock funds' in str(response.data)
+        assert P2POrder.objects.count() == 1 and Transaction.objects.count() == 1
+        assert P2POffer.objects.get(id=offer.id).available_amount == offer.available_amount
+
+        # the last amount of the offer sells it out in the same statement
+        Wallet.objects.filter(user_id=seller.id).update(balance=Decimal('10000'))
+        P2POffer.objects.filter(id=offer.id).update(available_amount=Decimal('5'))
+        fiat = str(Decimal(self.DEFAULT_PRICE) * 5)
+        response = client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount=fiat), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        offer.refresh_from_db()
+        assert offer.available_amount == 0 and offer.status == 'COMPLETED'
+
+    def test_racing_transitions_apply_once(self, auth_buyer_client, auth_seller_client):
+        """🏁 Test 27: confirm and cancel racing on a paid order, exactly one wins with its wallet side effects"""
+        buyer_client, buyer, _ = auth_buyer_client
+        seller_client, seller, offer, _ = auth_seller_client
+        wallet_before = Wallet.objects.get(user_id=seller.id, currency=self.DEFAULT_CRYPTO)
+
+        response = buyer_client.post('/api/p2p/orders/', self.create_order_data(offer.id), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        order = P2POrder.objects.get()
+        assert order.version == 0
+
+        # a stale version is refused, the current one moves the order
+        response = buyer_client.post(f'/api/p2p/orders/{order.id}/mark-as-paid/', {'version': 5}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'version' in str(response.data)
+        response = buyer_client.post(f'/api/p2p/orders/{order.id}/mark-as-paid/', {'version': 0}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['data']['version'] == 1
+
+        barrier = threading.Barrier(2)
+        outcomes = {}
+
+        def race(name, action):
+            barrier.wait()
+            try:
+                outcomes[name] = action(seller.id, order.id).status
+            except ValidationError as e:
+                outcomes[name] = str(e.detail)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=race, args=('confirm', P2POrderService.confirm_payment_received)),
+            threading.Thread(target=race, args=('cancel', P2POrderService.cancel_order)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        order.refresh_from_db()
+        assert order.version == 2
+        assert sorted(outcomes.values()).count(order.status) == 1
+        wallet = Wallet.objects.get(id=wallet_before.id)
+        offer.refresh_from_db()
+        if order.status == 'COMPLETED':
+            assert 'Cannot cancel this order' in outcomes['cancel']
+            assert wallet.balance == wallet_before.balance - order.crypto_amount and wallet.locked_balance == 0
+            assert Wallet.objects.get(user_id=buyer.id, currency=self.DEFAULT_CRYPTO).balance == order.crypto_amount
+            assert offer.available_amount == Decimal(self.DEFAULT_AMOUNT) - order.crypto_amount
+        else:
+            assert 'Order is not marked as paid' in outcomes['confirm']
+            assert (wallet.balance, wallet.locked_balance) == (wallet_before.balance, 0)
+            assert offer.available_amount == Decimal(self.DEFAULT_AMOUNT)
+        assert Transaction.objects.filter(related_order=order).count() == (3 if order.status == 'COMPLETED' else 2)
+
+    def test_outbox_events_are_relayed_in_order(self, auth_buyer_client, auth_seller_client):
+        """📬 Test 28: every committed transition writes its event, the relay delivers them in order at least once"""
+        buyer_client, buyer, _ = auth_buyer_client
+        seller_client, seller, offer, _ = auth_seller_client
+
+        response = buyer_client.post('/api/p2p/orders/', self.create_order_data(offer.id), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        order = P2POrder.objects.get()
+        # refused changes write no event
+        response = buyer_client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount='5000'),
+                                     format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        response = seller_client.post(f'/api/p2p/orders/{order.id}/mark-as-paid/')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert buyer_client.post(f'/api/p2p/orders/{order.id}/mark-as-paid/').status_code == status.HTTP_200_OK
+        assert seller_client.post(f'/api/p2p/orders/{order.id}/confirm-payment/').status_code == status.HTTP_200_OK
+
+        events = list(OutboxEvent.objects.all())
+        assert [e.event_type for e in events] == ['order.created', 'order.paid', 'order.completed']
+        assert {e.aggregate_id for e in events} == {order.id}
+        assert [e.payload['version'] for e in events] == [0, 1, 2]
+        assert Decimal(events[2].payload['crypto_amount']) == order.crypto_amount
+
+        delivered, flaky = [], []
+
+        def failing_once(event):
+            flaky.append(event.event_type)
+            if flaky.count('order.paid') == 1 and event.event_type == 'order.paid':
+                raise RuntimeError('consumer down')
+
+        OUTBOX_RELAY.register('test_log', lambda event: delivered.append(event.event_type))
+        OUTBOX_RELAY.register('test_flaky', failing_once, event_types={'order.paid', 'order.completed'})
+        try:
+            totals = OUTBOX_RELAY.relay(batch_size=2)
+            assert delivered == ['order.created', 'order.paid', 'order.completed']
+            assert totals['test_log'] == {'read': 3, 'delivered': 3, 'failed': None}
+            # the failed event stops the consumer at its checkpoint, created was filtered out
+            assert totals['test_flaky']['delivered'] == 0 and 'consumer down' in totals['test_flaky']['failed']
+            metrics = OUTBOX_RELAY.metrics['consumers']
+            assert metrics['test_log']['lag_events'] == 0
+            assert metrics['test_flaky']['lag_events'] == 2 and metrics['test_flaky']['lag_seconds'] > 0
+            checkpoint = OutboxCheckpoint.objects.get(consumer='test_flaky')
+            assert (checkpoint.transaction_id, checkpoint.event_id) == (events[0].transaction_id, events[0].id)
+
+            # the next pass delivers the failed event again, then the rest in order
+            totals = OUTBOX_RELAY.relay()
+            assert flaky == ['order.paid', 'order.paid', 'order.completed']
+            assert totals['test_flaky'] == {'read': 2, 'delivered': 2, 'failed': None}
+            assert totals['test_log']['read'] == 0 and len(delivered) == 3
+            assert metrics['test_flaky']['lag_events'] == 0 and metrics['test_flaky']['failed'] == 1
+
+            # a consumer registered after the pass has no checkpoint yet, it keeps every event
+            OUTBOX_RELAY.register('test_late', lambda event: None)
+            assert OUTBOX_RELAY.prune(timezone.now() + timedelta(seconds=1)) == 0
+            assert OutboxEvent.objects.count() == 3
+            OUTBOX_RELAY.relay()
+
+            # delivered events can be pruned once every consumer passed them
+            assert OUTBOX_RELAY.prune(timezone.now() + timedelta(seconds=1)) == 3
+        finally:
+            OUTBOX_RELAY.unregister('test_log')
+            OUTBOX_RELAY.unregister('test_flaky')
+            OUTBOX_RELAY.unregister('test_late')
+
+    def test_order_status_is_pushed_to_subscribers(self, settings, auth_buyer_client, auth_seller_client):
+        """📡 Test 29: websocket and SSE subscribers of both sides receive the committed status changes"""
+        settings.SIMPLE_JWT = {**settings.SIMPLE_JWT, 'SIGNING_KEY': 'stream-test-key', 'VERIFYING_KEY': None}
+        buyer_client, buyer, _ = auth_buyer_client
+        seller_client, seller, offer, _ = auth_seller_client
+        router = OrderStreamRouter(None)
+
+        def post(client, url):
+            try:
+                return client.post(url, format='json')
+            finally:
+                connections.close_all()
+
+        async def scenario():
+            buyer_receive, seller_receive = asyncio.Queue(), asyncio.Queue()
+            buyer_sent, seller_sent = asyncio.Queue(), asyncio.Queue()
+            buyer_receive.put_nowait({'type': 'websocket.connect'})
+            seller_receive.put_nowait({'type': 'http.request', 'body': b'', 'more_body': False})
+            buyer_task = asyncio.ensure_future(router(
+                {'type': 'websocket', 'path': '/ws/p2p/orders/', 'headers': [],
+                 'query_string': f'token={AccessToken.for_user(buyer)}'.encode()},
+                buyer_receive.get, buyer_sent.put))
+            seller_task = asyncio.ensure_future(router(
+                {'type': 'http', 'method': 'GET', 'path': '/api/p2p/orders/stream/', 'query_string': b'',
+                 'headers': [(b'authorization', f'Bearer {AccessToken.for_user(seller)}'.encode())]},
+                seller_receive.get, seller_sent.put))
+            next_event = lambda sent: asyncio.wait_for(sent.get(), timeout=5)
+
+            assert (await next_event(buyer_sent))['type'] == 'websocket.accept'
+            assert (await next_event(seller_sent))['status'] == 200
+            assert json.loads((await next_event(buyer_sent))['text'])['type'] == 'subscribed'
+            assert b'event: subscribed' in (await next_event(seller_sent))['body']
+            assert ORDER_STREAM.subscribers(buyer.id) == 1 and ORDER_STREAM.subscribers(seller.id) == 1
+
+            response = await sync_to_async(post, thread_sensitive=False)(
+                buyer_client, f'/api/p2p/orders/{order.id}/mark-as-paid/')
+            assert response.status_code == status.HTTP_200_OK
+            pushed = json.loads((await next_event(buyer_sent))['text'])
+            assert (pushed['order_id'], pushed['status'], pushed['version']) == (order.id, 'PAID', 1)
+            event = (await next_event(seller_sent))['body'].decode()
+            assert event.startswith('event: order.status') and '"status": "PAID"' in event
+
+            # a refused transition pushes nothing
+            response = await sync_to_async(post, thread_sensitive=False)(
+                buyer_client, f'/api/p2p/orders/{order.id}/mark-as-paid/')
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+            await asyncio.sleep(0.1)
+            assert buyer_sent.empty() and seller_sent.empty()
+
+            buyer_receive.put_nowait({'type': 'websocket.disconnect'})
+            seller_receive.put_nowait({'type': 'http.disconnect'})
+            await asyncio.gather(buyer_task, seller_task)
+            assert ORDER_STREAM.subscribers(buyer.id) == 0 and ORDER_STREAM.subscribers(seller.id) == 0
+
+            # a bad token is refused before any subscription
+            refused = asyncio.Queue()
+            refused.put_nowait({'type': 'websocket.connect'})
+            sent = []
+            await router({'type': 'websocket', 'path': '/ws/p2p/orders/', 'headers': [], 'query_string': b'token=bad'},
+                         refused.get, lambda event: asyncio.sleep(0, sent.append(event)))
+            assert sent == [{'type': 'websocket.close', 'code': 4401}]
+
+        response = buyer_client.post('/api/p2p/orders/', self.create_order_data(offer.id), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        order = P2POrder.objects.get()
+        asyncio.run(scenario())
+
+        out = StringIO()
+        call_command('benchmark_order_stream', subscribers=500, messages=200, idle=0.1, stdout=out)
+        assert '500 idle subscribers held by one worker' in out.getvalue()
+
+    def test_order_counters_move_with_the_orders(self, auth_buyer_client, auth_seller_client):
+        """🔢 Test 30: per-status counters from one GROUP BY, then moved by the changes without a query"""
+        buyer_client, buyer, _ = auth_buyer_client
+        seller_client, seller, offer, _ = auth_seller_client
+        cache.clear()
+
+        for amount in ('500', '300', '200'):
+            response = buyer_client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount=amount),
+                                         format='json')
+            assert response.status_code == status.HTTP_201_CREATED
+        first, second, third = P2POrder.objects.order_by('id')
+
+        with CaptureQueriesContext(connections['default']) as ctx:
+            response = buyer_client.get('/api/p2p/orders/counters/')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['data']['statuses']['UNPAID'] == 3
+        assert (response.data['data']['processing'], response.data['data']['total']) == (3, 3)
+        assert sum('GROUP BY' in query['sql'] for query in ctx.captured_queries) == 1
+        assert seller_client.get('/api/p2p/orders/counters/').data['data']['statuses']['UNPAID'] == 3
+
+        # every kind of change moves the cached counters of both sides
+        assert buyer_client.post(f'/api/p2p/orders/{first.id}/mark-as-paid/').status_code == status.HTTP_200_OK
+        assert seller_client.post(f'/api/p2p/orders/{first.id}/confirm-payment/').status_code == status.HTTP_200_OK
+        assert seller_client.post(f'/api/p2p/orders/{second.id}/cancel/').status_code == status.HTTP_200_OK
+        # a refused transition moves nothing
+        assert seller_client.post(f'/api/p2p/orders/{second.id}/cancel/').status_code == status.HTTP_400_BAD_REQUEST
+        P2POrder.objects.filter(id=third.id).update(payment_time_limit=timezone.now() - timedelta(minutes=1))
+        assert EXPIRY_SWEEPER.sweep()['orders'] == 1
+
+        expected = {'UNPAID': 0, 'PAID': 0, 'APPEAL': 0, 'COMPLETED': 1, 'CANCELLED': 2}
+        for client in (buyer_client, seller_client):
+            with CaptureQueriesContext(connections['default']) as ctx:
+                response = client.get('/api/p2p/orders/counters/')
+            assert not any('GROUP BY' in query['sql'] for query in ctx.captured_queries)
+            assert response.data['data']['statuses'] == expected
+            assert (response.data['data']['completed'], response.data['data']['total']) == (3, 3)
+
+        # the list count comes from the counters, a filtered list is counted in the database
+        with CaptureQueriesContext(connections['default']) as ctx:
+            response = buyer_client.get('/api/p2p/orders/')
+        assert response.data['count'] == 3
+        assert not any('COUNT(' in query['sql'] for query in ctx.captured_queries)
+        response = buyer_client.get('/api/p2p/orders/', {'coin': 'BTC'})
+        assert response.data['count'] == 0
+
+    def test_wallet_mutations_are_atomic_in_the_database(self, auth_seller_client):
+        """🧮 Test 31: the deltas are applied by the database, a change breaking a balance rule is refused"""
+        _, seller, _, _ = auth_seller_client
+        wallet = Wallet.objects.get(user_id=seller.id, currency=self.DEFAULT_CRYPTO)
+        before = (wallet.balance, wallet.locked_balance)
+
+        # balance below zero, then more locked than held: nothing changes
+        for balance_delta, locked_delta in ((-before[0] - 1, 0), (-before[0] / 2, before[0])):
+            with pytest.raises(ValueError):
+                WalletService.mutate_wallet(seller.id, self.DEFAULT_CRYPTO, balance_delta, locked_delta,
+                                            TransactionType.LOCK_ESCROW)
+        wallet.refresh_from_db()
+        assert (wallet.balance, wallet.locked_balance) == before
+        assert not Transaction.objects.filter(wallet=wallet).exists()
+
+        # the running balance is the one returned by the update, not the one read before
+        Wallet.objects.filter(id=wallet.id).update(balance=before[0] + 100)
+        stale = Wallet.objects.get(id=wallet.id)
+        Wallet.objects.filter(id=wallet.id).update(balance=before[0] + 200)
+        locked = WalletService.mutate_wallet(seller.id, self.DEFAULT_CRYPTO, Decimal('-50'), Decimal('50'),
+                                             TransactionType.LOCK_ESCROW)
+        assert (locked.balance, locked.locked_balance) == (before[0] + 150, Decimal('50'))
+        assert stale.balance == before[0] + 100
+        wallet = WalletService.mutate_wallet(seller.id, self.DEFAULT_CRYPTO, Decimal('5'), 0, TransactionType.DEPOSIT)
+        assert Transaction.objects.get(wallet=wallet, transaction_type='DEPOSIT').running_balance == before[0] + 155
+
+        out = StringIO()
+        call_command('benchmark_wallet_mutations', writers=[1, 4], mutations=10, stdout=out)
+        assert 'no lost update and exact running balances' in out.getvalue()
+
+    def test_journal_entries_balance_and_batch_the_settlement(self, auth_buyer_client, auth_seller_client):
+        """📒 Test 32: every escrow step is one balanced journal entry, a settlement is two round trips"""
+        buyer_client, buyer, _ = auth_buyer_client
+        _, seller, offer, _ = auth_seller_client
+        response = buyer_client.post('/api/p2p/orders/', self.create_order_data(offer.id), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        order = P2POrder.objects.get()
+        amount = order.crypto_amount
+        Wallet.objects.create(user_id=buyer.id, currency=self.DEFAULT_CRYPTO)
+
+        # in the transaction of the confirmation: the buyer wallet read, then one statement for the wallets, the
+        # entry, its postings and the transactions
+        with transaction.atomic(), CaptureQueriesContext(connections['default']) as ctx:
+            WalletService.release_funds_to_buyer(order)
+        assert len(ctx.captured_queries) == 2
+
+        entries = JournalEntry.objects.filter(related_order=order)
+        assert list(entries.values_list('event_type', flat=True)) == ['LOCK_ESCROW', 'RELEASE_ESCROW']
+        assert P2PJournalRepository.get_unbalanced_entries() == []
+        seller_wallet = Wallet.objects.get(user_id=seller.id, currency=self.DEFAULT_CRYPTO)
+        buyer_wallet = Wallet.objects.get(user_id=buyer.id, currency=self.DEFAULT_CRYPTO)
+        postings = lambda wallet, account: sum(
+            Posting.objects.filter(wallet=wallet, account=account).values_list('amount', flat=True)
+        )
+        assert (postings(seller_wallet, LedgerAccount.BALANCE), postings(seller_wallet, LedgerAccount.LOCKED)) == (-amount, 0)
+        assert (postings(buyer_wallet, LedgerAccount.BALANCE), buyer_wallet.balance) == (amount, amount)
+        # the release is recorded with its amount, not 0
+        release = Transaction.objects.get(related_order=order, transaction_type=TransactionType.RELEASE_ESCROW)
+        assert (release.amount, release.running_balance) == (-amount, seller_wallet.balance)
+
+        # a second release finds no escrow: refused, nothing written
+        with pytest.raises(ValueError):
+            WalletService.release_funds_to_buyer(order)
+        assert entries.count() == 2
+        assert Wallet.objects.get(id=buyer_wallet.id).balance == amount
+        # an entry that does not balance never reaches the database
+        with pytest.raises(ValueError):
+            WalletService.post_entries([(TransactionType.DEPOSIT, None, ESCROW_RELEASE_ENTRY(
+                order.id, seller.id, buyer.id, self.DEFAULT_CRYPTO, amount)[2][:1])], 'refused')
+
+    def test_ledger_reconciliation_reports_the_drift(self, auth_buyer_client, auth_seller_client):
+        """🧾 Test 33: the wallets recomputed from their history match, a drifted row is reported"""
+        buyer_client, buyer, _ = auth_buyer_client
+        seller_client, seller, offer, _ = auth_seller_client
+        # the fixture wallets have no history, their balances come in as deposits
+        for wallet in Wallet.objects.all():
+            Wallet.objects.filter(id=wallet.id).update(balance=0)
+            WalletService.mutate_wallet(wallet.user_id, wallet.currency, wallet.balance, 0, TransactionType.DEPOSIT)
+        seller_wallet = Wallet.objects.get(user_id=seller.id, currency=self.DEFAULT_CRYPTO)
+
+        for amount in ('500', '300'):
+            response = buyer_client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount=amount),
+                                         format='json')
+            assert response.status_code == status.HTTP_201_CREATED
+        first, second = P2POrder.objects.order_by('id')
+        assert buyer_client.post(f'/api/p2p/orders/{first.id}/mark-as-paid/').status_code == status.HTTP_200_OK
+        assert seller_client.post(f'/api/p2p/orders/{first.id}/confirm-payment/').status_code == status.HTTP_200_OK
+        assert seller_client.post(f'/api/p2p/orders/{second.id}/cancel/').status_code == status.HTTP_200_OK
+        # a release written with an amount of 0 before the journal takes the amount of its order
+        Transaction.objects.filter(transaction_type=TransactionType.RELEASE_ESCROW).update(amount=0)
+
+        out = StringIO()
+        call_command('reconcile_wallets', workers=2, range_size=1, chunk_size=2, stdout=out)
+        assert 'every wallet matches its transaction history' in out.getvalue()
+
+        # a wallet changed behind the ledger, and a history row with a wrong running balance
+        buyer_wallet = Wallet.objects.get(user_id=buyer.id, currency=self.DEFAULT_CRYPTO)
+        Wallet.objects.filter(id=buyer_wallet.id).update(balance=buyer_wallet.balance + 1)
+        lock = Transaction.objects.get(related_order=second, transaction_type=TransactionType.LOCK_ESCROW)
+        Transaction.objects.filter(id=lock.id).update(running_balance=lock.running_balance + 7)
+        result = LEDGER_RECONCILER.reconcile(workers=2, range_size=1, chunk_size=2)
+        assert (result['wallets'], result['transactions'], result['found']) == (3, 7, 2)
+        assert {(row['wallet_id'], row['kind'], row['transaction_id']) for row in result['discrepancies']} == {
+            (buyer_wallet.id, 'balance', None), (seller_wallet.id, 'running_balance', lock.id),
+        }
+        with pytest.raises(CommandError):
+            call_command('reconcile_wallets', stdout=StringIO())
+
+    def test_escrow_checker_finds_and_repairs_drift(self, auth_buyer_client, auth_seller_client):
+        """🔐 Test 34: locked balances diffed against the open orders, incrementally, repaired with a journal entry"""
+        buyer_client, buyer, _ = auth_buyer_client
+        seller_client, seller, offer, _ = auth_seller_client
+        for amount in ('500', '300'):
+            response = buyer_client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount=amount),
+                                         format='json')
+            assert response.status_code == status.HTTP_201_CREATED
+        first, second = P2POrder.objects.order_by('id')
+        assert seller_client.post(f'/api/p2p/orders/{second.id}/cancel/').status_code == status.HTTP_200_OK
+        assert ESCROW_CHECKER.run()['drifts'] == []
+
+        # 5 stuck in the escrow behind the ledger: the wallet row is not touched, an incremental run skips it
+        wallet = Wallet.objects.get(user_id=seller.id, currency=self.DEFAULT_CRYPTO)
+        Wallet.objects.filter(id=wallet.id).update(balance=F('balance') + 5, locked_balance=F('locked_balance') + 5)
+        result = ESCROW_CHECKER.run(incremental=True)
+        assert (result['mode'], result['drifts']) == ('incremental', [])
+        # the order moving touches its seller
+        assert buyer_client.post(f'/api/p2p/orders/{first.id}/mark-as-paid/').status_code == status.HTTP_200_OK
+        with CaptureQueriesContext(connections['default']) as ctx:
+            result = ESCROW_CHECKER.run(incremental=True)
+        assert sum('GROUP BY' in query['sql'] for query in ctx.captured_queries) == 1
+        assert [(drift['wallet_id'], drift['expected'], drift['actual']) for drift in result['drifts']] == [
+            (wallet.id, first.crypto_amount, first.crypto_amount + 5)
+        ]
+        with pytest.raises(CommandError):
+            call_command('check_escrow', stdout=StringIO())
+
+        # the repair gives the 5 back to the balance with one balanced entry, kept with the drift
+        out = StringIO()
+        call_command('check_escrow', repair=True, stdout=out)
+        assert 'every locked balance matches the open orders' in out.getvalue()
+        drift = EscrowDrift.objects.get(repair_entry__isnull=False)
+        assert (drift.wallet_id, drift.actual - drift.expected, drift.repair_entry.event_type) == (
+            wallet.id, 5, TransactionType.CANCEL_ESCROW
+        )
+        wallet.refresh_from_db()
+        assert (wallet.locked_balance, P2PJournalRepository.get_unbalanced_entries()) == (first.crypto_amount, [])
+        assert ESCROW_CHECKER.run()['drifts'] == []
+        assert EscrowCheck.objects.filter(finished_at__isnull=False).count() == 6
+
+    def test_bulk_provisioning_of_profiles_and_wallets(self, monkeypatch):
+        """🏗️ Test 35: the missing profiles and wallets of many users, one read and one insert per chunk"""
+        users = [User.objects.create_user(username=f'bulk{n}', password='pass123') for n in range(5)]
+        # one user is half set up already, another one's nickname is taken
+        P2PProfile.objects.create(user_id=users[0].id, nickname='bulk0_p2p')
+        Wallet.objects.create(user_id=users[0].id, currency='USDT', balance=Decimal('7'))
+        P2PProfile.objects.create(user_id=users[4].id + 1000, nickname='bulk4_p2p')
+
+        with CaptureQueriesContext(connections['default']) as ctx:
+            call_command('provision_users', user_ids=[user.id for user in users], chunk_size=2, stdout=StringIO())
+        # 3 chunks of: profiles read, insert, read again (taken nicknames), wallets read, insert
+        statements = [
+            query['sql'].split()[0] for query in ctx.captured_queries if query['sql'] not in ('BEGIN', 'COMMIT')
+        ]
+        assert statements == ['SELECT', 'INSERT', 'SELECT', 'SELECT', 'INSERT'] * 3
+        profiles = P2PProfile.objects.filter(user_id__in=[user.id for user in users])
+        assert set(profiles.values_list('user_id', flat=True)) == {user.id for user in users[:4]}
+        assert Wallet.objects.filter(user_id__in=[user.id for user in users]).count() == 15
+        assert Wallet.objects.get(user_id=users[0].id, currency='USDT').balance == Decimal('7')
+
+        # a second run creates nothing, an opening balance comes in through the journal
+        out = StringIO()
+        call_command('provision_users', user_ids=[user.id for user in users], stdout=out)
+        assert '0 profiles and 0 wallets created' in out.getvalue()
+        newcomer = User.objects.create_user(username='newcomer', password='pass123')
+        assert ProvisioningService.provision_wallets([newcomer.id], ['USDT'], opening_balance=5000) == 1
+        wallet = Wallet.objects.get(user_id=newcomer.id)
+        deposit = Transaction.objects.get(wallet=wallet)
+        assert (wallet.balance, deposit.transaction_type, deposit.running_balance) == (5000, 'DEPOSIT', 5000)
+
+        # a wallet another writer created between the read and the insert is neither counted nor funded
+        racer = User.objects.create_user(username='racer', password='pass123')
+        stale = ProvisioningService.wallets.get_missing_wallets([racer.id], ['USDT', 'BTC'])
+        Wallet.objects.create(user_id=racer.id, currency='USDT', balance=Decimal('3'))
+        monkeypatch.setattr(ProvisioningService.wallets, 'get_missing_wallets', lambda user_ids, currencies: stale)
+        assert ProvisioningService.provision_wallets([racer.id], ['USDT', 'BTC'], opening_balance=10) == 1
+        balances = dict(Wallet.objects.filter(user_id=racer.id).values_list('currency', 'balance'))
+        assert balances == {'USDT': Decimal('3'), 'BTC': Decimal('10')}
+        assert P2PJournalRepository.get_unbalanced_entries() == []
+
+    def test_expiry_sweeper_skips_an_order_with_a_short_escrow(self, auth_buyer_client, seller_with_wallet_and_offer):
+        """🧯 Test 36: one order whose escrow is short stays UNPAID, the rest of its chunk is cancelled"""
+        client, _, _ = auth_buyer_client
+        seller, offer, _ = seller_with_wallet_and_offer
+        for amount in ('500', '300', '200'):
+            response = client.post('/api/p2p/orders/', self.create_order_data(offer.id, fiat_amount=amount),
+                                   format='json')
+            assert response.status_code == status.HTTP_201_CREATED
+        first, second, short = P2POrder.objects.order_by('id')
+        for minutes, order in enumerate((short, second, first), start=1):
+            P2POrder.objects.filter(id=order.id).update(payment_time_limit=timezone.now() - timedelta(minutes=minutes))
+        # the escrow of the last order to expire is gone from the seller wallet
+        Wallet.objects.filter(user_id=seller.id, currency=self.DEFAULT_CRYPTO).update(
+            locked_balance=first.crypto_amount + second.crypto_amount
+        )
+
+        result = EXPIRY_SWEEPER.sweep(chunk_size=3)
+        assert (result['orders'], result['chunks'], result['refused']) == (2, 1, [short.id])
+        statuses = dict(P2POrder.objects.values_list('id', 'status'))
+        assert statuses == {first.id: 'CANCELLED', second.id: 'CANCELLED', short.id: 'UNPAID'}
+        wallet = Wallet.objects.get(user_id=seller.id, currency=self.DEFAULT_CRYPTO)
+        assert wallet.locked_balance == 0
+        offer.refresh_from_db()
+        assert offer.available_amount == Decimal(self.DEFAULT_AMOUNT) - short.crypto_amount
+        assert OutboxEvent.objects.filter(event_type='order.cancelled').count() == 2
+
+        # the refused order is tried again by the next pass, and no chunk is blocked by it
+        result = EXPIRY_SWEEPER.sweep(chunk_size=1)
+        assert (result['orders'], result['refused']) == (0, [short.id])
+        assert EXPIRY_SWEEPER.metrics['refused'] >= 2
+
+    def test_expiry_sweeper_and_intake_lock_in_the_same_order(self, monkeypatch, auth_buyer_client,
+                                                                seller_with_wallet_and_offer):
+        """🔐 Test 37: a sweep and an intake on the same offer and seller wait on each other, never in a cycle"""
+        client, buyer, _ = auth_buyer_client
+        seller, offer, _ = seller_with_wallet_and_offer
+        response = client.post('/api/p2p/orders/', self.create_order_data(offer.id), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        expired = P2POrder.objects.get()
+        P2POrder.objects.filter(id=expired.id).update(payment_time_limit=timezone.now() - timedelta(minutes=1))
+
+        # the intake holds the offer and waits before it takes the seller wallet, the sweep starts meanwhile
+        offer_locked = threading.Event()
+        lock_seller_wallet = WalletService.lock_seller_wallet
+
+        def slow_lock_seller_wallet(seller_id, currency, amount):
+            offer_locked.set()
+            time.sleep(1.5)
+            return lock_seller_wallet(seller_id, currency, amount)
+
+        monkeypatch.setattr(WalletService, 'lock_seller_wallet', staticmethod(slow_lock_seller_wallet))
+        outcomes = {}
+
+        def run(name, action):
+            try:
+                outcomes[name] = action()
+            except Exception as e:
+                outcomes[name] = e
+            finally:
+                connections.close_all()
+
+        intake = threading.Thread(target=run, args=(
+            'intake', lambda: P2POrderService.create_locked_order(buyer.id, offer.id, Decimal('300'))))
+        sweep = threading.Thread(target=run, args=('sweep', EXPIRY_SWEEPER.sweep))
+        intake.start()
+        assert offer_locked.wait(5)
+        sweep.start()
+        intake.join()
+        sweep.join()
+
+        assert isinstance(outcomes['intake'], P2POrder), outcomes['intake']
+        assert isinstance(outcomes['sweep'], dict) and outcomes['sweep']['orders'] == 1, outcomes['sweep']
+        created = P2POrder.objects.get(id=outcomes['intake'].id)
+        assert dict(P2POrder.objects.values_list('id', 'status')) == {expired.id: 'CANCELLED', created.id: 'UNPAID'}
+        wallet = Wallet.objects.get(user_id=seller.id, currency=self.DEFAULT_CRYPTO)
+        assert wallet.locked_balance == created.crypto_amount
+        assert wallet.balance + wallet.locked_balance == Decimal('5000.00')
+        offer.refresh_from_db()
+        assert offer.available_amount == Decimal(self.DEFAULT_AMOUNT) - created.crypto_amount
@@ -0,0 +1,132 @@
+# tests/integration_test_p2p_price_engine.py
+
+import json
+import pytest
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from rest_framework import status
+from p2p_trading.models import Wallet, P2POffer, P2POrder
+from p2p_trading.engines.p2p_order_book_engine import ORDER_BOOK
+from p2p_trading.engines.p2p_price_engine import PRICE_ENGINE, ReferencePriceFeed
+from p2p_trading.repositories.p2p_offer_repository import P2POfferRepository
+from MainDashboard.models import PaymentMethods
+
+User = get_user_model()
+
+PUBLIC_URL = '/api/p2p/offers/public_offers/'
+
+
+@pytest.mark.django_db(databases=['default', 'main_db'], transaction=True)
+class TestP2PPriceEngineIntegration:
+    """Integration tests for the floating price repricing"""
+
+    @pytest.fixture(autouse=True)
+    def setup_method(self, db, settings, tmp_path):
+        """clean the database and point the feed to a temporary file"""
+        P2POrder.objects.all().delete()
+        P2POffer.objects.all().delete()
+        Wallet.objects.all().delete()
+        PaymentMethods.objects.all().delete()
+        User.objects.all().delete()
+        ORDER_BOOK.warm(force=True)
+
+        self.feed_file = tmp_path / 'prices.json'
+        settings.P2P_PRICE_FEED_FILE = str(self.feed_file)
+        self.set_index_price('50.00')
+
+    def set_index_price(self, price):
+        self.feed_file.write_text(json.dumps({'USDT': {'EGP': price}}))
+        PRICE_ENGINE.refresh()
+
+    @pytest.fixture
+    def seller_client(self):
+        seller = User.objects.create_user(username='float_seller', password='pass123')
+        Wallet.objects.create(user_id=seller.id, currency='USDT', balance=Decimal('5000'))
+        payment_method = PaymentMethods.objects.create(
+            user=seller, payment_method_id='BANK_FLOAT', type='BANK_TRANSFER',
+            number='1234567890', holder_name='Float Seller', primary=True
+        )
+        client = APIClient()
+        client.force_authenticate(user=seller)
+        return client, payment_method
+
+    def create_floating_offer(self, client, payment_method_id, margin):
+        data = {
+            "trade_type": "SELL",
+            "crypto_currency": "USDT",
+            "fiat_currency": "EGP",
+            "price_type": "FLOATING",
+            "price": "1.00",
+            "price_margin": margin,
+            "total_amount": "100",
+            "min_order_limit": "100",
+            "max_order_limit": "1000",
+            "payment_method_ids": [payment_method_id],
+            "payment_time_limit_minutes": 30
+        }
+        response = client.post('/api/p2p/offers/', data, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        return P2POffer.objects.latest('id')
+
+    def test_reprice_pair(self, seller_client):
+        """📈 Test 1: one pass reprices every floating offer and the feed follows"""
+        client, payment_method = seller_client
+        up = self.create_floating_offer(client, payment_method.id, '2.50')
+        down = self.create_floating_offer(client, payment_method.id, '-1.33')
+        # created at the current index price
+        assert up.price == Decimal('51.25')
+        assert down.price == Decimal('49.34')
+
+        self.set_index_price('60.00')
+        assert PRICE_ENGINE.reprice_pair(('USDT', 'EGP')) == 2
+
+        up.refresh_from_db()
+        down.refresh_from_db()
+        assert up.price == Decimal('61.50')
+        assert down.price == Decimal('59.20')
+        # nothing changed, nothing written
+        assert PRICE_ENGINE.reprice_pair(('USDT', 'EGP')) == 0
+
+        response = APIClient().get(PUBLIC_URL, {'trade_type': 'SELL', 'crypto_currency': 'USDT',
+                                                'fiat_currency': 'EGP'})
+        assert [o['price'] for o in response.data['data']] == ['59.20', '61.50']
+
+        # a P2P_PRICE_FEED class without fetch() fails when it is built, not on the first repricing
+        with pytest.raises(TypeError):
+            type('IncompleteFeed', (ReferencePriceFeed,), {})()
+
+    def test_order_uses_effective_price(self, settings, seller_client):
+        """💱 Test 2: an order is taken at the price the feed shows, on both reservation paths"""
+        client, payment_method = seller_client
+        offer = self.create_floating_offer(client, payment_method.id, '2.50')
+        buyer = User.objects.create_user(username='float_buyer', password='pass123')
+        buyer_client = APIClient()
+        buyer_client.force_authenticate(user=buyer)
+
+        def feed_price():
+            response = APIClient().get(PUBLIC_URL, {'trade_type': 'SELL', 'crypto_currency': 'USDT',
+                                                    'fiat_currency': 'EGP'})
+            return Decimal(response.data['data'][0]['price'])
+
+        # the index moved but no repricing pass ran yet, the feed still shows the stored price
+        self.set_index_price('40.00')
+        for reservation in ('lock', 'conditional'):
+            settings.P2P_ORDER_RESERVATION = reservation
+            response = buyer_client.post('/api/p2p/orders/', {"offer_id": offer.id, "fiat_amount": "512.50"},
+                                         format='json')
+            assert response.status_code == status.HTTP_201_CREATED
+            order = P2POrder.objects.filter(offer=offer).latest('id')
+            assert order.price == feed_price() == Decimal('51.25')
+            assert order.crypto_amount == Decimal('10')
+
+        # once repriced, the feed and the orders move together, an intake that read the old price is refused
+        stale = P2POffer.objects.get(id=offer.id)
+        PRICE_ENGINE.reprice_pair(('USDT', 'EGP'))
+        assert P2POfferRepository.reserve_available_amount(stale, Decimal('1')) is None
+        response = buyer_client.post('/api/p2p/orders/', {"offer_id": offer.id, "fiat_amount": "410"},
+                                     format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        order = P2POrder.objects.filter(offer=offer).latest('id')
+        assert order.price == feed_price() == Decimal('41.00')
+        assert order.crypto_amount == Decimal('10')